@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import pathlib
+import platform
+import tempfile
+import datetime
+import subprocess
+import contextlib
+import numpy as np
+
+# Add the src directory and the directories of the benchmarked scripts to the path
+SRC_DIR = pathlib.Path(__file__).parent.parent
+sys.path.append(os.path.abspath(SRC_DIR))
+sys.path.append(os.path.abspath(SRC_DIR / "simulator"))
+sys.path.append(os.path.abspath(SRC_DIR / "tester"))
+from tools.swf_reader import ReaderSWF
+from tools.swf_generator import generate_swf, write_deployment
+import tester
+from simulator import Simulator, PHASES
+from regressor.regressor import Regressor, DATA_SET_DTYPE, FUNCTIONS
+
+# Predefined paths (enable the script to be run from anywhere in the project)
+BENCHMARK_DIR = pathlib.Path(__file__).parent
+RESULTS_DIR = BENCHMARK_DIR / "results"
+
+BENCHMARK_PARAMETERS = {
+    "number-of-jobs": [10_000, 100_000],
+    "number-of-processors": 256,
+    "number-of-tuples": 2,
+    "number-of-trials": [4096, 16_384],
+    "size-of-S": 16,
+    "size-of-Q": 32,
+    "batch-size": 4096,
+    "number-of-samples": [100_000, 1_000_000],
+    "number-of-experiments": 4,
+    "policies": ["FCFS", "SPT", "LIN"],
+    "sim-types": ["ESTIMATED", "BACKFILLING"],
+    "repeat": 3,
+    "seed": 0,
+}
+
+# A throughput lower than the baseline by more than this fraction is reported as a regression
+TOLERANCE = 0.1
+
+
+def time_call(function, repeat):
+    """
+    Call a function repeat times.
+
+    Returns
+    -------
+    tuple
+        The shortest time of a call (in seconds) and the result of the last call.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def make_result(stage, size, seconds, count, unit):
+    return {"stage": stage, "size": size, "seconds": seconds, "throughput": count / seconds, "unit": unit}
+
+
+def generate_data_set(filename, number_of_samples, number_of_processors, seed):
+    """
+    Write a synthetic training data set (a .npy file with the fields of DATA_SET_DTYPE) whose scores
+    grow with the area of the jobs, as the scores of the simulator do.
+    """
+    rng = np.random.default_rng(seed)
+    data_set = np.empty(number_of_samples, dtype=DATA_SET_DTYPE)
+    data_set["p"] = np.clip(rng.lognormal(7, 1.5, number_of_samples), 1, 172800)
+    data_set["q"] = rng.integers(1, number_of_processors + 1, number_of_samples)
+    data_set["r"] = rng.integers(0, 86400, number_of_samples)
+    area = data_set["p"].astype(np.double) * data_set["q"]
+    data_set["score"] = 1e-6 * area + rng.normal(0, 1, number_of_samples)
+    np.save(filename, data_set)
+
+
+def benchmark_swf_parse(workload, number_of_jobs, repeat):
+    parse_time, _ = time_call(lambda: ReaderSWF(workload, cache=False), repeat)
+    # The first cached read writes the cache, the next ones only map it
+    ReaderSWF(workload)
+    cached_time, _ = time_call(lambda: ReaderSWF(workload), repeat)
+    return [
+        make_result("swf-parse", number_of_jobs, parse_time, number_of_jobs, "jobs/s"),
+        make_result("swf-cached-read", number_of_jobs, cached_time, number_of_jobs, "jobs/s"),
+    ]
+
+
+def benchmark_simulator(workload, deployment, directory, number_of_trials, parameters):
+    """
+    Time the phases of Simulator.simulate_tuple with the python trial engine, on files kept in the
+    given directory instead of the directories of the simulator.
+    """
+    simulator = Simulator(
+        workload,
+        deployment,
+        None,
+        parameters["number-of-tuples"],
+        number_of_trials,
+        parameters["size-of-S"],
+        parameters["size-of-Q"],
+        True,
+        engine="python",
+        batch_size=parameters["batch-size"],
+    )
+    simulator.use_output_dir(directory)
+    simulator.use_scratch_dir(directory)
+
+    times = dict.fromkeys(PHASES, 0.0)
+    number_of_scheduled_trials = 0
+    for tuple_index in range(simulator.number_of_tuples):
+        tuple_metrics = simulator.simulate_tuple(tuple_index)
+        for phase in PHASES:
+            times[phase] += tuple_metrics["phases"][phase]
+        number_of_scheduled_trials += tuple_metrics["trials"]
+
+    number_of_tuples = simulator.number_of_tuples
+    return [
+        make_result("tuple-generation", number_of_trials, times["store_tuple"], number_of_tuples, "tuples/s"),
+        make_result("initial-state", number_of_trials, times["create_initial_state"], number_of_tuples, "tuples/s"),
+        make_result("trials", number_of_trials, times["schedule_trials"], number_of_scheduled_trials, "trials/s"),
+        make_result("score-distribution", number_of_trials, times["compute_AVGbsld"], number_of_tuples, "tuples/s"),
+        make_result("save-scores", number_of_trials, times["save_score_distribution"], number_of_tuples, "tuples/s"),
+    ]
+
+
+def benchmark_regression(data_file, number_of_samples, repeat):
+    # Every degree is fitted alone, so its time does not include the smaller ones
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        report_file = pathlib.Path(directory) / "report.json"
+        for function in FUNCTIONS:
+            fit_time, _ = time_call(lambda: Regressor(data_file, [function]).regression(report_file), repeat)
+            stage = f"regression-{function.__name__}"
+            results.append(make_result(stage, number_of_samples, fit_time, number_of_samples, "samples/s"))
+    return results
+
+
+def benchmark_tester(workload, deployment, directory, parameters):
+    """
+    Time tester.workload_experiments with the python backend on the synthetic trace, writing the
+    slowdowns to the given directory instead of the directory of the tester.
+    """
+    experiments_dir = tester.EXPERIMENTS_DIR
+    tester.traces["SYNTHETIC"] = [workload, deployment, parameters["number-of-experiments"]]
+    tester.EXPERIMENTS_DIR = directory
+    results = []
+    try:
+        for sim_type in parameters["sim-types"]:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                seconds, _ = time_call(
+                    lambda: tester.workload_experiments(
+                        ["SYNTHETIC"], parameters["policies"], [sim_type], backend="python", cache_file=None
+                    ),
+                    parameters["repeat"],
+                )
+            # A window per row (the tester warns when the trace holds fewer than the number of experiments)
+            slowdowns_file = next(directory.glob(f"SYNTHETIC_{sim_type}_*.csv"))
+            with open(slowdowns_file, "r") as slowdowns:
+                number_of_windows = sum(1 for _ in slowdowns) - 1
+            results.append(
+                make_result(f"tester-{sim_type.lower()}", number_of_windows, seconds, number_of_windows, "windows/s")
+            )
+    finally:
+        tester.EXPERIMENTS_DIR = experiments_dir
+        del tester.traces["SYNTHETIC"]
+    return results
+
+
+def get_commit():
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, cwd=SRC_DIR
+        )
+    except OSError:
+        return None
+    return output.stdout.strip() or None
+
+
+def run_benchmarks(parameters=BENCHMARK_PARAMETERS, results_dir=RESULTS_DIR):
+    """
+    Run every benchmark on synthetic workloads generated in a temporary directory and write the
+    results to a JSON file of results_dir.
+
+    Parameters
+    ----------
+    parameters : dict
+        The sizes of the benchmarks, as in BENCHMARK_PARAMETERS. The simulator and the tester use
+        the largest trace.
+    results_dir : str
+        The directory of the results file.
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the results file.
+    """
+    repeat = parameters["repeat"]
+    number_of_processors = parameters["number-of-processors"]
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        deployment = directory / "deployment.xml"
+        write_deployment(deployment, number_of_processors)
+
+        for number_of_jobs in parameters["number-of-jobs"]:
+            workload = directory / f"synthetic-{number_of_jobs}.swf"
+            generate_swf(workload, number_of_jobs, number_of_processors, seed=parameters["seed"])
+            print(f"Benchmarking the SWF reader on {number_of_jobs} jobs...")
+            results += benchmark_swf_parse(workload, number_of_jobs, repeat)
+
+        for number_of_trials in parameters["number-of-trials"]:
+            print(f"Benchmarking the simulator with {number_of_trials} trials per tuple...")
+            simulator_dir = directory / f"simulator-{number_of_trials}"
+            simulator_dir.mkdir()
+            results += benchmark_simulator(workload, deployment, simulator_dir, number_of_trials, parameters)
+
+        for number_of_samples in parameters["number-of-samples"]:
+            print(f"Benchmarking the regression on {number_of_samples} samples...")
+            data_file = directory / f"data-set-{number_of_samples}.npy"
+            generate_data_set(data_file, number_of_samples, number_of_processors, parameters["seed"])
+            results += benchmark_regression(data_file, number_of_samples, repeat)
+
+        print(f"Benchmarking the tester on {parameters['number-of-experiments']} experiments...")
+        tester_dir = directory / "tester"
+        tester_dir.mkdir()
+        results += benchmark_tester(workload, deployment, tester_dir, parameters)
+
+    created = datetime.datetime.now()
+    report = {
+        "created": created.isoformat(timespec="seconds"),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu-count": os.cpu_count(),
+        "parameters": parameters,
+        "results": results,
+    }
+
+    results_file = pathlib.Path(results_dir) / f"benchmark-{created:%Y%m%d-%H%M%S}.json"
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, "w+") as report_file:
+        json.dump(report, report_file, indent=4)
+    return results_file
+
+
+def compare_results(baseline_file, current_file, tolerance=TOLERANCE):
+    """
+    Compare the throughputs of two results files, matching the results by stage and size.
+
+    Returns
+    -------
+    list
+        The (stage, size, baseline throughput, current throughput) of the results whose throughput
+        dropped by more than the tolerance.
+    """
+    with open(baseline_file, "r") as baseline:
+        baseline_results = {(result["stage"], result["size"]): result for result in json.load(baseline)["results"]}
+    with open(current_file, "r") as current:
+        current_results = json.load(current)["results"]
+
+    regressions = []
+    for result in current_results:
+        key = (result["stage"], result["size"])
+        if key not in baseline_results:
+            continue
+        baseline_throughput = baseline_results[key]["throughput"]
+        if result["throughput"] < (1 - tolerance) * baseline_throughput:
+            regressions.append((*key, baseline_throughput, result["throughput"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    # Without arguments the benchmarks are run, with two results files they are compared
+    if len(sys.argv) == 3:
+        regressions = compare_results(sys.argv[1], sys.argv[2])
+        for stage, size, baseline_throughput, throughput in regressions:
+            change = throughput / baseline_throughput - 1
+            print(f"{stage} ({size}): {baseline_throughput:.6g} -> {throughput:.6g} ({change:+.1%})")
+        sys.exit(1 if regressions else 0)
+
+    results_file = run_benchmarks()
+    with open(results_file, "r") as report_file:
+        for result in json.load(report_file)["results"]:
+            print(f"{result['stage']} ({result['size']}): {result['throughput']:.6g} {result['unit']}")
+    print(f"Benchmark results saved to '{results_file}'")
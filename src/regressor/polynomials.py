@@ -1,63 +1,249 @@
+import re
+import sys
+import pathlib
+import numpy as np
+
 def lin(x, t0, t1, t2, t3):
-    p, q, r = x
-    lin_term = (t0 + t1*p + t2*q + t3*r)
-    return lin_term
+    return polynomial(x, (t0, t1, t2, t3))
 
 def qdr(x, t0, t1, t2, t3, t4, t5, t6, t7):
-    p, q, r = x
-    lin_term = lin(x, t0, t1, t2, t3)
-    sq_term = (t4*p**2 + t5*q**2 + t6*r**2) + (t7*p*q)
-
-    return lin_term + sq_term
+    return polynomial(x, (t0, t1, t2, t3, t4, t5, t6, t7))
 
 def cub(
     x, t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
     t10, t11, t12):
-    p, q, r = x
-    sq_term = qdr(x, t0, t1, t2, t3, t4, t5, t6, t7)
-    cub_term = (t8*p**3 + t9*q**3 + t10*r**3) \
-        + (t11*(p**2)*q + t12*p*(q**2))
-
-    return sq_term + cub_term
+    return polynomial(x, (
+        t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
+        t10, t11, t12))
 
 def qua(
     x, t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
     t10, t11, t12, t13, t14, t15, t16, t17, t18):
-    p, q, r = x
-    cub_term = cub(
-        x, t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
-        t10, t11, t12)
-    qua_term = (t13*p**4 + t14*q**4 + t15*r**4) \
-        + (t16*(p**3)*q + t17*(p*q)**2 + t18*p*(q**3))
-    
-    return cub_term + qua_term
+    return polynomial(x, (
+        t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
+        t10, t11, t12, t13, t14, t15, t16, t17, t18))
 
 def qui(
     x, t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
     t10, t11, t12, t13, t14, t15, t16, t17, t18, t19,
     t20, t21, t22, t23, t24, t25):
-    p, q, r = x
-    qua_term = qua(
-        x, t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
-        t10, t11, t12, t13, t14, t15, t16, t17, t18)
-    qui_term = (t19*p**5 + t20*q**5 + t21*r**5) \
-        + (t22*(p**4)*q + t23*(p**3)*(q**2) + t24*(p**2)*(q**3) \
-            + t25*p*(q**4))
-
-    return qua_term + qui_term
+    return polynomial(x, (
+        t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
+        t10, t11, t12, t13, t14, t15, t16, t17, t18, t19,
+        t20, t21, t22, t23, t24, t25))
 
 def sex(
     x, t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
     t10, t11, t12, t13, t14, t15, t16, t17, t18, t19,
     t20, t21, t22, t23, t24, t25, t26, t27, t28, t29,
     t30, t31, t32, t33):
-    p, q, r = x
-    qui_term = qui(
-        x, t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
+    return polynomial(x, (
+        t0, t1, t2, t3, t4, t5, t6, t7, t8, t9,
         t10, t11, t12, t13, t14, t15, t16, t17, t18, t19,
-        t20, t21, t22, t23, t24, t25)
-    sex_term = (t26*p**6 + t27*q**6 + t28*r**6) \
-        + (t29*(p**5)*q + t30*(p**4)*(q**2) + t31*(p*q)**3 \
-            + t32*(p**2)*(q**4) + t33*p*(q**5))
+        t20, t21, t22, t23, t24, t25, t26, t27, t28, t29,
+        t30, t31, t32, t33))
+
+# Exponents of (p, q, r) in the term of each coefficient t0..t33. Every function
+# extends the previous one, so a function with n coefficients uses the first n terms.
+EXPONENTS = [
+    (0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1),
+    (2, 0, 0), (0, 2, 0), (0, 0, 2), (1, 1, 0),
+    (3, 0, 0), (0, 3, 0), (0, 0, 3), (2, 1, 0), (1, 2, 0),
+    (4, 0, 0), (0, 4, 0), (0, 0, 4), (3, 1, 0), (2, 2, 0), (1, 3, 0),
+    (5, 0, 0), (0, 5, 0), (0, 0, 5), (4, 1, 0), (3, 2, 0), (2, 3, 0), (1, 4, 0),
+    (6, 0, 0), (0, 6, 0), (0, 0, 6), (5, 1, 0), (4, 2, 0), (3, 3, 0), (2, 4, 0), (1, 5, 0)]
+
+# Number of coefficients of each function, with the name of its copy in polynomials.c
+POLYNOMIAL_SIZES = {"lin": 4, "qdr": 8, "cub": 13, "qua": 19, "qui": 26, "sex": 34}
+C_FUNCTIONS = {"lin": "linear", "qdr": "quadratic", "cub": "cubic", "qua": "quartic", "qui": "quintic", "sex": "sextic"}
+MAX_DEGREE = max(max(exponents) for exponents in EXPONENTS)
+
+# Rows evaluated at once by evaluate_polynomials, bounding the memory of the power table
+BLOCK_SIZE = 65536
+
+# The evaluation functions of the tester are generated from EXPONENTS between these lines
+C_FILE = pathlib.Path(__file__).parent.parent / "tester" / "polynomials.c"
+BEGIN_GENERATED = "/* BEGIN GENERATED CODE: python src/regressor/polynomials.py writes the code up to END */"
+END_GENERATED = "/* END GENERATED CODE */"
+C_POWERS_PER_LINE = 3
+C_TERMS_PER_LINE = 3
+
+
+def polynomial_degree(number_of_terms):
+    return max(max(exponents) for exponents in EXPONENTS[:number_of_terms])
+
+
+def power_table(p, q, r, degree=MAX_DEGREE):
+    """
+    Compute the powers 0 to degree of p, q and r, once for all the monomials of a batch.
+
+    Every power is the previous one times the variable, as in the code generated in
+    polynomials.c, so both sides compute the same powers to the last bit.
+
+    Returns
+    -------
+    tuple
+        The lists of the powers of p, q and r: powers[0][a] is p**a.
+    """
+    powers = []
+    for variable in (p, q, r):
+        variable = np.asarray(variable, dtype=np.double)
+        variable_powers = [np.ones_like(variable), variable]
+        for _ in range(2, degree + 1):
+            variable_powers.append(variable_powers[-1] * variable)
+        powers.append(variable_powers)
+    return tuple(powers)
+
+
+def evaluate_polynomial(theta, powers):
+    """
+    Evaluate the polynomial of the first len(theta) terms of EXPONENTS on a power table.
+
+    The terms are summed in the order of EXPONENTS, each one computed as
+    theta[k] * p**a * q**b * r**c from left to right, which is the order of the code
+    generated in polynomials.c.
+    """
+    score = np.full(np.shape(powers[0][0]), theta[0], dtype=np.double)
+    term = np.empty_like(score)
+    for coefficient, exponents in zip(theta[1:], EXPONENTS[1 : len(theta)]):
+        first_factor = True
+        for exponent, variable_powers in zip(exponents, powers):
+            if exponent == 0:
+                continue
+            if first_factor:
+                np.multiply(coefficient, variable_powers[exponent], out=term)
+                first_factor = False
+            else:
+                np.multiply(term, variable_powers[exponent], out=term)
+        score += term
+    return score
+
+
+def polynomial(x, theta):
+    """Evaluate the polynomial of coefficients theta on the arrays x = (p, q, r)."""
+    return evaluate_polynomial(theta, power_table(*x, degree=polynomial_degree(len(theta))))
+
+
+def evaluate_polynomials(thetas, p, q, r, block_size=BLOCK_SIZE):
+    """
+    Evaluate several polynomials on the same rows of (p, q, r), computing the power
+    table once for each block of rows.
+
+    Parameters
+    ----------
+    thetas : list
+        The coefficients of each polynomial (the first terms of EXPONENTS).
+    p, q, r : array
+        The variables of the rows.
+    block_size : int, optional
+        The number of rows evaluated at once.
+
+    Returns
+    -------
+    array
+        A (rows, len(thetas)) matrix of the scores of each polynomial, equal to the scores
+        of evaluate_polynomial.
+    """
+    p, q, r = (np.asarray(variable, dtype=np.double) for variable in (p, q, r))
+    degree = max(polynomial_degree(len(theta)) for theta in thetas)
+    scores = np.empty((len(p), len(thetas)), order="F")
+    for start in range(0, len(p), block_size):
+        block = slice(start, start + block_size)
+        powers = power_table(p[block], q[block], r[block], degree)
+        for column, theta in enumerate(thetas):
+            scores[block, column] = evaluate_polynomial(theta, powers)
+    return scores
+
+
+def monomial_matrix(powers, number_of_terms):
+    """
+    Build the matrix of the monomials of the first number_of_terms terms of EXPONENTS
+    from a power table.
+
+    Returns
+    -------
+    array
+        A (rows, number_of_terms) matrix.
+    """
+    p_powers, q_powers, r_powers = powers
+    matrix = np.empty((len(p_powers[0]), number_of_terms))
+    for column, (p_exponent, q_exponent, r_exponent) in enumerate(EXPONENTS[:number_of_terms]):
+        np.multiply(p_powers[p_exponent], q_powers[q_exponent], out=matrix[:, column])
+        if r_exponent:
+            matrix[:, column] *= r_powers[r_exponent]
+    return matrix
+
+
+def _c_factor(variable, exponent):
+    return variable if exponent == 1 else f"{variable}{exponent}"
+
+
+def _c_function(function_index, name, number_of_terms):
+    """Write the C function of a polynomial, summing its terms as evaluate_polynomial does."""
+    degree = polynomial_degree(number_of_terms)
+    lines = [f"double {C_FUNCTIONS[name]}(double p, double q, double r)", "{"]
+    lines.append(f"    double *theta = get_theta({function_index}, &p, &r);")
+    for variable in "pqr":
+        powers = [
+            f"{variable}{exponent} = {_c_factor(variable, exponent - 1)}*{variable}" for exponent in range(2, degree + 1)
+        ]
+        if powers:
+            lines.append(f"    double {', '.join(powers)};")
+    lines.append("")
+
+    # One line for the powers of each degree and lines of C_TERMS_PER_LINE mixed terms
+    terms = {}
+    for index, exponents in enumerate(EXPONENTS[1:number_of_terms], 1):
+        factors = [_c_factor(variable, exponent) for variable, exponent in zip("pqr", exponents) if exponent]
+        kind = "powers" if len(factors) == 1 else "mixed"
+        terms.setdefault((sum(exponents), kind), []).append("*".join([f"theta[{index}]", *factors]))
+    term_lines = []
+    for key, group in terms.items():
+        per_line = C_POWERS_PER_LINE if key[1] == "powers" else C_TERMS_PER_LINE
+        term_lines += [" + ".join(group[start : start + per_line]) for start in range(0, len(group), per_line)]
+
+    lines.append("    return theta[0] \\")
+    lines += [f"            + {term_line} \\" for term_line in term_lines]
+    lines[-1] = lines[-1][: -len(" \\")] + ";"
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def generate_c_code():
+    """
+    Generate the evaluation functions of polynomials.c (linear to sextic) from EXPONENTS.
+
+    Returns
+    -------
+    str
+        The code between BEGIN_GENERATED and END_GENERATED, markers included.
+    """
+    functions = [_c_function(index, name, size) for index, (name, size) in enumerate(POLYNOMIAL_SIZES.items())]
+    return "\n\n".join([BEGIN_GENERATED, *functions, END_GENERATED])
+
+
+def render_c_file(source):
+    """Replace the generated code and the table of polynomial sizes of the source of polynomials.c."""
+    sizes = ", ".join(str(size) for size in POLYNOMIAL_SIZES.values())
+    source = re.sub(r"(polynomial_sizes\[NUMBER_OF_POLYNOMIALS\] = \{)[^}]*", rf"\g<1>{sizes}", source)
+    start = source.index(BEGIN_GENERATED)
+    end = source.index(END_GENERATED) + len(END_GENERATED)
+    return source[:start] + generate_c_code() + source[end:]
+
+
+if __name__ == "__main__":
+    # Rewrite the generated code of polynomials.c, or with --check only tell whether it is up to date
+    with open(C_FILE, "r") as c_file:
+        source = c_file.read()
+    rendered = render_c_file(source)
+
+    if "--check" in sys.argv[1:]:
+        if rendered != source:
+            print(f"'{C_FILE}' is out of date, run python {sys.argv[0]}")
+            sys.exit(1)
+        print(f"'{C_FILE}' is up to date")
+        sys.exit(0)
 
-    return qui_term + sex_term
\ No newline at end of file
+    with open(C_FILE, "w") as c_file:
+        c_file.write(rendered)
+    print(f"Generated code written to '{C_FILE}'")
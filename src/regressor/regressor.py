@@ -1,13 +1,37 @@
+import os
+import sys
 import json
+import time
+import inspect
 import pathlib
+import tempfile
 import numpy as np
+import pandas as pd
 from scipy.optimize import curve_fit
-from polynomials import *
+from concurrent.futures import ProcessPoolExecutor
+
+if __package__:
+    # Imported as regressor.regressor: share the polynomials module of the policy engine
+    from .polynomials import *
+else:
+    # Run as a script
+    from polynomials import *
+
+# Add the src directory to the path so we can import the tools
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "src")))
+from tools.training_store import TrainingStore
 
 DATA_DIR = pathlib.Path(__file__).parent.parent.parent / "data"
 SCORE_DISTRIBUTION = DATA_DIR / "scores" / "lublin-256-final-score.csv"
 REPORT_FILE = DATA_DIR / "regression_report.json"
 FUNCTIONS = [lin, qdr, cub, qua, qui, sex]
+METHOD = "lstsq"
+CHUNK_SIZE = None  # Number of samples read at a time, None reads the whole data set
+NUMBER_OF_FOLDS = None  # Number of folds of the cross-validation, None skips it
+WORKERS = 1
+CROSS_VALIDATION_BLOCK_SIZE = 262_144
+
+DATA_SET_DTYPE = np.dtype([("p", np.uintc), ("q", np.uintc), ("r", np.uintc), ("score", np.double)])
 
 
 class Regressor:
@@ -16,20 +40,43 @@ class Regressor:
     using a set of functions.
     """
 
-    def __init__(self, data_file, functions):
+    def __init__(self, data_file, functions, method="lstsq", chunk_size=None):
         """
         Initialize the regressor.
 
         Parameters
         ----------
         data_file : str
-            The path to the file containing the data set.
+            The path to the file containing the data set: a CSV file, a .npy
+            file with the fields of DATA_SET_DTYPE or the records file (.dat)
+            of a training store (both memory-mapped).
         functions : list
             The list of functions to use for the regression.
+        method : str, optional
+            "lstsq" to solve the weighted least squares problem directly (the
+            functions must be polynomials following EXPONENTS), or "curve_fit"
+            to fit each function with scipy.optimize.curve_fit.
+        chunk_size : int, optional
+            If given, the data set is never loaded as a whole: it is read from
+            the file chunk_size samples at a time, once to fit the functions
+            and once to compute their errors (lstsq method only).
         """
+        if method not in ("lstsq", "curve_fit"):
+            raise ValueError(f"Unknown regression method '{method}'")
+        if chunk_size is not None and method != "lstsq":
+            raise ValueError("Only the lstsq method can read the data set in chunks")
         self.functions = functions
-        self.data_set = self._read_data_set(data_file)
-        self.number_of_samples = self.data_set.shape[0]
+        self.method = method
+        self.data_file = data_file
+        self.chunk_size = chunk_size
+
+        if chunk_size is None:
+            self.data_set = self._read_data_set(data_file)
+            self.number_of_samples = self.data_set.shape[0]
+        else:
+            # Counted while reading the chunks
+            self.data_set = None
+            self.number_of_samples = None
 
     def _read_data_set(self, filename):
         """
@@ -45,20 +92,61 @@ class Regressor:
         array
             The data set.
         """
+        mapped_data_set = _map_data_set(filename)
+        if mapped_data_set is not None:
+            return mapped_data_set
+
         data_set = np.genfromtxt(
             filename,
             delimiter=",",
-            dtype=[np.uintc, np.uintc, np.uintc, np.double],
-            names=["p", "q", "r", "score"],
+            dtype=DATA_SET_DTYPE,
         )
         return data_set
 
-    def _compute_weights(self):
+    def _iter_chunks(self):
+        """
+        Iterate over the data set, in chunks of chunk_size samples read from
+        the file if a chunk size was given, or as a whole otherwise.
+
+        Yields
+        ------
+        array
+            A part of the data set, with the fields p, q, r and score.
+        """
+        if self.chunk_size is None:
+            yield self.data_set
+            return
+
+        mapped_data_set = _map_data_set(self.data_file)
+        if mapped_data_set is not None:
+            yield from _iter_blocks(mapped_data_set, self.chunk_size)
+            return
+
+        with pd.read_csv(
+            self.data_file,
+            header=None,
+            names=list(DATA_SET_DTYPE.names),
+            dtype={name: DATA_SET_DTYPE[name] for name in DATA_SET_DTYPE.names},
+            chunksize=self.chunk_size,
+        ) as reader:
+            for chunk in reader:
+                yield chunk.to_records(index=False)
+
+    def _compute_weights(self, data_set=None):
         """
-        Compute the weights for the regression.
+        Compute the weights for the regression (of the whole data set, or of
+        the given part of it).
         """
-        sigma = [1.0 / (p * q) for p, q in zip(self.data_set["p"], self.data_set["q"])]
-        return sigma
+        data_set = self.data_set if data_set is None else data_set
+        return 1.0 / (data_set["p"].astype(np.double) * data_set["q"])
+
+    def _get_x_data(self, data_set=None):
+        """
+        Get the variables (p, q, r) of the data set (or of the given part of
+        it) as floats, so the powers of the polynomials do not overflow.
+        """
+        data_set = self.data_set if data_set is None else data_set
+        return tuple(data_set[variable].astype(np.double) for variable in ("p", "q", "r"))
 
     def _fit_function(self, function):
         """
@@ -76,7 +164,7 @@ class Regressor:
         """
         optimal_parameters, optimal_covariance = curve_fit(
             function,
-            (self.data_set["p"], self.data_set["q"], self.data_set["r"]),
+            self._get_x_data(),
             self.data_set["score"],
             sigma=self._compute_weights(),
             absolute_sigma=True,
@@ -100,11 +188,282 @@ class Regressor:
         array
             The predicted values of y.
         """
-        p = lambda x: function(x, *optimal_parameters)
-        x_data = zip(self.data_set["p"], self.data_set["q"], self.data_set["r"])
-        predicted_y = np.array([p(x) for x in x_data])
+        return function(self._get_x_data(), *optimal_parameters)
+
+    def _get_number_of_coefficients(self, function):
+        """
+        Get the number of coefficients of a function (all its arguments but x).
+        """
+        return len(inspect.signature(function).parameters) - 1
+
+    def _check_polynomial(self, function):
+        """
+        Check that a function is the polynomial given by the first terms of
+        EXPONENTS, which the lstsq method relies on.
+
+        Parameters
+        ----------
+        function : function
+            The function to check.
+        """
+        number_of_coefficients = self._get_number_of_coefficients(function)
+        generator = np.random.default_rng(0)
+        x = tuple(generator.uniform(0.5, 2.0, 8) for _ in range(3))
+        coefficients = generator.uniform(-1.0, 1.0, number_of_coefficients)
+
+        if number_of_coefficients <= len(EXPONENTS):
+            expected = self._design_matrix(x, number_of_coefficients) @ coefficients
+            if np.allclose(function(x, *coefficients), expected):
+                return
+        raise ValueError(
+            f"'{function.__name__}' is not a polynomial following EXPONENTS, use the curve_fit method to fit it"
+        )
+
+    def _design_matrix(self, x, number_of_coefficients):
+        """
+        Build the matrix of the monomials of (p, q, r) for the first
+        coefficients of EXPONENTS.
+
+        Parameters
+        ----------
+        x : tuple
+            The arrays of p, q and r.
+        number_of_coefficients : int
+            The number of monomials (columns).
+
+        Returns
+        -------
+        array
+            A (samples, number_of_coefficients) matrix.
+        """
+        powers = power_table(*x, degree=polynomial_degree(number_of_coefficients))
+        return monomial_matrix(powers, number_of_coefficients)
+
+    def _weighted_system(self, data_set, number_of_columns):
+        """
+        Build the weighted least squares system [X | y] of a part of the data
+        set, each row multiplied by 1 / sigma = p * q.
+
+        Parameters
+        ----------
+        data_set : array
+            A part of the data set.
+        number_of_columns : int
+            The number of monomials of the design matrix X.
+
+        Returns
+        -------
+        array
+            A (samples, number_of_columns + 1) matrix.
+        """
+        weighted_system = np.empty((len(data_set), number_of_columns + 1))
+        weighted_system[:, :-1] = self._design_matrix(self._get_x_data(data_set), number_of_columns)
+        weighted_system[:, -1] = data_set["score"]
+        weighted_system *= 1.0 / self._compute_weights(data_set)[:, None]
+        return weighted_system
+
+    def _accumulate_r_factor(self, number_of_columns, chunks=None):
+        """
+        Compute the R factor of the QR factorization of the weighted system of
+        the whole data set, one chunk at a time: the R factor of [R; A] is the
+        R factor of the rows of R and A together, so only a square matrix is
+        kept between chunks. The columns are scaled to a unit maximum on the
+        first chunk, since the powers of p and r span many orders of magnitude.
+
+        Parameters
+        ----------
+        number_of_columns : int
+            The number of monomials of the design matrix.
+        chunks : iterable, optional
+            The parts of the data set to fit, the whole data set by default.
 
-        return predicted_y
+        Returns
+        -------
+        tuple
+            The R factor of the scaled system, the scale of each column and
+            the number of samples.
+        """
+        r_factor = np.empty((0, number_of_columns + 1))
+        scale = None
+        number_of_samples = 0
+
+        for data_set in self._iter_chunks() if chunks is None else chunks:
+            weighted_system = self._weighted_system(data_set, number_of_columns)
+            if scale is None:
+                scale = np.max(np.abs(weighted_system[:, :-1]), axis=0)
+                scale[scale == 0.0] = 1.0
+            weighted_system[:, :-1] /= scale
+
+            r_factor = np.linalg.qr(np.vstack((r_factor, weighted_system)), mode="r")
+            number_of_samples += len(data_set)
+
+        return r_factor, scale, number_of_samples
+
+    def _compute_maes(self, parameters, chunks=None):
+        """
+        Compute the mean absolute error of several fitted functions in a
+        single pass over the data set.
+
+        Parameters
+        ----------
+        parameters : dict
+            The optimal parameters of each function.
+        chunks : iterable, optional
+            The parts of the data set to evaluate, the whole data set by default.
+
+        Returns
+        -------
+        dict
+            The mean absolute error of each function.
+        """
+        number_of_columns = max(len(optimal_parameters) for optimal_parameters in parameters.values())
+        absolute_errors = dict.fromkeys(parameters, 0.0)
+        number_of_samples = 0
+
+        for data_set in self._iter_chunks() if chunks is None else chunks:
+            number_of_samples += len(data_set)
+            design_matrix = self._design_matrix(self._get_x_data(data_set), number_of_columns)
+            for function, optimal_parameters in parameters.items():
+                predicted_y = design_matrix[:, : len(optimal_parameters)] @ optimal_parameters
+                absolute_errors[function] += np.sum(np.abs(predicted_y - data_set["score"]))
+
+        return {function: error / number_of_samples for function, error in absolute_errors.items()}
+
+    def _solve_least_squares(self, r_factor, scale):
+        """
+        Solve the least squares problem of each function from the R factor of
+        the scaled weighted system.
+
+        Parameters
+        ----------
+        r_factor : array
+            The R factor returned by _accumulate_r_factor.
+        scale : array
+            The scale of each column of the system.
+
+        Returns
+        -------
+        tuple
+            The optimal parameters, the covariance matrix and the solving time
+            (in seconds) of each function.
+        """
+        parameters = {}
+        covariances = {}
+        solve_times = {}
+        for function in self.functions:
+            started = time.perf_counter()
+            n = self._get_number_of_coefficients(function)
+            r_inverse = np.linalg.pinv(r_factor[:n, :n])
+            parameters[function] = (r_inverse @ r_factor[:n, -1]) / scale[:n]
+            covariances[function] = (r_inverse @ r_inverse.T) / np.outer(scale[:n], scale[:n])
+            solve_times[function] = time.perf_counter() - started
+
+        return parameters, covariances, solve_times
+
+    def _fit_least_squares(self):
+        """
+        Fit all the functions by weighted least squares, minimizing the same
+        sum of ((y - f(x)) / sigma)^2 as curve_fit.
+
+        The functions are nested polynomials, so a single QR factorization of
+        the weighted design matrix of the largest one (with y as an extra
+        column) gives all of them: the problem of a function with n
+        coefficients is the leading n x n block of R.
+
+        Returns
+        -------
+        dict
+            For each function, the optimal parameters, the covariance matrix,
+            the mean absolute error and the time spent solving its problem
+            from the shared R factor (in seconds).
+        """
+        for function in self.functions:
+            self._check_polynomial(function)
+
+        number_of_columns = max(self._get_number_of_coefficients(function) for function in self.functions)
+        r_factor, scale, self.number_of_samples = self._accumulate_r_factor(number_of_columns)
+        parameters, covariances, solve_times = self._solve_least_squares(r_factor, scale)
+
+        maes = self._compute_maes(parameters)
+        return {
+            function: (parameters[function], covariances[function], maes[function], solve_times[function])
+            for function in self.functions
+        }
+
+    def _save_binary_data_set(self, filename):
+        """
+        Write the data set to a .npy file, which the cross-validation workers
+        map instead of receiving a copy of the data.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the .npy file.
+        """
+        if self.data_set is not None:
+            np.save(filename, self.data_set)
+            return
+
+        number_of_samples = sum(len(data_set) for data_set in self._iter_chunks())
+        binary_data_set = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=DATA_SET_DTYPE, shape=(number_of_samples,)
+        )
+        first = 0
+        for data_set in self._iter_chunks():
+            binary_data_set[first : first + len(data_set)] = data_set
+            first += len(data_set)
+        binary_data_set.flush()
+
+    def _cross_validate(self, number_of_folds, workers):
+        """
+        Estimate the error of each function on unseen data with a k-fold
+        cross-validation (lstsq method only). The folds are contiguous ranges
+        of the data set, so the samples of a tuple stay (almost always) in the
+        same fold. Every (function, fold) pair is fitted on its own, in a pool
+        of processes sharing the data set through a memory-mapped file.
+
+        Parameters
+        ----------
+        number_of_folds : int
+            The number of folds.
+        workers : int
+            The number of processes fitting the folds.
+
+        Returns
+        -------
+        dict
+            For each function, the held-out mean absolute error of each fold
+            and the mean time spent fitting a fold.
+        """
+        if self.method != "lstsq":
+            raise ValueError("Only the lstsq method supports the cross-validation")
+
+        tasks = [(function, fold) for function in self.functions for fold in range(number_of_folds)]
+        with tempfile.TemporaryDirectory() as directory:
+            if _map_data_set(self.data_file) is not None:
+                data_file = self.data_file
+            else:
+                data_file = pathlib.Path(directory) / "data-set.npy"
+                self._save_binary_data_set(data_file)
+
+            arguments = (
+                [data_file] * len(tasks),
+                [function for function, _ in tasks],
+                [fold for _, fold in tasks],
+                [number_of_folds] * len(tasks),
+            )
+            if workers == 1:
+                results = list(map(_fit_fold, *arguments))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(_fit_fold, *arguments))
+
+        cross_validation = {function: {"fold_mean_absolute_errors": [], "fit_times": []} for function in self.functions}
+        for (function, _), (mean_absolute_error, fit_time) in zip(tasks, results):
+            cross_validation[function]["fold_mean_absolute_errors"].append(mean_absolute_error)
+            cross_validation[function]["fit_times"].append(fit_time)
+
+        return cross_validation
 
     def _compute_mae(self, predicted_y):
         """
@@ -127,7 +486,7 @@ class Regressor:
         function,
         optimal_parameters,
         optimal_covariance,
-        predicted_y,
+        mean_absolute_error,
         include_covariance,
     ):
         """
@@ -141,8 +500,8 @@ class Regressor:
             The optimal parameters of the function.
         optimal_covariance : array
             The covariance matrix of the function.
-        predicted_y : array
-            The predicted values of y.
+        mean_absolute_error : float
+            The mean absolute error of the function on the data set.
         include_covariance : bool
             Whether to include the covariance matrix in the report.
 
@@ -154,7 +513,7 @@ class Regressor:
         report = {
             "fitted_function": function.__name__,
             "coeficients": optimal_parameters.tolist(),
-            "mean_absolute_error": self._compute_mae(predicted_y),
+            "mean_absolute_error": mean_absolute_error,
         }
 
         if include_covariance:
@@ -162,7 +521,7 @@ class Regressor:
 
         return report
 
-    def regression(self, output_file, include_covariance=False):
+    def regression(self, output_file, include_covariance=False, number_of_folds=None, workers=1):
         """
         Perform the regression on the data set and write the report to a file.
 
@@ -172,27 +531,101 @@ class Regressor:
             The path to the file where the report will be written.
         include_covariance : bool, optional
             Whether to include the covariance matrix in the report.
+        number_of_folds : int, optional
+            If given, also report the held-out mean absolute error of each
+            function in a k-fold cross-validation, and its fitting time.
+        workers : int, optional
+            The number of processes used by the cross-validation.
         """
+        if self.method == "lstsq":
+            fits = self._fit_least_squares()
+
+        if number_of_folds is not None:
+            cross_validation = self._cross_validate(number_of_folds, workers)
+
         reports = []
         for function in self.functions:
-            optimal_parameters, optimal_covariance = self._fit_function(function)
-            predicted_y = self._predict_y(function, optimal_parameters)
+            if self.method == "lstsq":
+                # The QR factorization shared by all the functions is not part of their fit time
+                optimal_parameters, optimal_covariance, mean_absolute_error, fit_time = fits[function]
+            else:
+                started = time.perf_counter()
+                optimal_parameters, optimal_covariance = self._fit_function(function)
+                fit_time = time.perf_counter() - started
+                mean_absolute_error = self._compute_mae(self._predict_y(function, optimal_parameters))
             report = self._generate_report(
                 function,
                 optimal_parameters,
                 optimal_covariance,
-                predicted_y,
+                mean_absolute_error,
                 include_covariance,
             )
+            report["fit_time"] = fit_time
+            if number_of_folds is not None:
+                fold_errors = cross_validation[function]["fold_mean_absolute_errors"]
+                report["cross_validation"] = {
+                    "folds": number_of_folds,
+                    "mean_absolute_error": float(np.mean(fold_errors)),
+                    "fold_mean_absolute_errors": fold_errors,
+                    "mean_fit_time": float(np.mean(cross_validation[function]["fit_times"])),
+                }
             reports.append(report)
 
         with open(output_file, "w") as f:
             json.dump(reports, f, indent=4)
 
 
+def _map_data_set(filename):
+    """
+    Memory-map a binary data set (a .npy file or a training store), or return
+    None for a CSV file.
+    """
+    suffix = pathlib.Path(filename).suffix
+    if suffix == ".npy":
+        return np.load(filename, mmap_mode="r")
+    if suffix == ".dat":
+        return TrainingStore(filename).read()
+    return None
+
+
+def _iter_blocks(data_set, block_size, ranges=None):
+    """
+    Iterate over the rows of the given (start, end) ranges of a data set, in
+    blocks of at most block_size rows.
+    """
+    for start, end in [(0, len(data_set))] if ranges is None else ranges:
+        for first in range(start, end, block_size):
+            yield data_set[first : min(first + block_size, end)]
+
+
+def _fit_fold(data_file, function, fold, number_of_folds):
+    """
+    Fit a function on all the folds of a memory-mapped data set but one, and
+    compute its mean absolute error on the held-out fold.
+
+    Returns
+    -------
+    tuple
+        The held-out mean absolute error and the fitting time (in seconds).
+    """
+    regressor = Regressor(data_file, [function])
+    number_of_samples = regressor.number_of_samples
+    start = fold * number_of_samples // number_of_folds
+    end = (fold + 1) * number_of_samples // number_of_folds
+
+    started = time.perf_counter()
+    training_set = _iter_blocks(regressor.data_set, CROSS_VALIDATION_BLOCK_SIZE, [(0, start), (end, number_of_samples)])
+    r_factor, scale, _ = regressor._accumulate_r_factor(regressor._get_number_of_coefficients(function), training_set)
+    parameters, _, _ = regressor._solve_least_squares(r_factor, scale)
+    fit_time = time.perf_counter() - started
+
+    test_set = _iter_blocks(regressor.data_set, CROSS_VALIDATION_BLOCK_SIZE, [(start, end)])
+    return regressor._compute_maes(parameters, test_set)[function], fit_time
+
+
 if __name__ == "__main__":
     print("Performing the regression...")
-    regressor = Regressor(SCORE_DISTRIBUTION, FUNCTIONS)
-    regressor.regression(REPORT_FILE)
+    regressor = Regressor(SCORE_DISTRIBUTION, FUNCTIONS, METHOD, CHUNK_SIZE)
+    regressor.regression(REPORT_FILE, number_of_folds=NUMBER_OF_FOLDS, workers=WORKERS)
     print("Done!")
     print("Regression report saved to '{}'".format(REPORT_FILE))
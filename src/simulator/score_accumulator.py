@@ -0,0 +1,177 @@
+import numpy as np
+from statistics import NormalDist
+
+
+class ScoreAccumulator:
+    """
+    Accumulate the average bounded slowdowns of the trials of a tuple by the
+    first job chosen in each trial, as the trial results arrive.
+
+    Parameters
+    ----------
+    size_of_Q : int
+        The number of jobs in the queue Q (the possible first choices).
+    stratified : bool, optional
+        Whether the trials were sampled in strata of first choice. The scores are
+        then computed from the mean slowdown of each stratum, which does not depend
+        on how many trials each stratum received.
+
+    Attributes
+    ----------
+    sums : array
+        The sum of the slowdowns of the trials starting with each job.
+    counts : array
+        The number of trials starting with each job.
+    total : float
+        The sum of the slowdowns of all trials.
+    squares : array
+        The sum of the squared slowdowns of the trials starting with each job.
+    total_squares : float
+        The sum of the squared slowdowns of all trials.
+    """
+
+    def __init__(self, size_of_Q, stratified=False):
+        self.size_of_Q = size_of_Q
+        self.stratified = stratified
+        self.sums = np.zeros(size_of_Q)
+        self.counts = np.zeros(size_of_Q, dtype=np.int64)
+        self.total = 0.0
+        self.squares = np.zeros(size_of_Q)
+        self.total_squares = 0.0
+
+    @property
+    def number_of_trials(self):
+        return int(self.counts.sum())
+
+    def add(self, first_choices, slowdowns):
+        """
+        Add the results of a group of trials.
+
+        Parameters
+        ----------
+        first_choices : array
+            The index (in Q) of the first job of each trial.
+        slowdowns : array
+            The average bounded slowdown of each trial.
+        """
+        first_choices = np.asarray(first_choices)
+        slowdowns = np.asarray(slowdowns, dtype=float)
+        if slowdowns.shape != first_choices.shape:
+            raise ValueError(f"Got {slowdowns.size} slowdowns for {first_choices.size} trials")
+
+        self.sums += np.bincount(first_choices, weights=slowdowns, minlength=self.size_of_Q)
+        self.counts += np.bincount(first_choices, minlength=self.size_of_Q)
+        self.total += slowdowns.sum()
+        self.squares += np.bincount(first_choices, weights=slowdowns**2, minlength=self.size_of_Q)
+        self.total_squares += np.dot(slowdowns, slowdowns)
+
+    def score_distribution(self, number_of_trials):
+        """
+        Compute the score of each job of Q: the share of the total slowdown
+        observed in the trials starting with it.
+
+        Parameters
+        ----------
+        number_of_trials : int
+            The number of trials that must have been accumulated.
+
+        Returns
+        -------
+        array
+            The score of each job of Q.
+        """
+        if self.number_of_trials != number_of_trials:
+            raise ValueError(f"Expected {number_of_trials} trials but {self.number_of_trials} were accumulated")
+        return self._scores()
+
+    def _scores(self):
+        if self.stratified:
+            if np.any(self.counts == 0):
+                raise ValueError("The score of a first choice without trials is undefined")
+            means = self.sums / self.counts
+            return means / means.sum()
+        return self.sums / self.total
+
+    def confidence_half_widths(self, confidence=0.95):
+        """
+        Compute the half-width of the confidence interval of each score.
+
+        Each score is a ratio of two means over the trials, so its variance is
+        estimated with the delta method: the score of job k has the variance of
+        (x * [first choice is k] - score_k * x) / mean(x), x being the slowdowns.
+        For stratified trials, the score of job k is m_k / M (m being the mean
+        slowdown of each stratum and M their sum), and the strata are taken as
+        independent. Paired trials (common or antithetic) are treated as
+        independent too.
+
+        Parameters
+        ----------
+        confidence : float, optional
+            The confidence level of the intervals.
+
+        Returns
+        -------
+        array
+            The half-width of the confidence interval of each score (inf while
+            there are fewer than two trials).
+        """
+        number_of_trials = self.number_of_trials
+        if number_of_trials < 2 or (self.stratified and np.any(self.counts < 2)):
+            return np.full(self.size_of_Q, np.inf)
+
+        scores = self._scores()
+        if self.stratified:
+            means = self.sums / self.counts
+            variances_of_means = (self.squares - self.sums * means) / ((self.counts - 1) * self.counts)
+            total_mean = means.sum()
+            variances = (
+                (total_mean**2 - 2 * total_mean * means) * variances_of_means
+                + means**2 * variances_of_means.sum()
+            ) / total_mean**4
+        else:
+            mean_slowdown = self.total / number_of_trials
+            squared_deviations = (1 - 2 * scores) * self.squares + scores**2 * self.total_squares
+            variances = squared_deviations / (mean_slowdown**2 * (number_of_trials - 1) * number_of_trials)
+
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        return z * np.sqrt(np.maximum(variances, 0.0))
+
+    def has_converged(self, tolerance, confidence=0.95):
+        """
+        Check if the confidence interval of every score is within a relative tolerance.
+
+        Parameters
+        ----------
+        tolerance : float
+            The largest half-width accepted, relative to the score.
+        confidence : float, optional
+            The confidence level of the intervals.
+
+        Returns
+        -------
+        bool
+            True if every score is known within the tolerance (never while a
+            stratum has no trials).
+        """
+        if self.stratified and np.any(self.counts == 0):
+            return False
+        half_widths = self.confidence_half_widths(confidence)
+        if np.any(np.isinf(half_widths)):
+            return False
+        return bool(np.all(half_widths <= tolerance * self._scores()))
+
+    def get_state(self):
+        return {
+            "sums": self.sums.tolist(),
+            "counts": self.counts.tolist(),
+            "total": self.total,
+            "squares": self.squares.tolist(),
+            "total-squares": self.total_squares,
+        }
+
+    def set_state(self, state):
+        self.sums[:] = state["sums"]
+        self.counts[:] = state["counts"]
+        self.total = state["total"]
+        self.squares[:] = state["squares"]
+        self.total_squares = state["total-squares"]
@@ -1,14 +1,23 @@
+import io
 import os
+import json
 import sys
+import time
 import pathlib
+import datetime
+import contextlib
 import numpy as np
 import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from random import seed, randint
 
 # Add the src directory to the path so we can import the tools
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "src")))
 from tools.swf_reader import *
+from tools.training_store import TrainingStore
+from trials_engine import *
+from score_accumulator import ScoreAccumulator
 
 # Predefined paths (enable the script to be run from anywhere in the project)
 SIMULATION_DIR = pathlib.Path(__file__).parent
@@ -22,40 +31,116 @@ SIMULATION_PARAMETERS = {
     "number-of-trials": 1000,
     "size-of-S": 16,
     "size-of-Q": 32,
+    "engine": "simgrid",
+    "dispatch-delay": 0.0,
+    "batch-size": 4096,
+    "workers": 1,
+    "tolerance": None,
+    "min-trials": 16_384,
+    "confidence": 0.95,
+    "sampling": "uniform",
+    "pairing": None,
 }
 
+# Phases of Simulator.simulate_tuple timed in the metrics file
+PHASES = ["store_tuple", "create_initial_state", "schedule_trials", "compute_AVGbsld", "save_score_distribution"]
+
 
 class Simulator:
     _jobs_S = None
     _jobs_Q = None
     _current_file = SIMULATION_DIR / "current-simulation.csv"
-    _result_file = SIMULATION_DIR / "result-temp.dat"
+    _scratch_path = SIMULATION_DIR / "scratch"
     _gather_file = SIMULATION_DIR / "training-data.csv"
+    _training_store_file = SIMULATION_DIR / "training-data.dat"
     _task_sets_path = SIMULATION_DIR / "task-sets"
     _states_path = SIMULATION_DIR / "states"
     _training_data_path = SIMULATION_DIR / "training-data"
-    _permutation_indexes = None
+    _metrics_file = SIMULATION_DIR / "simulation-metrics.jsonl"
+    _tuple_seed = None
+    _accumulator = None
+    _post_S_state = None
 
     def __init__(
-        self, workload, deployment, cluster, number_of_tuples, number_of_trials, size_of_S, size_of_Q, fixed_seed
+        self,
+        workload,
+        deployment,
+        cluster,
+        number_of_tuples,
+        number_of_trials,
+        size_of_S,
+        size_of_Q,
+        fixed_seed,
+        engine="simgrid",
+        dispatch_delay=0.0,
+        batch_size=BLOCK_SIZE,
+        tolerance=None,
+        min_trials=0,
+        confidence=0.95,
+        sampling="uniform",
+        pairing=None,
     ):
         self.workload = workload
         self.deployment = deployment
         self.cluster = cluster
 
+        if engine not in ("simgrid", "batch", "python"):
+            raise ValueError(f"Unknown trial engine '{engine}'")
+        self.engine = engine
+        self.dispatch_delay = dispatch_delay
+        self.batch_size = batch_size
+        # With a tolerance, number_of_trials is only the largest budget of a tuple
+        self.tolerance = tolerance
+        self.min_trials = min_trials
+        self.confidence = confidence
+
+        if sampling not in ("uniform", "stratified"):
+            raise ValueError(f"Unknown sampling '{sampling}'")
+        if pairing not in (None, "common", "antithetic"):
+            raise ValueError(f"Unknown pairing '{pairing}'")
+        if pairing is not None and sampling != "stratified":
+            raise ValueError("Pairing is only available with stratified sampling")
+        # Every first choice must get trials, or its mean slowdown (and so every score) is undefined
+        if sampling == "stratified" and (number_of_trials < size_of_Q or number_of_trials % size_of_Q != 0):
+            raise ValueError("Stratified sampling needs a number of trials multiple of size_of_Q")
+        self.sampling = sampling
+        self.pairing = pairing
+        self.number_of_nodes = read_number_of_workers(deployment) if engine == "python" else None
+
         self.number_of_tuples = number_of_tuples
         self.number_of_trials = number_of_trials
         self.size_of_S = size_of_S
         self.size_of_Q = size_of_Q
         self.tuple_size = size_of_S + size_of_Q
+        if size_of_Q > np.iinfo(np.uint8).max + 1:
+            raise ValueError("The permutations are stored as uint8, size_of_Q must be at most 256")
 
         self.number_of_jobs = None
         self.number_of_processors = None
         self.model_jobs = None
         self.get_workload_info()
 
-        if fixed_seed:
-            seed(42)
+        # Each tuple draws from its own seed of the stream, so the tuples do not
+        # depend on the order (or the worker) in which they are simulated
+        self.seed = 42 if fixed_seed else int(np.random.SeedSequence().entropy)
+
+    def use_scratch_dir(self, path):
+        path.mkdir(parents=True, exist_ok=True)
+        self._current_file = path / "current-simulation.csv"
+
+    def use_output_dir(self, path):
+        # Keep the task sets, the states and the training data of this simulator in a single directory
+        path.mkdir(parents=True, exist_ok=True)
+        self._task_sets_path = path
+        self._states_path = path
+        self._training_data_path = path
+        self._training_store_file = path / "training-data.dat"
+
+    def get_scratch_dir(self):
+        return self._current_file.parent
+
+    def get_tuple_seed(self, index):
+        return int(np.random.SeedSequence([self.seed, index]).generate_state(1)[0])
 
     def get_workload_info(self):
         reader = ReaderSWF(self.workload)
@@ -64,19 +149,63 @@ class Simulator:
         self.number_of_processors = reader.number_of_processors
 
     def get_start_index(self):
+        done_indexes = TrainingStore(self._training_store_file).get_tuple_indexes()
         start = 0
-        while (self._training_data_path / f"set-{start}.csv").exists():
+        while start in done_indexes:
             start += 1
         return start
 
+    def get_pending_indexes(self):
+        # Tuples finish out of order when simulated in parallel
+        done_indexes = TrainingStore(self._training_store_file).get_tuple_indexes()
+        return [index for index in range(self.get_start_index(), self.number_of_tuples) if index not in done_indexes]
+
     def get_task_sets_file(self, index):
         return self._task_sets_path / f"set-{index}.csv"
 
     def get_states_file(self, index):
         return self._states_path / f"set-{index}.csv"
 
-    def get_training_data_file(self, index):
-        return self._training_data_path / f"set-{index}.csv"
+    def get_post_S_state_file(self, index):
+        return self._states_path / f"set-{index}.npz"
+
+    def get_trials_report_file(self, index):
+        return self._training_data_path / f"set-{index}.json"
+
+    def get_checkpoint_file(self, index):
+        return self._task_sets_path / f"set-{index}.checkpoint.json"
+
+    def load_checkpoint(self, index):
+        if not self.get_checkpoint_file(index).exists():
+            return None
+        with open(self.get_checkpoint_file(index), "r") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        # A checkpoint of other parameters cannot be continued, the tuple starts over
+        if (
+            checkpoint["number-of-trials"],
+            checkpoint["batch-size"],
+            checkpoint["sampling"],
+            checkpoint["pairing"],
+            len(checkpoint["scores"]["sums"]),
+        ) != (self.number_of_trials, self.batch_size, self.sampling, self.pairing, self.size_of_Q):
+            return None
+        return checkpoint
+
+    def save_checkpoint(self, index, next_block):
+        checkpoint = {
+            "tuple-seed": self._tuple_seed,
+            "next-block": next_block,
+            "number-of-trials": self.number_of_trials,
+            "batch-size": self.batch_size,
+            "sampling": self.sampling,
+            "pairing": self.pairing,
+            "scores": self._accumulator.get_state(),
+        }
+
+        temporary_file = self.get_checkpoint_file(index).with_suffix(".tmp")
+        with open(temporary_file, "w+") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temporary_file, self.get_checkpoint_file(index))
 
     def get_random_index(self):
         maximum_start_index = (self.number_of_jobs - 1) - (self.tuple_size)
@@ -106,139 +235,318 @@ class Simulator:
                 )
 
     def create_initial_state(self, index):
+        if self.engine == "python":
+            elapsed_times = initial_state(self._jobs_S, self.number_of_nodes, self.dispatch_delay)
+            with open(self.get_states_file(index), "w+") as state_file:
+                state_file.write(",".join(f"{elapsed_time:f}" for elapsed_time in elapsed_times) + "\n")
+            return
+
         shutil.copyfile(self.get_task_sets_file(index), self._current_file)
         subprocess.run(
-            ["./trials_simulator", self.cluster, self.deployment, "-state"],
+            [SIMULATION_DIR / "trials_simulator", self.cluster, self.deployment, "-state"],
             stdout=open(self.get_states_file(index), "w+"),
-            cwd=SIMULATION_DIR,
+            cwd=self.get_scratch_dir(),
         )
 
-    def clear_possible_artifacts(self, index):
-        if self._result_file.exists():
-            self._result_file.unlink()
-        if self.get_training_data_file(index).exists():
-            self.get_training_data_file(index).unlink()
-
-    def initialize_permutation_indexes(self):
-        self._permutation_indexes = np.empty(shape=(self.number_of_trials, self.size_of_Q), dtype=int)
-        for j in range(0, self.number_of_trials):
-            self._permutation_indexes[j] = np.arange(self.size_of_Q)
-
-    def create_permutation(self, index, shuffled_Q):
+    def load_post_S_state(self, index):
+        # The cache is only reused for the same S jobs and platform, a regenerated tuple gets a new one
+        jobs_S = np.array([self._jobs_S["p"], self._jobs_S["q"], self._jobs_S["r"]], dtype=float)
+        state_file = self.get_post_S_state_file(index)
+        if state_file.exists():
+            with np.load(state_file) as cached:
+                if (
+                    np.array_equal(cached["jobs_S"], jobs_S)
+                    and cached["dispatch_delay"] == self.dispatch_delay
+                    and len(cached["busy_until"]) == self.number_of_nodes
+                ):
+                    return cached["busy_until"], float(cached["clock"])
+
+        busy_until, clock = post_S_state(self._jobs_S, self.number_of_nodes, self.dispatch_delay)
+        temporary_file = state_file.with_suffix(".tmp.npz")
+        np.savez(temporary_file, jobs_S=jobs_S, dispatch_delay=self.dispatch_delay, busy_until=busy_until, clock=clock)
+        os.replace(temporary_file, state_file)
+        return busy_until, clock
+
+    def initialize_permutations(self, tuple_seed):
+        self._tuple_seed = tuple_seed
+        self._accumulator = ScoreAccumulator(self.size_of_Q, self.sampling == "stratified")
+
+    def get_permutation_block(self, block_index):
+        # Every block has its own generator, so any block can be rebuilt alone
+        first = block_index * self.batch_size
+        number_of_rows = min(self.batch_size, self.number_of_trials - first)
+        generator = np.random.default_rng([self._tuple_seed, block_index])
+        if self.sampling == "stratified":
+            return self.get_stratified_block(generator, number_of_rows)
+        identity = np.broadcast_to(np.arange(self.size_of_Q, dtype=np.uint8), (number_of_rows, self.size_of_Q))
+        return generator.permuted(identity, axis=1)
+
+    def get_stratified_block(self, generator, number_of_rows):
+        # Row j of a block starts with job j % Q, so every job gets the same share of
+        # trials; the other jobs follow in a uniformly random order
+        rows = np.arange(number_of_rows)
+        first_choices = (rows % self.size_of_Q).astype(np.uint8)
+        groups = rows // self.size_of_Q
+
+        if self.pairing == "common":
+            # The Q trials of a group follow the same order, only the first job changes
+            orders = np.broadcast_to(np.arange(self.size_of_Q, dtype=np.uint8), (groups[-1] + 1, self.size_of_Q))
+            orders = generator.permuted(orders, axis=1)[groups]
+            rest = orders[orders != first_choices[:, None]].reshape(number_of_rows, self.size_of_Q - 1)
+        else:
+            others = np.arange(self.size_of_Q - 1, dtype=np.uint8)
+            rest = generator.permuted(others + (others >= first_choices[:, None]), axis=1)
+            if self.pairing == "antithetic":
+                # The trials of odd groups run the rest of the previous group backwards
+                paired = rows[groups % 2 == 1]
+                rest[paired] = rest[paired - self.size_of_Q, ::-1]
+
+        return np.column_stack((first_choices, rest))
+
+    def get_permutation(self, trial_index):
+        return self.get_permutation_block(trial_index // self.batch_size)[trial_index % self.batch_size]
+
+    def create_permutation(self, permutation):
         with open(self._current_file, "w+") as iteration_file:
-            for k in range(self.size_of_Q):
-                choose = randint(0, self.size_of_Q - 1)
-                buffer_runtimes = shuffled_Q["p"][choose]
-                buffer_nodes = shuffled_Q["q"][choose]
-                buffer_submit = shuffled_Q["r"][choose]
-                shuffled_Q["p"][choose] = shuffled_Q["p"][k]
-                shuffled_Q["q"][choose] = shuffled_Q["q"][k]
-                shuffled_Q["r"][choose] = shuffled_Q["r"][k]
-                shuffled_Q["p"][k] = buffer_runtimes
-                shuffled_Q["q"][k] = buffer_nodes
-                shuffled_Q["r"][k] = buffer_submit
-                buffer_index = self._permutation_indexes[index, choose]
-                self._permutation_indexes[index, choose] = self._permutation_indexes[index, k]
-                self._permutation_indexes[index, k] = buffer_index
-
             for j in range(self.size_of_S):
                 iteration_file.write(f"{self._jobs_S['p'][j]},{self._jobs_S['q'][j]},{self._jobs_S['r'][j]}\n")
-            for k in range(self.size_of_Q):
-                iteration_file.write(
-                    f"{self._jobs_Q['p'][self._permutation_indexes[index, k]]},{self._jobs_Q['q'][self._permutation_indexes[index, k]]},{self._jobs_Q['r'][self._permutation_indexes[index, k]]}\n"
-                )
-
-        return shuffled_Q
-
-    def create_shuffled_Q(self):
-        shuffled_Q = {"p": [], "q": [], "r": []}
-
-        shuffled_Q["p"] = np.copy(self._jobs_Q["p"])
-        shuffled_Q["q"] = np.copy(self._jobs_Q["q"])
-        shuffled_Q["r"] = np.copy(self._jobs_Q["r"])
-
-        return shuffled_Q
-
-    def schedule_trials(self):
-        shuffled_Q = self.create_shuffled_Q()
-
-        for trial_index in range(self.number_of_trials):
-            shuffled_Q = self.create_permutation(trial_index, shuffled_Q)
-            subprocess.run(
-                ["./trials_simulator", self.cluster, self.deployment],
-                stdout=open(self._result_file, "a+"),
-                cwd=SIMULATION_DIR,
+            for k in permutation:
+                iteration_file.write(f"{self._jobs_Q['p'][k]},{self._jobs_Q['q'][k]},{self._jobs_Q['r'][k]}\n")
+
+    def create_tuple_file(self):
+        # The batch mode reads the tuple in its original order and permutes Q itself
+        with open(self._current_file, "w+") as tuple_file:
+            for jobs in (self._jobs_S, self._jobs_Q):
+                for p, q, r in zip(jobs["p"], jobs["q"], jobs["r"]):
+                    tuple_file.write(f"{p},{q},{r}\n")
+
+    def schedule_permutations(self, permutations):
+        if self.engine == "simgrid":
+            output = ""
+            for permutation in permutations:
+                self.create_permutation(permutation)
+                output += subprocess.run(
+                    [SIMULATION_DIR / "trials_simulator", self.cluster, self.deployment],
+                    stdout=subprocess.PIPE,
+                    text=True,
+                    cwd=self.get_scratch_dir(),
+                ).stdout
+        elif self.engine == "batch":
+            batch = io.StringIO()
+            np.savetxt(batch, permutations, fmt="%d", delimiter=",")
+            output = subprocess.run(
+                [SIMULATION_DIR / "trials_simulator", self.cluster, self.deployment, "-batch", "-"],
+                input=batch.getvalue(),
+                stdout=subprocess.PIPE,
+                text=True,
+                cwd=self.get_scratch_dir(),
+            ).stdout
+        else:
+            return simulate_trials(
+                self._jobs_S,
+                self._jobs_Q,
+                permutations,
+                self.number_of_nodes,
+                self.dispatch_delay,
+                self.batch_size,
+                self._post_S_state,
             )
 
-    def compute_AVGbsld(self, index):
-        exp_sum_slowdowns = 0.0
-        distribution = np.zeros(self.size_of_Q)
-        exp_first_choice = np.zeros((self.number_of_trials), dtype=np.int32)
-        exp_slowdowns = np.zeros((self.number_of_trials))
+        # trials_simulator prints the AVGbsld of each trial on its own line
+        return np.loadtxt(io.StringIO(output), ndmin=1)
 
-        for trialID in range(self.number_of_trials):
-            exp_first_choice[trialID] = self._permutation_indexes[trialID, 0]  # asserted
+    def schedule_trials(self, index, first_block=0):
+        if self.engine == "batch":
+            self.create_tuple_file()
 
-        trialID = 0
-        with open(self._result_file, "r") as rf:
-            lines = rf.readlines()
-            if len(lines) != self.number_of_trials:
-                index = index - 1
-            for line in lines:
-                exp_slowdowns[trialID] = float(line)
-                exp_sum_slowdowns += float(line)
-                trialID = trialID + 1
+        number_of_blocks = -(-self.number_of_trials // self.batch_size)
+        for block_index in range(first_block, number_of_blocks):
+            if self.has_converged():
+                break
+            permutations = self.get_permutation_block(block_index)
+            self._accumulator.add(permutations[:, 0], self.schedule_permutations(permutations))
+            # The next block is known from the tuple seed, so the scores are all that must be kept
+            self.save_checkpoint(index, block_index + 1)
 
-        for trialID in range(self.number_of_trials):
-            distribution[exp_first_choice[trialID]] += exp_slowdowns[trialID]
+    def has_converged(self):
+        if self.tolerance is None or self._accumulator.number_of_trials < self.min_trials:
+            return False
+        return self._accumulator.has_converged(self.tolerance, self.confidence)
 
-        for k in range(self.size_of_Q):
-            distribution[k] = distribution[k] / exp_sum_slowdowns
+    def get_number_of_scheduled_trials(self):
+        if self.tolerance is None:
+            return self.number_of_trials
+        return self._accumulator.number_of_trials
 
-        return distribution
+    def compute_AVGbsld(self, index):
+        return self._accumulator.score_distribution(self.get_number_of_scheduled_trials())
+
+    def save_trials_report(self, index):
+        report = {
+            "trials": self._accumulator.number_of_trials,
+            "converged": self.has_converged(),
+            "tolerance": self.tolerance,
+            "confidence": self.confidence,
+            "half-widths": self._accumulator.confidence_half_widths(self.confidence).tolist(),
+        }
+        with open(self.get_trials_report_file(index), "w+") as report_file:
+            json.dump(report, report_file, indent=4)
 
     def save_score_distribution(self, index, score_dist):
-        output = ""
-        for k in range(self.size_of_Q):
-            output += (
-                f"{int(self._jobs_Q['p'][k])},{int(self._jobs_Q['q'][k])},{int(self._jobs_Q['r'][k])},{score_dist[k]}\n"
-            )
+        # The store commits the whole tuple at once, which marks it as done
+        TrainingStore(self._training_store_file).append(
+            index, self._jobs_Q["p"], self._jobs_Q["q"], self._jobs_Q["r"], score_dist
+        )
 
-        with open(self.get_training_data_file(index), "w+") as output_file:
-            output_file.write(output)
+    def simulate_tuple(self, tuple_index):
+        # Returns the time spent in each phase and the number of trials scheduled by this call
+        phase_times = dict.fromkeys(PHASES, 0.0)
 
-    def simulate(self):
-        for tuple_index in range(self.get_start_index(), self.number_of_tuples):
-            self._jobs_S = {"p": [], "q": [], "r": []}
-            self._jobs_Q = {"p": [], "q": [], "r": []}
+        # A checkpointed tuple is drawn again from the seed it was started with
+        checkpoint = self.load_checkpoint(tuple_index)
+        tuple_seed = checkpoint["tuple-seed"] if checkpoint else self.get_tuple_seed(tuple_index)
 
+        seed(tuple_seed)
+        self._jobs_S = {"p": [], "q": [], "r": []}
+        self._jobs_Q = {"p": [], "q": [], "r": []}
+
+        with _timed_phase(phase_times, "store_tuple"):
             self.store_tuple(tuple_index)
+        with _timed_phase(phase_times, "create_initial_state"):
             self.create_initial_state(tuple_index)
-            self.clear_possible_artifacts(tuple_index)
-            self.initialize_permutation_indexes()
-            self.schedule_trials()
+            self.initialize_permutations(tuple_seed)
+            if self.engine == "python":
+                self._post_S_state = self.load_post_S_state(tuple_index)
+        with _timed_phase(phase_times, "schedule_trials"):
+            if checkpoint:
+                self._accumulator.set_state(checkpoint["scores"])
+                resumed_trials = self._accumulator.number_of_trials
+                self.schedule_trials(tuple_index, checkpoint["next-block"])
+            else:
+                resumed_trials = 0
+                self.schedule_trials(tuple_index)
+        with _timed_phase(phase_times, "compute_AVGbsld"):
             score_dist = self.compute_AVGbsld(tuple_index)
+        with _timed_phase(phase_times, "save_score_distribution"):
+            if self.tolerance is not None:
+                self.save_trials_report(tuple_index)
             self.save_score_distribution(tuple_index, score_dist)
+            self.get_checkpoint_file(tuple_index).unlink(missing_ok=True)
+
+        scheduled_trials = self._accumulator.number_of_trials - resumed_trials
+        return {"tuple": tuple_index, "phases": phase_times, "trials": scheduled_trials}
+
+    def write_metrics(self, record):
+        record = {"time": datetime.datetime.now().isoformat(timespec="seconds"), **record}
+        with open(self._metrics_file, "a") as metrics_file:
+            metrics_file.write(json.dumps(record) + "\n")
+
+    def report_tuple(self, tuple_metrics, progress):
+        progress["completed"] += 1
+        progress["trials"] += tuple_metrics["trials"]
+        elapsed = time.perf_counter() - progress["started"]
+        remaining = progress["pending"] - progress["completed"]
+        # The tuples left are expected to take as long as the ones simulated by this run
+        eta = elapsed / progress["completed"] * remaining
+        schedule_time = tuple_metrics["phases"]["schedule_trials"]
+        trials_per_second = tuple_metrics["trials"] / schedule_time if schedule_time > 0 else None
+
+        self.write_metrics(
+            {
+                "event": "tuple",
+                **tuple_metrics,
+                "trials-per-second": trials_per_second,
+                "run-trials-per-second": progress["trials"] / elapsed,
+                "tuples-completed": self.number_of_tuples - remaining,
+                "tuples-remaining": remaining,
+                "elapsed": elapsed,
+                "eta": eta,
+            }
+        )
+        print(
+            f"Tuple {tuple_metrics['tuple']} done ({self.number_of_tuples - remaining}/{self.number_of_tuples}), "
+            f"{progress['trials'] / elapsed:.1f} trials/s, ETA {datetime.timedelta(seconds=round(eta))}",
+            flush=True,
+        )
+
+    def simulate(self, workers=1):
+        # Every simulated tuple appends its phase times and the progress of the run to the metrics file
+        pending_indexes = self.get_pending_indexes()
+        progress = {"started": time.perf_counter(), "pending": len(pending_indexes), "completed": 0, "trials": 0}
+        self.write_metrics(
+            {
+                "event": "start",
+                "engine": self.engine,
+                "workers": workers,
+                "number-of-trials": self.number_of_trials,
+                "tuples-completed": self.number_of_tuples - len(pending_indexes),
+                "tuples-remaining": len(pending_indexes),
+            }
+        )
+
+        if workers == 1:
+            for tuple_index in pending_indexes:
+                self.report_tuple(self.simulate_tuple(tuple_index), progress)
+        else:
+            # The scratch directories of the workers are removed even if a tuple fails or the run is interrupted
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_initialize_worker, initargs=(self,)
+                ) as executor:
+                    futures = [executor.submit(_simulate_tuple, tuple_index) for tuple_index in pending_indexes]
+                    for future in as_completed(futures):
+                        self.report_tuple(future.result(), progress)
+            finally:
+                shutil.rmtree(self._scratch_path, ignore_errors=True)
+
+        self.write_metrics(
+            {"event": "end", "elapsed": time.perf_counter() - progress["started"], "trials": progress["trials"]}
+        )
 
     @classmethod
     def clear_files(cls):
-        if cls._result_file.exists():
-            cls._result_file.unlink()
         if cls._current_file.exists():
             cls._current_file.unlink()
+        if cls._metrics_file.exists():
+            cls._metrics_file.unlink()
+        shutil.rmtree(cls._scratch_path, ignore_errors=True)
 
         for path in [cls._training_data_path, cls._states_path, cls._task_sets_path]:
             for file in path.glob("*.csv"):
                 file.unlink()
+        for file in cls._training_data_path.glob("*.json"):
+            file.unlink()
+        for file in cls._states_path.glob("*.npz"):
+            file.unlink()
+        for file in cls._task_sets_path.glob("*.checkpoint.json"):
+            file.unlink()
+        TrainingStore(cls._training_store_file).clear()
 
     @classmethod
     def gather_training_data(cls):
-        with open(cls._gather_file, "w+") as out_file:
-            start = 0
-            while (SIMULATION_DIR / f"training-data/set-{start}.csv").exists():
-                with open(SIMULATION_DIR / f"training-data/set-{start}.csv", "r") as sample_file:
-                    out_file.write(sample_file.read())
-                start = start + 1
+        TrainingStore(cls._training_store_file).export_csv(cls._gather_file)
+
+
+# Each worker process keeps its own copy of the simulator and its own scratch
+# directory for the files shared with trials_simulator
+_worker_simulator = None
+
+
+def _initialize_worker(simulator):
+    global _worker_simulator
+    _worker_simulator = simulator
+    _worker_simulator.use_scratch_dir(Simulator._scratch_path / f"worker-{os.getpid()}")
+
+
+def _simulate_tuple(tuple_index):
+    return _worker_simulator.simulate_tuple(tuple_index)
+
+
+@contextlib.contextmanager
+def _timed_phase(phase_times, phase):
+    started = time.perf_counter()
+    yield
+    phase_times[phase] += time.perf_counter() - started
 
 
 if __name__ == "__main__":
@@ -251,8 +559,16 @@ if __name__ == "__main__":
         SIMULATION_PARAMETERS["size-of-S"],
         SIMULATION_PARAMETERS["size-of-Q"],
         False,
+        SIMULATION_PARAMETERS["engine"],
+        SIMULATION_PARAMETERS["dispatch-delay"],
+        SIMULATION_PARAMETERS["batch-size"],
+        SIMULATION_PARAMETERS["tolerance"],
+        SIMULATION_PARAMETERS["min-trials"],
+        SIMULATION_PARAMETERS["confidence"],
+        SIMULATION_PARAMETERS["sampling"],
+        SIMULATION_PARAMETERS["pairing"],
     )
 
-    simulator.simulate()
+    simulator.simulate(SIMULATION_PARAMETERS["workers"])
     # simulator.clear_files()
     # simulator.gather_training_data()
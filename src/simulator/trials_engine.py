@@ -0,0 +1,201 @@
+import numpy as np
+import xml.etree.ElementTree as ET
+
+# Same constants as trials_simulator.c
+TAO = 10
+BLOCK_SIZE = 4096
+
+
+def read_number_of_workers(deployment):
+    """
+    Read the number of workers given to the master process in a deployment file.
+
+    Parameters
+    ----------
+    deployment : str
+        The path to the SimGrid deployment file.
+
+    Returns
+    -------
+    int
+        The number of workers (nodes) the master allocates jobs on.
+    """
+    for process in ET.parse(deployment).getroot().iter("process"):
+        if process.get("function") == "master":
+            return int(process.find("argument").get("value"))
+    raise ValueError(f"No master process found in '{deployment}'")
+
+
+def _dispatch(clock, busy_until, runtimes, cores, submit, dispatch_delay):
+    """
+    Dispatch one job on every trial of the block, following the master loop of
+    trials_simulator.c: wait for the submit time, wait (job completion after job
+    completion) until enough nodes are free, then take the lowest-index free nodes.
+
+    Returns the start time of the job and the nodes allocated to it in every trial.
+    """
+    np.maximum(clock, submit, out=clock)
+
+    free = busy_until <= clock[:, None]
+    waiting = np.count_nonzero(free, axis=1) < cores
+    if waiting.any():
+        # The master is resumed at each completion, so it starts the job at the
+        # first completion that leaves enough nodes free.
+        release = np.sort(busy_until[waiting], axis=1)
+        release = release[np.arange(release.shape[0]), cores[waiting] - 1]
+        clock[waiting] = np.maximum(clock[waiting], release)
+        free[waiting] = busy_until[waiting] <= clock[waiting, None]
+
+    allocation = free & (np.cumsum(free, axis=1) <= cores[:, None])
+    start = clock + dispatch_delay
+    busy_until[allocation] = np.broadcast_to((start + runtimes)[:, None], busy_until.shape)[allocation]
+    clock[:] = start
+
+    return start, allocation
+
+
+def _as_arrays(jobs):
+    return {key: np.asarray(jobs[key]) for key in ("p", "q", "r")}
+
+
+def _simulate_S(jobs_S, number_of_nodes, dispatch_delay):
+    jobs_S = _as_arrays(jobs_S)
+    clock = np.zeros(1)
+    busy_until = np.zeros((1, number_of_nodes))
+    started_at = np.zeros(number_of_nodes)
+    allocation = np.zeros((1, number_of_nodes), dtype=bool)
+
+    for p, q, r in zip(jobs_S["p"], jobs_S["q"], jobs_S["r"]):
+        start, allocation = _dispatch(
+            clock, busy_until, np.array([p], dtype=float), np.array([q]), np.array([r], dtype=float), dispatch_delay
+        )
+        started_at[allocation[0]] = start[0]
+
+    return clock[0], busy_until[0], started_at, allocation[0]
+
+
+def initial_state(jobs_S, number_of_nodes, dispatch_delay=0.0):
+    """
+    Compute the state of the platform right after the dispatch of the last S job,
+    as printed by trials_simulator.c in "-state" mode.
+
+    Parameters
+    ----------
+    jobs_S : dict
+        The state jobs, with the keys "p" (runtimes), "q" (nodes) and "r" (submit times).
+    number_of_nodes : int
+        The number of nodes of the platform.
+    dispatch_delay : float, optional
+        The time spent by the master to send a job to its worker.
+
+    Returns
+    -------
+    array
+        The elapsed time of the job running on each node (0 for idle nodes and
+        0.01 for the nodes of the last S job).
+    """
+    clock, busy_until, started_at, last_allocation = _simulate_S(jobs_S, number_of_nodes, dispatch_delay)
+
+    elapsed_times = np.where(busy_until > clock, clock - started_at, 0.0)
+    elapsed_times[last_allocation] = 0.01
+
+    return elapsed_times
+
+
+def post_S_state(jobs_S, number_of_nodes, dispatch_delay=0.0):
+    """
+    Simulate the S jobs, which run in the same order in every trial, and return
+    the state the Q phase of every trial starts from.
+
+    Parameters
+    ----------
+    jobs_S : dict
+        The state jobs, with the keys "p" (runtimes), "q" (nodes) and "r" (submit times).
+    number_of_nodes : int
+        The number of nodes of the platform.
+    dispatch_delay : float, optional
+        The time spent by the master to send a job to its worker.
+
+    Returns
+    -------
+    tuple
+        The time at which each node becomes free and the clock of the master
+        after the dispatch of the last S job.
+    """
+    clock, busy_until, _, _ = _simulate_S(jobs_S, number_of_nodes, dispatch_delay)
+    return busy_until, clock
+
+
+def _simulate_block(jobs_Q, permutations, state, dispatch_delay):
+    number_of_trials, size_of_Q = permutations.shape
+    busy_until, clock = state
+    clock = np.full(number_of_trials, clock, dtype=float)
+    busy_until = np.tile(busy_until, (number_of_trials, 1))
+
+    sum_slowdowns = np.zeros(number_of_trials)
+    for k in range(size_of_Q):
+        runtimes = jobs_Q["p"][permutations[:, k]]
+        submit = jobs_Q["r"][permutations[:, k]]
+        start, _ = _dispatch(clock, busy_until, runtimes, jobs_Q["q"][permutations[:, k]], submit, dispatch_delay)
+
+        wait_time = start - submit
+        slowdown = (wait_time + runtimes) / np.maximum(runtimes, TAO)
+        sum_slowdowns += np.maximum(slowdown, 1.0)
+
+    return sum_slowdowns / size_of_Q
+
+
+def simulate_trials(
+    jobs_S, jobs_Q, permutations, number_of_nodes, dispatch_delay=0.0, block_size=BLOCK_SIZE, state=None
+):
+    """
+    Simulate the trials of a tuple (S, Q) in-process.
+
+    The S jobs are dispatched first, then the Q jobs in the permuted order. Each job
+    waits for its submit time and for enough free nodes, and takes the lowest-index
+    free nodes (first-fit on busy_workers), exactly as in trials_simulator.c. The S
+    jobs are the same in every trial, so they are simulated once and every trial
+    starts its Q phase from the resulting state.
+
+    Parameters
+    ----------
+    jobs_S : dict
+        The state jobs, with the keys "p" (runtimes), "q" (nodes) and "r" (submit times).
+    jobs_Q : dict
+        The queue jobs, with the same keys as jobs_S.
+    permutations : array
+        A (trials, size_of_Q) array with the order of the Q jobs in each trial.
+    number_of_nodes : int
+        The number of nodes of the platform.
+    dispatch_delay : float, optional
+        The time spent by the master to send a job to its worker. SimGrid charges
+        the transfer of the job description (1000 bytes) on the platform links, so
+        set it to that transfer time to reproduce trials_simulator.c exactly.
+    block_size : int, optional
+        The number of trials simulated together.
+    state : tuple, optional
+        The state after the S jobs, as returned by post_S_state. It is computed
+        when not given.
+
+    Returns
+    -------
+    array
+        The average bounded slowdown (TAO=10) of the Q jobs in each trial.
+    """
+    jobs_S = _as_arrays(jobs_S)
+    jobs_Q = _as_arrays(jobs_Q)
+    permutations = np.asarray(permutations)
+
+    widest_job = max(np.max(jobs_S["q"], initial=0), np.max(jobs_Q["q"], initial=0))
+    if widest_job > number_of_nodes:
+        raise ValueError(f"A job requests {widest_job} nodes but the platform has only {number_of_nodes}")
+
+    if state is None:
+        state = post_S_state(jobs_S, number_of_nodes, dispatch_delay)
+
+    slowdowns = np.empty(permutations.shape[0])
+    for first in range(0, permutations.shape[0], block_size):
+        last = first + block_size
+        slowdowns[first:last] = _simulate_block(jobs_Q, permutations[first:last], state, dispatch_delay)
+
+    return slowdowns
@@ -17,6 +17,14 @@ XBT_LOG_NEW_DEFAULT_CATEGORY(msg_test,
 void sortTasksQueue(double* runtimes, int* cores, int* submit, int policy);
 const char* getfield(char* line, int num);
 void readModelFile(void);
+void readBatchFile(const char* filename);
+void loadPermutation(int trial);
+void createManagers(void);
+void initFreeNodes(int num_nodes);
+void allocateNodes(int* allocation, int count);
+void releaseNodes(const int* allocation, int count);
+void printStats(void);
+double averageSlowdown(void);
 int master(int argc, char *argv[]);
 int taskManager(int argc, char *argv[]);
 msg_error_t test_all(const char *platform_file,
@@ -58,6 +66,17 @@ int *task_allocation;
 //int seed;
 int VERBOSE = 0;
 int STATE = 0;
+int STATS = 0;
+int BATCH = 0;
+
+const char* batch_file = NULL;
+int batch_num_trials = 0;
+int* batch_permutations;
+double* base_runtimes;
+int* base_submit;
+int* base_cores;
+int running_tasks = 0;
+double t_offset = 0.0f;
 
 double* model_runtimes;
 int* model_submit;
@@ -76,7 +95,6 @@ struct task_t* task_queue = NULL;
 msg_process_t p_master;
 
 int chosen_policy = FCFS;
-int* busy_workers;
 int num_managers = MODEL_NUM_TASKS + NUM_TASKS_STATE;
 
 double* sched_task_placement;
@@ -85,8 +103,69 @@ double* sched_task_placement;
 int number_of_tasks = MODEL_NUM_TASKS + NUM_TASKS_STATE;
 double t0 = 0.0f;
 
+/* Free nodes: bit j % 64 of free_node_words[j / 64] is set while node j is free. The words before
+   first_free_word have no free node. */
+unsigned long long* free_node_words = NULL;
+int num_node_words = 0;
+int first_free_word = 0;
+int num_free_nodes = 0;
+
+/* Counters printed to stderr with -stats */
+long stats_sort_calls = 0;
+long stats_dispatch_retries = 0;
+long stats_simulated_events = 0;
+
+void initFreeNodes(int num_nodes){
+  int j;
+  num_node_words = (num_nodes + 63) / 64;
+  free_node_words = (unsigned long long*) calloc(num_node_words, sizeof(unsigned long long));
+  for(j = 0; j < num_nodes; j++){
+    free_node_words[j / 64] |= 1ULL << (j % 64);
+  }
+  first_free_word = 0;
+  num_free_nodes = num_nodes;
+}
+
+/* Takes the count lowest-index free nodes (count must not exceed num_free_nodes) */
+void allocateNodes(int* allocation, int count){
+  int k = 0;
+  int word = first_free_word;
+  while(k < count){
+    while(free_node_words[word] == 0)
+      word++;
+    while(free_node_words[word] != 0 && k < count){
+      allocation[k++] = word * 64 + __builtin_ctzll(free_node_words[word]);
+      //clear the lowest set bit
+      free_node_words[word] &= free_node_words[word] - 1;
+    }
+  }
+  while(word < num_node_words && free_node_words[word] == 0)
+    word++;
+  first_free_word = word;
+  num_free_nodes -= count;
+}
+
+void releaseNodes(const int* allocation, int count){
+  int k;
+  for(k = 0; k < count; k++){
+    free_node_words[allocation[k] / 64] |= 1ULL << (allocation[k] % 64);
+    if(allocation[k] / 64 < first_free_word)
+      first_free_word = allocation[k] / 64;
+  }
+  num_free_nodes += count;
+}
+
+/* Events are the starts and completions of the tasks. A retry is a dispatch delayed until a
+   completion because too few nodes were free. */
+void printStats(void){
+  fprintf(stderr, "sort_calls: %ld\n", stats_sort_calls);
+  fprintf(stderr, "dispatch_retries: %ld\n", stats_dispatch_retries);
+  fprintf(stderr, "simulated_events: %ld\n", stats_simulated_events);
+}
+
 void sortTasksQueue(double* runtimes, int* cores, int* submit, int policy){
   int i, j;
+  stats_sort_calls++;
   if(policy == FCFS)
     return;
   if(policy == LPT){
@@ -235,6 +314,83 @@ void readModelFile(void){
     }
 }
 
+/* Reads the Q permutations of a batch (one per line, MODEL_NUM_TASKS comma
+ * separated positions in the Q jobs of current-simulation.csv). "-" is stdin. */
+void readBatchFile(const char* filename){
+    int k;
+    int capacity = 1024;
+    FILE* stream = strcmp(filename, "-") == 0 ? stdin : fopen(filename, "r");
+    xbt_assert(stream != NULL, "Unable to open batch file %s", filename);
+
+    batch_permutations = (int*) malloc(capacity * MODEL_NUM_TASKS * sizeof(int));
+
+    char line[4096];
+    while (fgets(line, 4096, stream))
+    {
+        char* tok = strtok(line, ",\n");
+        if(tok == NULL){ // blank line
+          continue;
+        }
+        if(batch_num_trials == capacity){
+          capacity *= 2;
+          batch_permutations = (int*) realloc(batch_permutations, capacity * MODEL_NUM_TASKS * sizeof(int));
+        }
+        for(k = 0; k < MODEL_NUM_TASKS; k++){
+          xbt_assert(tok != NULL, "Permutation %d has less than %d jobs", batch_num_trials, MODEL_NUM_TASKS);
+          batch_permutations[batch_num_trials * MODEL_NUM_TASKS + k] = atoi(tok);
+          tok = strtok(NULL, ",\n");
+        }
+        batch_num_trials++;
+    }
+    if(stream != stdin){
+      fclose(stream);
+    }
+}
+
+/* Places the Q jobs in the order of the given permutation of the batch */
+void loadPermutation(int trial){
+    int k;
+    int* permutation = &batch_permutations[trial * MODEL_NUM_TASKS];
+    for(k = 0; k < MODEL_NUM_TASKS; k++){
+      xbt_assert(permutation[k] >= 0 && permutation[k] < MODEL_NUM_TASKS, "Invalid job %d in permutation %d", permutation[k], trial);
+      model_runtimes[NUM_TASKS_STATE + k] = base_runtimes[NUM_TASKS_STATE + permutation[k]];
+      model_cores[NUM_TASKS_STATE + k] = base_cores[NUM_TASKS_STATE + permutation[k]];
+      model_submit[NUM_TASKS_STATE + k] = base_submit[NUM_TASKS_STATE + permutation[k]];
+      orig_task_positions[k] = NUM_TASKS_STATE + permutation[k];
+    }
+}
+
+void createManagers(void){
+    int i;
+    char sprintf_buffer[64];
+
+    for(i = 0; i < num_managers; i++){
+      sprintf(sprintf_buffer, "node-%d", i+1);
+      MSG_process_create("taskManager", taskManager, NULL, MSG_get_host_by_name(sprintf_buffer));
+    }
+}
+
+double averageSlowdown(void){
+    int i;
+    double sumSlowdown = 0.0f;
+    if(slowdown == NULL){
+      slowdown = (double* ) calloc(MODEL_NUM_TASKS, sizeof(double));
+    }
+    int _count = 0;
+    for (i = NUM_TASKS_STATE; i < number_of_tasks; i++) {
+      double waitTime = task_queue[i].startTime - task_queue[i].submitTime;
+      double runTime = task_queue[i].endTime - task_queue[i].startTime;
+      double quocient = runTime >= TAO ? runTime : TAO;
+      double slow = (waitTime + runTime) / quocient;
+      slowdown[_count] = slow >= 1.0f ? slow : 1.0f;
+      sumSlowdown += slowdown[_count];
+      _count++;
+      //printf("%f %f\n", task_queue[i].startTime, task_queue[i].endTime);
+    }
+
+    return sumSlowdown / MODEL_NUM_TASKS;
+}
+
 /** Emitter function  */
 int master(int argc, char *argv[])
 {
@@ -263,7 +419,17 @@ int c = 0;
 for(i = NUM_TASKS_STATE; i < number_of_tasks; i++){
   orig_task_positions[c++] = i;
 }
-sortTasksQueue(&model_runtimes[NUM_TASKS_STATE], &model_cores[NUM_TASKS_STATE], &model_submit[NUM_TASKS_STATE], chosen_policy);
+if(BATCH){
+  readBatchFile(batch_file);
+  base_runtimes = (double*) malloc(number_of_tasks * sizeof(double));
+  base_submit = (int*) malloc(number_of_tasks * sizeof(int));
+  base_cores = (int*) malloc(number_of_tasks * sizeof(int));
+  memcpy(base_runtimes, model_runtimes, number_of_tasks * sizeof(double));
+  memcpy(base_submit, model_submit, number_of_tasks * sizeof(int));
+  memcpy(base_cores, model_cores, number_of_tasks * sizeof(int));
+}else{
+  sortTasksQueue(&model_runtimes[NUM_TASKS_STATE], &model_cores[NUM_TASKS_STATE], &model_submit[NUM_TASKS_STATE], chosen_policy);
+}
 
 /*  criacao das matrizes de saída */
 //sched_task_placement = (double*) calloc((MAX_TASKS),sizeof(double));
@@ -300,33 +466,35 @@ XBT_INFO("Got %d workers and %d tasks to process", workers_count, number_of_task
 
     todo = xbt_new0(msg_task_t, number_of_tasks);
 
-    busy_workers = (int*) calloc(workers_count, sizeof(int));
+    initFreeNodes(workers_count);
     task_queue = (struct task_t*) malloc(number_of_tasks * sizeof(struct task_t)); 
     //tasks_comp_sizes = (double**) malloc(number_of_tasks * sizeof(double*));
     //tasks_comm_sizes = (double**) malloc(number_of_tasks * sizeof(double*));
     //tasks_allocation = (int**) malloc(number_of_tasks * sizeof(int*));  
     //tasks_workers = xbt_new0(msg_host_t**, number_of_tasks);
+
+    int trial;
+    for (trial = 0; trial < (BATCH ? batch_num_trials : 1); trial++) {
+    if(BATCH){
+      /* every task of the previous permutation is done: the platform is idle */
+      createManagers();
+      loadPermutation(trial);
+      sortTasksQueue(&model_runtimes[NUM_TASKS_STATE], &model_cores[NUM_TASKS_STATE], &model_submit[NUM_TASKS_STATE], chosen_policy);
+      t_offset = MSG_get_clock();
+    }
     
     for (i = 0; i < number_of_tasks; i++) {
       int available_nodes;  
       do{
-        while(MSG_get_clock() < model_submit[i]){//task has not arrived yet 
-          MSG_process_sleep(model_submit[i] - MSG_get_clock());
-        }
-        available_nodes = 0;
-        for (j = 0; j < workers_count; j++) {
-          if(busy_workers[j] == 0){
-            available_nodes++;            
-            if(available_nodes == model_cores[i]){
-              //printf("%d %d\n", available_nodes, model_cores[i]);
-              break;
-            }
-          }
+        while(MSG_get_clock() < model_submit[i] + t_offset){//task has not arrived yet 
+          MSG_process_sleep(model_submit[i] + t_offset - MSG_get_clock());
         }
+        available_nodes = num_free_nodes;
         if(available_nodes < model_cores[i]){
           if(VERBOSE)
             XBT_INFO("Insuficient workers for task \"%d\" (%d available workers. need %d). Waiting.", i, available_nodes, model_cores[i]);
           //MSG_process_sleep(1.0f);
+          stats_dispatch_retries++;
           MSG_process_suspend(p_master);     
         }               
       }while(available_nodes < model_cores[i]);      
@@ -334,7 +502,7 @@ XBT_INFO("Got %d workers and %d tasks to process", workers_count, number_of_task
       task_queue[i].numNodes = model_cores[i];
       task_queue[i].startTime = 0.0f;
       task_queue[i].endTime = 0.0f;
-      task_queue[i].submitTime = model_submit[i];
+      task_queue[i].submitTime = model_submit[i] + t_offset;
       //task_queue[i].task_comp_size = (double*) malloc(model_cores[i] * sizeof(double));
       //task_queue[i].task_comm_size = (double*) malloc(model_cores[i] * model_cores[i] * sizeof(double));
       task_queue[i].task_allocation = (int*) malloc((model_cores[i]) * sizeof(int));      
@@ -346,18 +514,7 @@ XBT_INFO("Got %d workers and %d tasks to process", workers_count, number_of_task
       //tasks_allocation[i][0] = model_cores[i];
       //tasks_workers[i] = xbt_new0(msg_host_t*, model_cores[i]);
 
-      int count = 0;
-      for (j = 0; j < workers_count; j++) {          
-          if(busy_workers[j] == 0){
-            //task_queue[i].task_workers[count] = workers[j];
-            task_queue[i].task_allocation[count] = j;
-            busy_workers[j] = 1;
-            count++;
-          }
-          if(count >= model_cores[i]){
-            break;
-          }
-      }
+      allocateNodes(task_queue[i].task_allocation, model_cores[i]);
 
       msg_host_t self = MSG_host_self();
       double speed = MSG_host_get_speed(self);
@@ -387,6 +544,7 @@ XBT_INFO("Got %d workers and %d tasks to process", workers_count, number_of_task
       if(VERBOSE)
       XBT_INFO("Dispatching \"%s\" [r=%.1f,c=%d, s=%d]", todo[i]->name, model_runtimes[i], model_cores[i], model_submit[i]);
 
+      running_tasks++;
       MSG_task_send(todo[i], MSG_host_get_name(workers[i]));
 
       if(VERBOSE)
@@ -421,6 +579,20 @@ XBT_INFO("Got %d workers and %d tasks to process", workers_count, number_of_task
       }       
     }
 
+    if(BATCH){
+      while(running_tasks > 0){
+        MSG_process_suspend(p_master);
+      }
+      if(VERBOSE)
+        XBT_INFO("Average bounded slowdown of permutation %d: %f", trial, averageSlowdown());
+      else
+        printf("%f\n", averageSlowdown());
+      for (i = 0; i < number_of_tasks; i++) {
+        free(task_queue[i].task_allocation);
+      }
+    }
+    }
+
 if(STATE){
   if(VERBOSE)
     XBT_INFO("All tasks have been dispatched. Let's tell everybody the computation is over.");
@@ -444,7 +616,6 @@ int taskManager(int argc, char *argv[])
 {
   msg_task_t task = NULL;
   struct task_t* _task = NULL;
-  int i;
   int res;
   //while (1) {
     res = MSG_task_receive(&(task),MSG_host_get_name(MSG_host_self()));
@@ -469,16 +640,14 @@ int taskManager(int argc, char *argv[])
     }
     */
     _task->startTime = MSG_get_clock();
+    stats_simulated_events++;
     MSG_task_execute(task);    
     _task->endTime = MSG_get_clock();
+    stats_simulated_events++;
     if(VERBOSE)
     XBT_INFO("\"%s\" done", MSG_task_get_name(task));    
-    int* allocation = _task->task_allocation;
-    int n = _task->numNodes;
-    //int i;
-    for(i = 0; i < n; i++){
-      busy_workers[allocation[i]] = 0;
-    } 
+    releaseNodes(_task->task_allocation, _task->numNodes);
+    running_tasks--;
     MSG_task_destroy(task);
     task = NULL;
     MSG_process_resume(p_master);
@@ -493,7 +662,6 @@ msg_error_t test_all(const char *platform_file,
                      const char *application_file)
 {
   msg_error_t res = MSG_OK;
-  int i;
 
   {                             /*  Simulation setting */
     MSG_config("host/model", "default");
@@ -508,31 +676,22 @@ msg_error_t test_all(const char *platform_file,
     
     MSG_launch_application(application_file);
 
-    char sprintf_buffer[64];
-
-    for(i = 0; i < num_managers; i++){
-      sprintf(sprintf_buffer, "node-%d", i+1);
-      MSG_process_create("taskManager", taskManager, NULL, MSG_get_host_by_name(sprintf_buffer));
+    if(!BATCH){ // in batch mode the master creates them for each permutation
+      createManagers();
     }
 
   }
   res = MSG_main();
-  
-  double sumSlowdown = 0.0f;
-  slowdown = (double* ) calloc(MODEL_NUM_TASKS, sizeof(double));
-  int _count = 0;
-  for (i = NUM_TASKS_STATE; i < number_of_tasks; i++) {
-    double waitTime = task_queue[i].startTime - task_queue[i].submitTime;
-    double runTime = task_queue[i].endTime - task_queue[i].startTime;
-    double quocient = runTime >= TAO ? runTime : TAO;
-    double slow = (waitTime + runTime) / quocient;  
-    slowdown[_count] = slow >= 1.0f ? slow : 1.0f;
-    sumSlowdown += slowdown[_count];
-    _count++;
-    //printf("%f %f\n", task_queue[i].startTime, task_queue[i].endTime);
+
+  if(STATS){
+    printStats();
   }
 
-  double AVGSlowdown = sumSlowdown / MODEL_NUM_TASKS;
+  if(BATCH){ // the master already printed the slowdown of every permutation
+    return res;
+  }
+
+  double AVGSlowdown = averageSlowdown();
   
   if(VERBOSE){
     XBT_INFO("Average bounded slowdown: %f", AVGSlowdown);
@@ -563,8 +722,9 @@ int main(int argc, char *argv[])
 
   MSG_init(&argc, argv);
   if (argc < 3) {
-    printf("Usage: %s platform_file deployment_file [-verbose]\n", argv[0]);
+    printf("Usage: %s platform_file deployment_file [-verbose] [-stats] [-state | -batch permutations_file]\n", argv[0]);
     printf("example: %s msg_platform.xml msg_deployment.xml -verbose\n", argv[0]);
+    printf("example: %s msg_platform.xml msg_deployment.xml -batch - < permutations.csv\n", argv[0]);
     exit(1);
   }
   //seed = atoi(argv[3]);
@@ -575,6 +735,14 @@ int main(int argc, char *argv[])
       }
       if (strcmp(argv[i], "-state") == 0){
         STATE = 1;
+      }
+      if (strcmp(argv[i], "-stats") == 0){
+        STATS = 1;
+      }
+      if (strcmp(argv[i], "-batch") == 0){
+        xbt_assert(i + 1 < argc, "-batch expects a permutations file (or - for stdin)");
+        BATCH = 1;
+        batch_file = argv[++i];
       }
 	  if (strcmp(argv[i], "-lpt") == 0){
         chosen_policy = LPT;
@@ -593,6 +761,7 @@ int main(int argc, char *argv[])
       }
     }
   }
+  xbt_assert(!(STATE && BATCH), "-state and -batch cannot be used together");
   res = test_all(argv[1], argv[2]);
 
   if (res == MSG_OK)
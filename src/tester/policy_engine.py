@@ -0,0 +1,559 @@
+import os
+import re
+import sys
+import json
+import heapq
+import pathlib
+import functools
+import numpy as np
+import xml.etree.ElementTree as ET
+
+# Add the src directory to the path so we can import the polynomials of the regressor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "src")))
+from regressor.polynomials import POLYNOMIAL_SIZES, polynomial
+
+# Same constants as sched-simulator-runtime.c and sched-simulator-estimate-backfilling.c
+TAO = 10
+NUM_TASKS_STATE = 16
+QUEUE_NUM_TASKS = 32
+EPSILON = 1e-20
+INT_MAX = 2**31 - 1
+SECONDS_IN_ONE_HOUR = 3600
+
+PARAMETERS_FILE = pathlib.Path(__file__).parent / "parameters.c"
+DEFAULT_COEFFICIENTS = "lublin_256"
+TASK_FILE = "initial-simulation-submit.csv"
+
+# Name and number of coefficients of each polynomial of polynomials.c
+POLYNOMIALS = {name.upper(): (name, size) for name, size in POLYNOMIAL_SIZES.items()}
+
+# Policies scheduling the arrived jobs by increasing score (policy >= F4 in the binaries)
+LOWEST_SCORE_POLICIES = ["F4", "F3", "F2", "F1", "SAF", *POLYNOMIALS]
+# Policies scheduling the arrived jobs by decreasing score
+HIGHEST_SCORE_POLICIES = ["WFP3", "UNICEF"]
+POLICIES = ["FCFS", "SPT", "EASY", *HIGHEST_SCORE_POLICIES, *LOWEST_SCORE_POLICIES]
+
+# Command line flags of the binaries
+POLICY_FLAGS = {f"-{policy.lower()}": policy for policy in POLICIES if policy != "FCFS"}
+
+
+def read_number_of_nodes(deployment):
+    """
+    Read the number of nodes given to the master process in a deployment file of the tester.
+
+    Parameters
+    ----------
+    deployment : str
+        The path to the SimGrid deployment file.
+
+    Returns
+    -------
+    int
+        The number of nodes (the second argument of the master) the jobs are allocated on.
+    """
+    for process in ET.parse(deployment).getroot().iter("process"):
+        if process.get("function") == "master":
+            return int(process.findall("argument")[1].get("value"))
+    raise ValueError(f"No master process found in '{deployment}'")
+
+
+@functools.lru_cache(maxsize=None)
+def read_coefficient_sets(parameters_file=PARAMETERS_FILE):
+    """
+    Read the coefficient sets compiled in parameters.c.
+
+    Returns
+    -------
+    dict
+        The coefficients of each polynomial ("lin" to "sex") of each set, by set name.
+    """
+    with open(parameters_file, "r") as parameters:
+        source = parameters.read()
+
+    sets = {}
+    arrays = re.findall(r"double (\w+)_(lin|qdr|cub|qua|qui|sex)_parameters\[\] = \{(.*?)\};", source, re.S)
+    for name, function, values in arrays:
+        sets.setdefault(name, {})[function] = np.array([float(value) for value in values.split(",")])
+    return sets
+
+
+def load_coefficients(coefficient_set=DEFAULT_COEFFICIENTS):
+    """
+    Load the coefficients of the polynomial policies, as the -coefficients flag of the binaries.
+
+    Parameters
+    ----------
+    coefficient_set : str, optional
+        The name of a set compiled in parameters.c or the path to a regression report
+        written by the regressor. The functions missing from a report keep the
+        coefficients of the default set, with a warning on stderr.
+
+    Returns
+    -------
+    tuple
+        The coefficients of each polynomial ("lin" to "sex") and whether the set takes
+        the runtimes and submit times in hours.
+    """
+    sets = read_coefficient_sets()
+    if coefficient_set in sets:
+        return sets[coefficient_set], coefficient_set == "temporal_normalized"
+
+    try:
+        stat = os.stat(coefficient_set)
+    except OSError:
+        raise ValueError(f"{coefficient_set}: no such coefficient set or file")
+    # A report rewritten at the same path is read again
+    return _load_regression_report(coefficient_set, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_regression_report(filename, mtime, size):
+    try:
+        with open(filename, "r") as report_file:
+            report = json.load(report_file)
+    except OSError:
+        raise ValueError(f"{filename}: no such coefficient set or file")
+
+    coefficients = dict(read_coefficient_sets()[DEFAULT_COEFFICIENTS])
+    sizes = dict(POLYNOMIALS.values())
+    loaded = set()
+    for function in report:
+        name = function["fitted_function"]
+        if name not in sizes:
+            continue
+        theta = function.get("coeficients", function.get("coefficients"))
+        if theta is None or len(theta) != sizes[name]:
+            raise ValueError(f"{filename}: {name} needs {sizes[name]} coefficients")
+        coefficients[name] = np.array(theta, dtype=float)
+        loaded.add(name)
+    for name in sizes:
+        if name not in loaded:
+            print(f"Warning: {filename} has no {name}, using the {DEFAULT_COEFFICIENTS} coefficients", file=sys.stderr)
+    return coefficients, False
+
+
+def _scores(policy, runtimes, cores, submit, curr_time, coefficient_set):
+    task_age = curr_time - submit
+    cores = cores.astype(float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        if policy == "WFP3":
+            return np.power((task_age.astype(np.float32) / runtimes.astype(np.float32)).astype(float), 3) * cores
+        if policy == "UNICEF":
+            return (task_age + EPSILON) / (np.log2(cores + EPSILON) * runtimes)
+        if policy == "F4":
+            return (0.0056500287 * runtimes) * (0.0000024814 * np.sqrt(cores)) + (0.0074444355 * np.log10(submit))
+        if policy == "F3":
+            return (-0.2188093701 * runtimes) * (-0.0000000049 * cores) + (0.0073580361 * np.log10(submit))
+        if policy == "F2":
+            return (0.0000342717 * np.sqrt(runtimes)) * (0.0076562110 * cores) + (0.0067364626 * np.log10(submit))
+        if policy == "F1":
+            return (-0.0155183403 * np.log10(runtimes)) * (-0.0005149209 * cores) + (0.0069596182 * np.log10(submit))
+        if policy == "SAF":
+            return runtimes * cores
+
+        coefficients, temporal_normalized = load_coefficients(coefficient_set)
+        submit = submit.astype(float)
+        if temporal_normalized:
+            runtimes = runtimes / SECONDS_IN_ONE_HOUR
+            submit = submit / SECONDS_IN_ONE_HOUR
+        # The engine of the regressor sums the terms as the code it generates in polynomials.c,
+        # so the scores are the same to the last bit
+        return polynomial((runtimes, cores, submit), coefficients[POLYNOMIALS[policy][0]])
+
+
+def _selection_order(scores, highest):
+    """
+    Order the jobs as the selection loops of sortTasksQueue: repeatedly take the first
+    job with the best score. The loops use +-1e20 as sentinels, so scores beyond them
+    (or NaN) go through the same scan as the binaries.
+    """
+    if highest and np.all(scores > -1e20):
+        return np.argsort(-scores, kind="stable")
+    if not highest and np.all(scores < 1e20):
+        return np.argsort(scores, kind="stable")
+
+    scores = scores.tolist()
+    order = []
+    best_index = 0
+    for _ in range(len(scores)):
+        best = -1e20 if highest else 1e20
+        if not highest:
+            best_index = 0
+        for j, score in enumerate(scores):
+            if (score > best) if highest else (score < best):
+                best = score
+                best_index = j
+        order.append(best_index)
+        scores[best_index] = -1e20 if highest else 1e20
+    return np.array(order, dtype=np.int64)
+
+
+def _exchange_sort_order(keys):
+    """
+    Order the jobs as the SJF exchange sort of sortTasksQueue, which sorts by increasing
+    key but does not keep the order of equal keys.
+    """
+    if len(np.unique(keys)) == len(keys):
+        return np.argsort(keys, kind="stable")
+
+    keys = keys.tolist()
+    order = list(range(len(keys)))
+    for i in range(len(keys)):
+        for j in range(len(keys)):
+            if keys[i] < keys[j]:
+                keys[i], keys[j] = keys[j], keys[i]
+                order[i], order[j] = order[j], order[i]
+    return np.array(order, dtype=np.int64)
+
+
+def _earliest_start(times, free, cores, duration):
+    """
+    The first breakpoint of a free nodes profile (free[k] nodes from times[k] until
+    times[k + 1]) from which cores nodes are free for duration, or None.
+    """
+    blocked = free < cores
+    # The first segment without enough nodes from each breakpoint on
+    next_blocked = np.where(blocked, np.arange(len(times)), len(times))
+    next_blocked = np.minimum.accumulate(next_blocked[::-1])[::-1]
+    fits = ~blocked & (np.append(times, np.inf)[next_blocked] >= times + duration)
+    return int(np.argmax(fits)) if fits.any() else None
+
+
+def _to_int(value):
+    # C int arithmetic wraps around
+    return (value + 2**31) % 2**32 - 2**31
+
+
+class _Cluster:
+    """The state of one simulation: the order of the jobs and the nodes they run on."""
+
+    def __init__(
+        self, jobs, number_of_nodes, policy, estimates, backfilling, conservative, coefficient_set, dispatch_delay
+    ):
+        self.runtimes = np.asarray(jobs["p"], dtype=float)
+        self.cores = np.asarray(jobs["q"], dtype=np.int64)
+        self.submit = np.asarray(jobs["r"], dtype=np.int64)
+        # The runtimes the scheduler knows of: the requested times with estimates, the actual ones otherwise
+        self.requested = np.asarray(jobs["~p"], dtype=float) if estimates else self.runtimes
+        self.number_of_nodes = number_of_nodes
+        self.policy = policy
+        self.backfilling = backfilling or conservative
+        self.conservative = conservative
+        self.coefficient_set = coefficient_set
+        self.dispatch_delay = dispatch_delay
+
+        number_of_jobs = len(self.runtimes)
+        # The job in each position of the dispatch order (all_* arrays of the binaries)
+        self.order = np.arange(number_of_jobs)
+        self.start = np.zeros(number_of_jobs)
+        self.end = np.zeros(number_of_jobs)
+        self.free = np.ones(number_of_nodes, dtype=bool)
+        self.free_nodes = number_of_nodes
+        self.allocation = {}
+        # Positions of the dispatched jobs that have not finished, in dispatch order
+        self.running = []
+        self.clock = 0.0
+        # The master is woken at every completion and at every arrival (taskMonitor)
+        self.events = [(float(time), -1) for time in np.maximum.accumulate(self.submit)]
+        heapq.heapify(self.events)
+
+    def advance(self, time):
+        # Apply every completion up to time
+        while self.events and self.events[0][0] <= time:
+            _, position = heapq.heappop(self.events)
+            if position >= 0:
+                job = self.order[position]
+                self.end[job] = self.start[job] + self.runtimes[job]
+                self.free[self.allocation.pop(position)] = True
+                self.free_nodes += self.cores[job]
+                self.running.remove(position)
+
+    def dispatch(self, position):
+        job = self.order[position]
+        nodes = np.flatnonzero(self.free)[: self.cores[job]]
+        self.free[nodes] = False
+        self.free_nodes -= self.cores[job]
+        self.allocation[position] = nodes
+        self.start[job] = self.clock + self.dispatch_delay
+        self.running.append(position)
+        heapq.heappush(self.events, (self.start[job] + self.runtimes[job], position))
+        # The master waits for the job to reach its worker
+        self.clock = self.start[job]
+        self.advance(self.clock)
+
+    def remaining_times(self, curr_time, number_dispatched):
+        remaining = np.full(number_dispatched, -1.0)
+        if self.running:
+            running = np.array(self.running)
+            jobs = self.order[running]
+            elapsed = (curr_time - self.start[jobs]).astype(np.float32).astype(float)
+            remaining[running] = self.requested[jobs] - elapsed
+        return remaining
+
+    def shadow(self, curr_time, position, needed):
+        """
+        The shadow time and extra nodes of the job at the head of the queue, following
+        backFill: the dispatched jobs are released by (truncated) remaining time until
+        enough nodes are free.
+        """
+        remaining = self.remaining_times(curr_time, position)
+        candidates = np.flatnonzero(remaining != -1.0)
+        # Repeatedly taking the job with the least truncated remaining time: among equal ones, the jobs
+        # past their estimate by a fraction of a second come first in reverse dispatch order, then the others
+        truncated = np.trunc(remaining[candidates])
+        overdue = remaining[candidates] < truncated
+        release_order = candidates[np.lexsort((np.where(overdue, -1 - candidates, candidates), truncated))]
+        available = self.free_nodes + np.cumsum(self.cores[self.order[release_order]])
+        enough = np.flatnonzero(available >= needed)
+        if enough.size:
+            k = enough[0]
+            return _to_int(curr_time + int(remaining[release_order[k]])), int(available[k] - needed)
+
+        # Too few releases: the loop of the binaries
+        remaining = remaining.tolist()
+        available_future = 0
+        min_remaining_task = 0
+        for _ in range(position):
+            min_remaining = INT_MAX
+            for j, value in enumerate(remaining):
+                if value != -1.0 and value < min_remaining:
+                    min_remaining = int(value)
+                    min_remaining_task = j
+            remaining[min_remaining_task] = INT_MAX
+            available_future += self.cores[self.order[min_remaining_task]]
+            if self.free_nodes + available_future >= needed:
+                return _to_int(curr_time + min_remaining), int(self.free_nodes + available_future - needed)
+        return 0, 0
+
+    def release_profile(self, curr_time):
+        """The free nodes from curr_time on, as the running jobs end at their requested times."""
+        times, free = [float(curr_time)], [self.free_nodes]
+        if self.running:
+            jobs = self.order[self.running]
+            # Whole seconds, as curr_time: the jobs ending in the same second are released together.
+            # A job past its requested time is expected to end in the next second
+            ends = np.floor(self.start[jobs] + self.requested[jobs])
+            ends = np.where(ends > curr_time, ends, curr_time + 1)
+            release_times, release_index = np.unique(ends, return_inverse=True)
+            released = np.bincount(release_index, weights=self.cores[jobs], minlength=len(release_times))
+            times += release_times.tolist()
+            free += (self.free_nodes + np.cumsum(released.astype(np.int64))).tolist()
+        return np.array(times), np.array(free, dtype=np.int64)
+
+    def conservative_backfill(self, position, number_arrived, curr_time):
+        """
+        Conservative backfilling, as conservativeBackFill: each arrived job, in queue order,
+        is reserved the earliest time it fits in the free nodes left by the running jobs
+        and by the reservations before it. The first job reserved now moves to the head.
+        """
+        times, free = self.release_profile(curr_time)
+        # Room for the end of every reservation
+        size = len(times)
+        times = np.append(times, np.zeros(number_arrived))
+        free = np.append(free, np.zeros(number_arrived, dtype=np.int64))
+        for k in range(number_arrived):
+            job = self.order[position + k]
+            start = _earliest_start(times[:size], free[:size], self.cores[job], self.requested[job])
+            if start is None:
+                # Wider than the nodes the running jobs release
+                continue
+            if start == 0:
+                self.order[position + 1 : position + k + 1] = self.order[position : position + k].copy()
+                self.order[position] = job
+                return
+            end = times[start] + self.requested[job]
+            if not end > times[start]:
+                continue
+            j = int(np.searchsorted(times[:size], end))
+            if j == size or times[j] != end:
+                times[j + 1 : size + 1] = times[j:size].copy()
+                free[j + 1 : size + 1] = free[j:size].copy()
+                times[j] = end
+                free[j] = free[j - 1]
+                size += 1
+            free[start:j] -= self.cores[job]
+
+    def backfill(self, position, number_arrived, curr_time):
+        if number_arrived == 1:
+            return
+        if self.conservative:
+            self.conservative_backfill(position, number_arrived, curr_time)
+            return
+        head = self.order[position]
+        available = self.free_nodes
+        shadow_time, extra_nodes = 0, 0
+        if available < self.cores[head]:
+            shadow_time, extra_nodes = self.shadow(curr_time, position, self.cores[head])
+
+        queue = self.order[position + 1 : position + number_arrived]
+        fits = ((self.cores[queue] <= available) & (curr_time + self.requested[queue] <= shadow_time)) | (
+            self.cores[queue] <= min(available, extra_nodes)
+        )
+        if fits.any():
+            # Move the first job that fits to the head of the queue
+            k = int(np.argmax(fits)) + 1
+            backfilled = self.order[position + k]
+            self.order[position + 1 : position + k + 1] = self.order[position : position + k].copy()
+            self.order[position] = backfilled
+
+    def sort_queue(self, position):
+        """Reorder the arrived jobs of the next QUEUE_NUM_TASKS, as sortTasksQueue."""
+        curr_time = int(self.clock)
+        window = self.order[position : position + QUEUE_NUM_TASKS]
+        arrived = self.submit[window] <= curr_time
+        number_arrived = len(window) if arrived.all() else int(np.argmin(arrived))
+        if number_arrived == 1:
+            return
+
+        if self.policy == "EASY":
+            self.backfill(position, number_arrived, curr_time)
+            return
+        if self.policy != "FCFS":
+            queue = window[:number_arrived]
+            if self.policy == "SPT":
+                order = _exchange_sort_order(self.requested[queue])
+            else:
+                scores = _scores(
+                    self.policy,
+                    self.requested[queue],
+                    self.cores[queue],
+                    self.submit[queue],
+                    curr_time,
+                    self.coefficient_set,
+                )
+                order = _selection_order(scores, self.policy in HIGHEST_SCORE_POLICIES)
+            self.order[position : position + number_arrived] = queue[order]
+        if self.backfilling:
+            self.backfill(position, number_arrived, curr_time)
+
+    def run(self):
+        for position in range(len(self.order)):
+            while True:
+                if position >= NUM_TASKS_STATE:
+                    self.sort_queue(position)
+                job = self.order[position]
+                if self.clock < self.submit[job]:
+                    self.clock = float(self.submit[job])
+                    self.advance(self.clock)
+                if self.free_nodes >= self.cores[job]:
+                    break
+                # Suspended until the next completion or arrival
+                if not self.events:
+                    raise RuntimeError(f"Job {job} can never get {self.cores[job]} nodes")
+                self.clock = self.events[0][0]
+                self.advance(self.clock)
+            self.dispatch(position)
+        self.advance(np.inf)
+
+
+def simulate_policy(
+    jobs,
+    number_of_nodes,
+    policy,
+    estimates=False,
+    backfilling=False,
+    coefficient_set=DEFAULT_COEFFICIENTS,
+    dispatch_delay=0.0,
+    conservative=False,
+):
+    """
+    Simulate the scheduling of a tester experiment in-process, as sched-simulator-runtime
+    (estimates=False) or sched-simulator-estimate-backfilling (estimates=True).
+
+    The first NUM_TASKS_STATE jobs are dispatched in order. Then, before each dispatch,
+    the arrived jobs among the next QUEUE_NUM_TASKS are reordered by the policy (and
+    EASY-backfilled with backfilling=True or the EASY policy, conservatively backfilled
+    with conservative=True), the head job waits for its submit time and for enough free
+    nodes, and takes the lowest-index free nodes.
+    The master is woken at every completion and arrival, which are kept in a heap.
+
+    Parameters
+    ----------
+    jobs : dict
+        The jobs of the experiment, with the keys "p" (runtimes), "q" (nodes), "r"
+        (submit times relative to the first job) and, with estimates, "~p" (requested times).
+    number_of_nodes : int
+        The number of nodes of the platform.
+    policy : str
+        One of POLICIES.
+    estimates : bool, optional
+        Whether the scheduler only knows the requested times of the jobs.
+    backfilling : bool, optional
+        Whether the reordered queue is EASY-backfilled (-bf, only with estimates).
+    coefficient_set : str, optional
+        The coefficients of the polynomial policies, as in load_coefficients.
+    dispatch_delay : float, optional
+        The time spent by the master to send a job to its worker. SimGrid charges the
+        transfer of the job description (1000 bytes) on the platform links.
+    conservative : bool, optional
+        Whether the reordered queue is conservatively backfilled instead (-cbf, only
+        with estimates): every arrived job keeps a reservation.
+
+    Returns
+    -------
+    float
+        The average bounded slowdown (TAO=10) of the jobs after the first NUM_TASKS_STATE.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy '{policy}'")
+    if (backfilling or conservative) and not estimates:
+        raise ValueError("Backfilling (-bf, -cbf) is only available with estimates")
+    widest_job = np.max(jobs["q"], initial=0)
+    if widest_job > number_of_nodes:
+        raise ValueError(f"A job requests {widest_job} nodes but the platform has only {number_of_nodes}")
+
+    cluster = _Cluster(
+        jobs, number_of_nodes, policy, estimates, backfilling, conservative, coefficient_set, dispatch_delay
+    )
+    cluster.run()
+
+    queue = cluster.order[NUM_TASKS_STATE:]
+    wait_time = cluster.start[queue] - cluster.submit[queue]
+    run_time = cluster.end[queue] - cluster.start[queue]
+    slowdown = (wait_time + run_time) / np.maximum(run_time, TAO)
+    return float(np.mean(np.maximum(slowdown, 1.0)))
+
+
+def read_task_file(filename, number_of_tasks):
+    tasks = np.loadtxt(filename, delimiter=",", ndmin=2)[:number_of_tasks]
+    jobs = {"p": tasks[:, 0], "q": tasks[:, 1].astype(np.int64), "r": tasks[:, 2].astype(np.int64)}
+    if tasks.shape[1] > 3:
+        jobs["~p"] = tasks[:, 3]
+    return jobs
+
+
+if __name__ == "__main__":
+    # Same arguments and output as the binaries, reading initial-simulation-submit.csv
+    # from the working directory, plus -estimate to follow sched-simulator-estimate-backfilling
+    if len(sys.argv) < 2:
+        print(f"usage: python {sys.argv[0]} deployment_file [-estimate] [-bf | -cbf] [-policy] [-coefficients set] -nt N")
+        sys.exit(1)
+
+    arguments = sys.argv[2:]
+    policy = "FCFS"
+    coefficient_set = DEFAULT_COEFFICIENTS
+    number_of_tasks = 0
+    for i, argument in enumerate(arguments):
+        if argument in POLICY_FLAGS:
+            policy = POLICY_FLAGS[argument]
+        elif argument == "-coefficients":
+            coefficient_set = arguments[i + 1]
+        elif argument == "-nt":
+            number_of_tasks = int(arguments[i + 1])
+    if number_of_tasks == 0:
+        print("Invalid number_of_tasks parameter. Please set -nt parameter in runtime.")
+        sys.exit(1)
+
+    estimates = "-estimate" in arguments
+    print(
+        "%f"
+        % simulate_policy(
+            read_task_file(TASK_FILE, number_of_tasks),
+            read_number_of_nodes(sys.argv[1]),
+            policy,
+            estimates=estimates,
+            backfilling=estimates and "-bf" in arguments,
+            coefficient_set=coefficient_set,
+            conservative=estimates and "-cbf" in arguments,
+        )
+    )
@@ -1,226 +1,372 @@
 #include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 #include "polynomials.h"
 #include "parameters.h"
 
-#define PARAMETERS 2
+#define DEFAULT_COEFFICIENTS "lublin_256"
 #define SECONDS_IN_ONE_HOUR 3600
+#define NUMBER_OF_POLYNOMIALS 6
+#define MAX_COEFFICIENTS 34
 
-double linear(double p, double q, double r)
+static const char *polynomial_names[NUMBER_OF_POLYNOMIALS] = {"lin", "qdr", "cub", "qua", "qui", "sex"};
+static const int polynomial_sizes[NUMBER_OF_POLYNOMIALS] = {4, 8, 13, 19, 26, 34};
+
+typedef struct
 {
-    double *theta;
-    
-    if(PARAMETERS == 1)
-    {
-        p = p / SECONDS_IN_ONE_HOUR;
-        r = r / SECONDS_IN_ONE_HOUR;
-        theta = temporal_normalized_lin_parameters; 
-    }
-    else if(PARAMETERS == 2)
-    {
-        theta = lublin_256_lin_parameters;
-    }
-    else if(PARAMETERS == 3)
+    const char *name;
+    int temporal_normalized; /* p and r are given in hours */
+    double *theta[NUMBER_OF_POLYNOMIALS];
+} coefficient_set_t;
+
+/* The coefficient sets compiled in parameters.c */
+static coefficient_set_t coefficient_sets[] = {
+    {"default", 0, {default_lin_parameters, default_qdr_parameters, default_cub_parameters,
+                    default_qua_parameters, default_qui_parameters, default_sex_parameters}},
+    {"temporal_normalized", 1, {temporal_normalized_lin_parameters, temporal_normalized_qdr_parameters,
+                                temporal_normalized_cub_parameters, temporal_normalized_qua_parameters,
+                                temporal_normalized_qui_parameters, temporal_normalized_sex_parameters}},
+    {"lublin_256", 0, {lublin_256_lin_parameters, lublin_256_qdr_parameters, lublin_256_cub_parameters,
+                       lublin_256_qua_parameters, lublin_256_qui_parameters, lublin_256_sex_parameters}},
+    {"ctc_sp2", 0, {ctc_sp2_lin_parameters, ctc_sp2_qdr_parameters, ctc_sp2_cub_parameters,
+                    ctc_sp2_qua_parameters, ctc_sp2_qui_parameters, ctc_sp2_sex_parameters}},
+    {"sdsc_blue", 0, {sdsc_blue_lin_parameters, sdsc_blue_qdr_parameters, sdsc_blue_cub_parameters,
+                      sdsc_blue_qua_parameters, sdsc_blue_qui_parameters, sdsc_blue_sex_parameters}},
+};
+
+/* The coefficients loaded from a regression report */
+static double loaded_parameters[NUMBER_OF_POLYNOMIALS][MAX_COEFFICIENTS];
+static coefficient_set_t loaded_set = {"loaded", 0, {loaded_parameters[0], loaded_parameters[1], loaded_parameters[2],
+                                                     loaded_parameters[3], loaded_parameters[4], loaded_parameters[5]}};
+
+static coefficient_set_t *coefficients = NULL;
+
+static coefficient_set_t *find_coefficient_set(const char *name)
+{
+    int i;
+    for (i = 0; i < (int)(sizeof(coefficient_sets) / sizeof(coefficient_sets[0])); i++)
     {
-        theta = ctc_sp2_lin_parameters;
+        if (strcmp(coefficient_sets[i].name, name) == 0)
+        {
+            return &coefficient_sets[i];
+        }
     }
-    else if(PARAMETERS == 4)
+    return NULL;
+}
+
+static coefficient_set_t *get_coefficients(void)
+{
+    if (coefficients == NULL)
     {
-        theta = sdsc_blue_lin_parameters;
+        coefficients = find_coefficient_set(DEFAULT_COEFFICIENTS);
     }
-    else
+    return coefficients;
+}
+
+/* Find the next occurrence of a key ("name":) in text[start, end) */
+static const char *find_key(const char *start, const char *end, const char *key)
+{
+    size_t length = strlen(key);
+    const char *position;
+    for (position = start; position + length + 2 <= end; position++)
     {
-        theta = default_lin_parameters;
+        if (*position == '"' && strncmp(position + 1, key, length) == 0 && position[length + 1] == '"')
+        {
+            position += length + 2;
+            while (position < end && (*position == ' ' || *position == '\t' || *position == '\n' || *position == '\r'))
+            {
+                position++;
+            }
+            if (position < end && *position == ':')
+            {
+                return position + 1;
+            }
+        }
     }
-    
-    return theta[0] \
-            + theta[1]*p + theta[2]*q + theta[3]*r;
+    return NULL;
 }
 
-double quadratic(double p, double q, double r)
+/* Read the coefficients of the object of a regression report in text[start, end) */
+static int load_function(const char *filename, const char *start, const char *end, int *loaded)
 {
-    double *theta;
+    const char *value = find_key(start, end, "fitted_function");
+    const char *name_end;
+    char *number_end;
+    int function, count;
 
-    if(PARAMETERS == 1)
+    if (value == NULL)
     {
-        p = p / SECONDS_IN_ONE_HOUR;
-        r = r / SECONDS_IN_ONE_HOUR;
-        theta = temporal_normalized_qdr_parameters; 
+        return 0;
     }
-    else if(PARAMETERS == 2)
+    value = strchr(value, '"');
+    if (value == NULL || value >= end || (name_end = strchr(value + 1, '"')) == NULL || name_end >= end)
     {
-        theta = lublin_256_qdr_parameters;
+        fprintf(stderr, "%s: invalid fitted_function\n", filename);
+        return -1;
     }
-    else if(PARAMETERS == 3)
+    value++;
+    for (function = 0; function < NUMBER_OF_POLYNOMIALS; function++)
     {
-        theta = ctc_sp2_qdr_parameters;
+        if ((size_t)(name_end - value) == strlen(polynomial_names[function]) &&
+            strncmp(value, polynomial_names[function], name_end - value) == 0)
+        {
+            break;
+        }
     }
-    else if(PARAMETERS == 4)
+    if (function == NUMBER_OF_POLYNOMIALS)
     {
-        theta = sdsc_blue_qdr_parameters;
+        /* A function the simulators do not know */
+        return 0;
     }
-    else
+
+    value = find_key(start, end, "coeficients");
+    if (value == NULL)
     {
-        theta = default_qdr_parameters;
+        value = find_key(start, end, "coefficients");
     }
-    
-    return theta[0] \
-            + theta[1]*p + theta[2]*q + theta[3]*r \
-            + theta[4]*pow(p,2) + theta[5]*pow(q,2) + theta[6]*pow(r,2) \
-            + theta[7]*p*q;
+    if (value == NULL || (value = strchr(value, '[')) == NULL || value >= end)
+    {
+        fprintf(stderr, "%s: no coefficients for %s\n", filename, polynomial_names[function]);
+        return -1;
+    }
+    value++;
+    for (count = 0;; count++)
+    {
+        while (value < end && *value != '\0' && strchr(" \t\r\n,", *value) != NULL)
+        {
+            value++;
+        }
+        if (value >= end || *value == ']')
+        {
+            break;
+        }
+        if (count == polynomial_sizes[function])
+        {
+            count++;
+            break;
+        }
+        loaded_parameters[function][count] = strtod(value, &number_end);
+        if (number_end == value)
+        {
+            fprintf(stderr, "%s: invalid coefficient of %s\n", filename, polynomial_names[function]);
+            return -1;
+        }
+        value = number_end;
+    }
+    if (count != polynomial_sizes[function])
+    {
+        fprintf(stderr, "%s: %s needs %d coefficients\n", filename, polynomial_names[function],
+                polynomial_sizes[function]);
+        return -1;
+    }
+    loaded[function] = 1;
+    return 0;
 }
 
-double cubic(double p, double q, double r)
+/* Read the regression report written by Regressor.regression: a list of objects with a
+   fitted_function name and its coeficients. The functions missing from the report keep the
+   coefficients of the default set, with a warning on stderr. */
+static int load_regression_report(const char *filename)
 {
-    double *theta;
+    FILE *file = fopen(filename, "rb");
+    char *text;
+    const char *position, *object_start = NULL;
+    long size;
+    int depth = 0, in_string = 0, status = 0, function;
+    int loaded[NUMBER_OF_POLYNOMIALS] = {0};
 
-    if(PARAMETERS == 1)
+    if (file == NULL)
     {
-        p = p / SECONDS_IN_ONE_HOUR;
-        r = r / SECONDS_IN_ONE_HOUR;
-        theta = temporal_normalized_cub_parameters; 
+        fprintf(stderr, "%s: no such coefficient set or file\n", filename);
+        return -1;
     }
-    else if(PARAMETERS == 2)
+    fseek(file, 0, SEEK_END);
+    size = ftell(file);
+    fseek(file, 0, SEEK_SET);
+    text = size < 0 ? NULL : (char *)malloc(size + 1);
+    if (text == NULL || fread(text, 1, size, file) != (size_t)size)
     {
-        theta = lublin_256_cub_parameters;
+        fclose(file);
+        free(text);
+        fprintf(stderr, "%s: read error\n", filename);
+        return -1;
     }
-    else if(PARAMETERS == 3)
+    fclose(file);
+    text[size] = '\0';
+
+    for (position = text; *position != '\0' && status == 0; position++)
+    {
+        if (in_string)
+        {
+            if (*position == '\\' && position[1] != '\0')
+            {
+                position++;
+            }
+            else if (*position == '"')
+            {
+                in_string = 0;
+            }
+        }
+        else if (*position == '"')
+        {
+            in_string = 1;
+        }
+        else if (*position == '{')
+        {
+            if (++depth == 1)
+            {
+                object_start = position;
+            }
+        }
+        else if (*position == '}')
+        {
+            if (--depth == 0)
+            {
+                status = load_function(filename, object_start, position, loaded);
+            }
+        }
+    }
+    free(text);
+    if (status != 0)
+    {
+        return -1;
+    }
+
+    loaded_set.name = filename;
+    for (function = 0; function < NUMBER_OF_POLYNOMIALS; function++)
     {
-        theta = ctc_sp2_cub_parameters;
+        if (!loaded[function])
+        {
+            fprintf(stderr, "Warning: %s has no %s, using the %s coefficients\n", filename, polynomial_names[function],
+                    DEFAULT_COEFFICIENTS);
+            memcpy(loaded_parameters[function], find_coefficient_set(DEFAULT_COEFFICIENTS)->theta[function],
+                   polynomial_sizes[function] * sizeof(double));
+        }
     }
-    else if(PARAMETERS == 4)
+    coefficients = &loaded_set;
+    return 0;
+}
+
+int set_coefficients(const char *name)
+{
+    coefficient_set_t *set = find_coefficient_set(name);
+    if (set != NULL)
     {
-        theta = sdsc_blue_cub_parameters;
+        coefficients = set;
+        return 0;
     }
-    else
+    return load_regression_report(name);
+}
+
+/* The coefficients of a polynomial, with p and r in the unit of the chosen set */
+static double *get_theta(int function, double *p, double *r)
+{
+    coefficient_set_t *set = get_coefficients();
+    if (set->temporal_normalized)
     {
-        theta = default_cub_parameters;
+        *p = *p / SECONDS_IN_ONE_HOUR;
+        *r = *r / SECONDS_IN_ONE_HOUR;
     }
+    return set->theta[function];
+}
+
+/* BEGIN GENERATED CODE: python src/regressor/polynomials.py writes the code up to END */
+
+double linear(double p, double q, double r)
+{
+    double *theta = get_theta(0, &p, &r);
+
+    return theta[0] \
+            + theta[1]*p + theta[2]*q + theta[3]*r;
+}
+
+double quadratic(double p, double q, double r)
+{
+    double *theta = get_theta(1, &p, &r);
+    double p2 = p*p;
+    double q2 = q*q;
+    double r2 = r*r;
+
+    return theta[0] \
+            + theta[1]*p + theta[2]*q + theta[3]*r \
+            + theta[4]*p2 + theta[5]*q2 + theta[6]*r2 \
+            + theta[7]*p*q;
+}
+
+double cubic(double p, double q, double r)
+{
+    double *theta = get_theta(2, &p, &r);
+    double p2 = p*p, p3 = p2*p;
+    double q2 = q*q, q3 = q2*q;
+    double r2 = r*r, r3 = r2*r;
 
     return theta[0] \
             + theta[1]*p + theta[2]*q + theta[3]*r \
-            + theta[4]*pow(p,2) + theta[5]*pow(q,2) + theta[6]*pow(r,2) \
+            + theta[4]*p2 + theta[5]*q2 + theta[6]*r2 \
             + theta[7]*p*q \
-            + theta[8]*pow(p,3) + theta[9]*pow(q,3) + theta[10]*pow(r,3) \
-            + theta[11]*pow(p,2)*q + theta[12]*p*pow(q,2);
+            + theta[8]*p3 + theta[9]*q3 + theta[10]*r3 \
+            + theta[11]*p2*q + theta[12]*p*q2;
 }
 
 double quartic(double p, double q, double r)
 {
-    double *theta;
-
-    if(PARAMETERS == 1)
-    {
-        p = p / SECONDS_IN_ONE_HOUR;
-        r = r / SECONDS_IN_ONE_HOUR;
-        theta = temporal_normalized_qua_parameters; 
-    }
-    else if(PARAMETERS == 2)
-    {
-        theta = lublin_256_qua_parameters;
-    }
-    else if(PARAMETERS == 3)
-    {
-        theta = ctc_sp2_qua_parameters;
-    }
-    else if(PARAMETERS == 4)
-    {
-        theta = sdsc_blue_qua_parameters;
-    }
-    else
-    {
-        theta = default_qua_parameters;
-    }
+    double *theta = get_theta(3, &p, &r);
+    double p2 = p*p, p3 = p2*p, p4 = p3*p;
+    double q2 = q*q, q3 = q2*q, q4 = q3*q;
+    double r2 = r*r, r3 = r2*r, r4 = r3*r;
 
     return theta[0] \
             + theta[1]*p + theta[2]*q + theta[3]*r \
-            + theta[4]*pow(p,2) + theta[5]*pow(q,2) + theta[6]*pow(r,2) \
+            + theta[4]*p2 + theta[5]*q2 + theta[6]*r2 \
             + theta[7]*p*q \
-            + theta[8]*pow(p,3) + theta[9]*pow(q,3) + theta[10]*pow(r,3) \
-            + theta[11]*pow(p,2)*q + theta[12]*p*pow(q,2) \
-            + theta[13]*pow(p,4) + theta[14]*pow(q,4) + theta[15]*pow(r,4) \
-            + theta[16]*pow(p,3)*q + theta[17]*pow(p,2)*pow(q,2) + theta[18]*p*pow(q,3);
+            + theta[8]*p3 + theta[9]*q3 + theta[10]*r3 \
+            + theta[11]*p2*q + theta[12]*p*q2 \
+            + theta[13]*p4 + theta[14]*q4 + theta[15]*r4 \
+            + theta[16]*p3*q + theta[17]*p2*q2 + theta[18]*p*q3;
 }
 
 double quintic(double p, double q, double r)
 {
-    double *theta;
-
-    if(PARAMETERS == 1)
-    {
-        p = p / SECONDS_IN_ONE_HOUR;
-        r = r / SECONDS_IN_ONE_HOUR;
-        theta = temporal_normalized_qui_parameters; 
-    }
-    else if(PARAMETERS == 2)
-    {
-        theta = lublin_256_qui_parameters;
-    }
-    else if(PARAMETERS == 3)
-    {
-        theta = ctc_sp2_qui_parameters;
-    }
-    else if(PARAMETERS == 4)
-    {
-        theta = sdsc_blue_qui_parameters;
-    }
-    else
-    {
-        theta = default_qui_parameters;
-    }
+    double *theta = get_theta(4, &p, &r);
+    double p2 = p*p, p3 = p2*p, p4 = p3*p, p5 = p4*p;
+    double q2 = q*q, q3 = q2*q, q4 = q3*q, q5 = q4*q;
+    double r2 = r*r, r3 = r2*r, r4 = r3*r, r5 = r4*r;
 
     return theta[0] \
             + theta[1]*p + theta[2]*q + theta[3]*r \
-            + theta[4]*pow(p,2) + theta[5]*pow(q,2) + theta[6]*pow(r,2) \
+            + theta[4]*p2 + theta[5]*q2 + theta[6]*r2 \
             + theta[7]*p*q \
-            + theta[8]*pow(p,3) + theta[9]*pow(q,3) + theta[10]*pow(r,3) \
-            + theta[11]*pow(p,2)*q + theta[12]*p*pow(q,2) \
-            + theta[13]*pow(p,4) + theta[14]*pow(q,4) + theta[15]*pow(r,4) \
-            + theta[16]*pow(p,3)*q + theta[17]*pow(p,2)*pow(q,2) + theta[18]*p*pow(q,3) \
-            + theta[19]*pow(p,5) + theta[20]*pow(q,5) + theta[21]*pow(r,5) \
-            + theta[22]*pow(p,4)*q + theta[23]*pow(p,3)*pow(q,2) \
-            + theta[24]*pow(p,2)*pow(q,3) + theta[25]*p*pow(q,4);
+            + theta[8]*p3 + theta[9]*q3 + theta[10]*r3 \
+            + theta[11]*p2*q + theta[12]*p*q2 \
+            + theta[13]*p4 + theta[14]*q4 + theta[15]*r4 \
+            + theta[16]*p3*q + theta[17]*p2*q2 + theta[18]*p*q3 \
+            + theta[19]*p5 + theta[20]*q5 + theta[21]*r5 \
+            + theta[22]*p4*q + theta[23]*p3*q2 + theta[24]*p2*q3 \
+            + theta[25]*p*q4;
 }
 
 double sextic(double p, double q, double r)
 {
-    double *theta;
-    
-    if(PARAMETERS == 1)
-    {
-        p = p / SECONDS_IN_ONE_HOUR;
-        r = r / SECONDS_IN_ONE_HOUR;
-        theta = temporal_normalized_sex_parameters; 
-    }
-    else if(PARAMETERS == 2)
-    {
-        theta = lublin_256_sex_parameters;
-    }
-    else if(PARAMETERS == 3)
-    {
-        theta = ctc_sp2_sex_parameters;
-    }
-    else if(PARAMETERS == 4)
-    {
-        theta = sdsc_blue_sex_parameters;
-    }
-    else
-    {
-        theta = default_sex_parameters;
-    }
+    double *theta = get_theta(5, &p, &r);
+    double p2 = p*p, p3 = p2*p, p4 = p3*p, p5 = p4*p, p6 = p5*p;
+    double q2 = q*q, q3 = q2*q, q4 = q3*q, q5 = q4*q, q6 = q5*q;
+    double r2 = r*r, r3 = r2*r, r4 = r3*r, r5 = r4*r, r6 = r5*r;
 
     return theta[0] \
             + theta[1]*p + theta[2]*q + theta[3]*r \
-            + theta[4]*pow(p,2) + theta[5]*pow(q,2) + theta[6]*pow(r,2) \
+            + theta[4]*p2 + theta[5]*q2 + theta[6]*r2 \
             + theta[7]*p*q \
-            + theta[8]*pow(p,3) + theta[9]*pow(q,3) + theta[10]*pow(r,3) \
-            + theta[11]*pow(p,2)*q + theta[12]*p*pow(q,2) \
-            + theta[13]*pow(p,4) + theta[14]*pow(q,4) + theta[15]*pow(r,4) \
-            + theta[16]*pow(p,3)*q + theta[17]*pow(p,2)*pow(q,2) + theta[18]*p*pow(q,3) \
-            + theta[19]*pow(p,5) + theta[20]*pow(q,5) + theta[21]*pow(r,5) \
-            + theta[22]*pow(p,4)*q + theta[23]*pow(p,3)*pow(q,2) \
-            + theta[24]*pow(p,2)*pow(q,3) + theta[25]*p*pow(q,4) \
-            + theta[26]*pow(p,6) + theta[27]*pow(q,6) + theta[28]*pow(r,6) \
-            + theta[29]*pow(p,5)*q + theta[30]*pow(p,4)*pow(q,2) \
-            + theta[31]*pow(p,3)*pow(q,3) \
-            + theta[32]*pow(p,2)*pow(q,4) + theta[33]*p*pow(q,5);
-}
\ No newline at end of file
+            + theta[8]*p3 + theta[9]*q3 + theta[10]*r3 \
+            + theta[11]*p2*q + theta[12]*p*q2 \
+            + theta[13]*p4 + theta[14]*q4 + theta[15]*r4 \
+            + theta[16]*p3*q + theta[17]*p2*q2 + theta[18]*p*q3 \
+            + theta[19]*p5 + theta[20]*q5 + theta[21]*r5 \
+            + theta[22]*p4*q + theta[23]*p3*q2 + theta[24]*p2*q3 \
+            + theta[25]*p*q4 \
+            + theta[26]*p6 + theta[27]*q6 + theta[28]*r6 \
+            + theta[29]*p5*q + theta[30]*p4*q2 + theta[31]*p3*q3 \
+            + theta[32]*p2*q4 + theta[33]*p*q5;
+}
+
+/* END GENERATED CODE */
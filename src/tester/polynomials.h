@@ -8,4 +8,8 @@ double quartic(double p, double q, double r);
 double quintic(double p, double q, double r);
 double sextic(double p, double q, double r);
 
+/* Select a coefficient set compiled in parameters.c by its name (default, temporal_normalized,
+   lublin_256, ctc_sp2 or sdsc_blue) or load one from a regression report. Returns 0 on success. */
+int set_coefficients(const char *name);
+
 #endif
\ No newline at end of file
@@ -0,0 +1,92 @@
+import hashlib
+import pathlib
+import sqlite3
+
+# Columns identifying a tester run: the content of the trace and of the deployment file, the jobs of
+# the window (first job and number of jobs among the filtered jobs of the trace), how it was simulated
+# and the content of the simulator (the binary, or the sources of the python backend)
+KEY_COLUMNS = [
+    "trace",
+    "deployment",
+    "first_job",
+    "number_of_jobs",
+    "sim_type",
+    "backfilling",
+    "policy",
+    "coefficients",
+    "backend",
+    "simulator",
+]
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class ResultCache:
+    """
+    A persistent cache of the slowdowns of the tester runs, in a SQLite database.
+
+    Every slowdown is committed as soon as it is stored, so an interrupted experiment only loses
+    the runs in progress. The hash of a file is computed once for each path, size and modification
+    time. Without a filename the cache only lives in memory. The results of a cache written with
+    other KEY_COLUMNS are dropped, as they cannot be told apart.
+    """
+
+    def __init__(self, filename=None):
+        self.connection = sqlite3.connect(":memory:" if filename is None else str(filename), timeout=60)
+        with self.connection:
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(results)")]
+            if columns and columns != [*KEY_COLUMNS, "slowdown"]:
+                self.connection.execute("DROP TABLE results")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT)"
+            )
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS results ({', '.join(KEY_COLUMNS)}, slowdown REAL, "
+                f"PRIMARY KEY ({', '.join(KEY_COLUMNS)}))"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def file_hash(self, filename):
+        path = pathlib.Path(filename).resolve()
+        stat = path.stat()
+        row = self.connection.execute(
+            "SELECT hash FROM files WHERE path = ? AND size = ? AND mtime = ?",
+            (str(path), stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (str(path), stat.st_size, stat.st_mtime_ns, digest.hexdigest()),
+            )
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the slowdown stored for a key (the values of KEY_COLUMNS), or None."""
+        row = self.connection.execute(
+            f"SELECT slowdown FROM results WHERE {' AND '.join(f'{column} = ?' for column in KEY_COLUMNS)}", key
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, slowdown):
+        with self.connection:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO results VALUES ({', '.join('?' * (len(KEY_COLUMNS) + 1))})", (*key, slowdown)
+            )
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM results")
@@ -19,6 +19,19 @@ XBT_LOG_NEW_DEFAULT_CATEGORY(msg_test,
 
 void backFill(double *runtimes, int *cores, int *submit, int *orig_pos, int policy, int queue_num_tasks, int num_tasks_disp);
 void sortTasksQueue(double *runtimes, int *cores, int *submit, int *orig_pos, int policy, int queue_num_tasks, int num_tasks_disp);
+double taskScore(int policy, double runtime, int cores, int submit, int task_age);
+void initFreeNodes(int num_nodes);
+void allocateNodes(int *allocation, int count);
+void releaseNodes(const int *allocation, int count);
+void printStats(void);
+void addRunningTask(int task);
+void removeRunningTask(int task);
+int profileShadowTime(int curr_time, int available_nodes, int needed, int num_tasks_disp, int *shadow_time, int *extra_nodes);
+void scanShadowTime(int curr_time, int available_nodes, int needed, int num_tasks_disp, int *shadow_time, int *extra_nodes);
+int compareQueueIndexes(const void *a, const void *b);
+int sortQueueIndexes(int num_arrived_tasks, int descending);
+int queueScoresInRange(int num_arrived_tasks, int descending);
+void reorderQueue(double *runtimes, int *cores, int *submit, int *orig_pos, int num_arrived_tasks);
 const char *getfield(char *line, int num);
 void readModelFile(void);
 int master(int argc, char *argv[]);
@@ -77,6 +90,7 @@ struct task_t
 // int seed;
 int VERBOSE = 0;
 int STATE = 0;
+int STATS = 0;
 
 double *all_runtimes;
 int *all_submit;
@@ -95,7 +109,6 @@ struct task_t *task_queue = NULL;
 msg_process_t p_master;
 
 int chosen_policy = FCFS;
-int *busy_workers;
 int num_managers;
 int number_of_nodes;
 
@@ -105,26 +118,224 @@ double *sched_task_placement;
 // int number_of_tasks = QUEUE_NUM_TASKS + NUM_TASKS_STATE;
 double t0 = 0.0f;
 
-void backFill(double *runtimes, int *cores, int *submit, int *orig_pos, int policy, int queue_num_tasks, int num_tasks_disp)
+/* Free nodes: bit j % 64 of free_node_words[j / 64] is set while node j is free. The words before
+   first_free_word have no free node. */
+unsigned long long *free_node_words = NULL;
+int num_node_words = 0;
+int first_free_word = 0;
+int num_free_nodes = 0;
+
+/* Counters printed to stderr with -stats */
+long stats_sort_calls = 0;
+long stats_backfill_attempts = 0;
+long stats_backfilled_tasks = 0;
+long stats_dispatch_retries = 0;
+long stats_simulated_events = 0;
+long stats_shadow_lookups = 0;
+long stats_shadow_scans = 0;
+
+/* Buffers reused by every sortTasksQueue call (the queue never holds more than QUEUE_NUM_TASKS tasks) */
+double queue_scores[QUEUE_NUM_TASKS];
+int queue_order[QUEUE_NUM_TASKS];
+double queue_r_temp[QUEUE_NUM_TASKS];
+int queue_c_temp[QUEUE_NUM_TASKS];
+int queue_s_temp[QUEUE_NUM_TASKS];
+int queue_p_temp[QUEUE_NUM_TASKS];
+int queue_sort_descending = 0;
+
+/* Scores that do not depend on the current time are computed once per task (indexed by orig_pos) */
+double *task_scores = NULL;
+char *task_score_known = NULL;
+
+/* Started tasks that have not finished yet (task_queue indexes), ordered by expected completion time
+   (startTime + runtime). The task managers add them when they start and remove them when they finish.
+   An addition or a removal finds its position by binary search but shifts the tail of the arrays, so it
+   costs O(r) for r running tasks. */
+int *running_tasks = NULL;
+double *running_ends = NULL;
+int num_running_tasks = 0;
+int num_started_tasks = 0;
+int *shadow_bucket = NULL;
+
+void initFreeNodes(int num_nodes)
 {
-    int i, j;
-    int curr_time = MSG_get_clock();
-    int num_arrived_tasks = 0;
-    for (i = 0; i < queue_num_tasks; i++)
+    int j;
+    num_node_words = (num_nodes + 63) / 64;
+    free_node_words = (unsigned long long *)calloc(num_node_words, sizeof(unsigned long long));
+    for (j = 0; j < num_nodes; j++)
     {
-        if (submit[i] <= curr_time)
+        free_node_words[j / 64] |= 1ULL << (j % 64);
+    }
+    first_free_word = 0;
+    num_free_nodes = num_nodes;
+}
+
+/* Takes the count lowest-index free nodes (count must not exceed num_free_nodes) */
+void allocateNodes(int *allocation, int count)
+{
+    int k = 0;
+    int word = first_free_word;
+    while (k < count)
+    {
+        while (free_node_words[word] == 0)
+            word++;
+        while (free_node_words[word] != 0 && k < count)
         {
-            num_arrived_tasks++;
+            allocation[k++] = word * 64 + __builtin_ctzll(free_node_words[word]);
+            // Clear the lowest set bit
+            free_node_words[word] &= free_node_words[word] - 1;
         }
+    }
+    while (word < num_node_words && free_node_words[word] == 0)
+        word++;
+    first_free_word = word;
+    num_free_nodes -= count;
+}
+
+void releaseNodes(const int *allocation, int count)
+{
+    int k;
+    for (k = 0; k < count; k++)
+    {
+        free_node_words[allocation[k] / 64] |= 1ULL << (allocation[k] % 64);
+        if (allocation[k] / 64 < first_free_word)
+            first_free_word = allocation[k] / 64;
+    }
+    num_free_nodes += count;
+}
+
+/* Events are the arrivals, starts and completions of the tasks. A retry is a dispatch of the queue
+   head delayed until a completion because too few nodes were free. A shadow lookup reads the shadow time
+   of EASY backfilling from the running tasks profile, and a shadow scan is a lookup that fell back to
+   scanShadowTime. */
+void printStats(void)
+{
+    fprintf(stderr, "sort_calls: %ld\n", stats_sort_calls);
+    fprintf(stderr, "backfill_attempts: %ld\n", stats_backfill_attempts);
+    fprintf(stderr, "backfilled_tasks: %ld\n", stats_backfilled_tasks);
+    fprintf(stderr, "dispatch_retries: %ld\n", stats_dispatch_retries);
+    fprintf(stderr, "simulated_events: %ld\n", stats_simulated_events);
+    fprintf(stderr, "shadow_lookups: %ld\n", stats_shadow_lookups);
+    fprintf(stderr, "shadow_scans: %ld\n", stats_shadow_scans);
+}
+
+void addRunningTask(int task)
+{
+    double end = task_queue[task].startTime + all_runtimes[task];
+    int low = 0;
+    int high = num_running_tasks;
+    // After the tasks ending at the same time, so these stay in start order
+    while (low < high)
+    {
+        int middle = (low + high) / 2;
+        if (running_ends[middle] <= end)
+            low = middle + 1;
+        else
+            high = middle;
+    }
+    memmove(&running_tasks[low + 1], &running_tasks[low], (num_running_tasks - low) * sizeof(int));
+    memmove(&running_ends[low + 1], &running_ends[low], (num_running_tasks - low) * sizeof(double));
+    running_tasks[low] = task;
+    running_ends[low] = end;
+    num_running_tasks++;
+    num_started_tasks++;
+}
+
+void removeRunningTask(int task)
+{
+    double end = task_queue[task].startTime + all_runtimes[task];
+    int low = 0;
+    int high = num_running_tasks;
+    while (low < high)
+    {
+        int middle = (low + high) / 2;
+        if (running_ends[middle] < end)
+            low = middle + 1;
         else
+            high = middle;
+    }
+    while (low < num_running_tasks && running_tasks[low] != task)
+        low++;
+    if (low == num_running_tasks)
+        return;
+    memmove(&running_tasks[low], &running_tasks[low + 1], (num_running_tasks - low - 1) * sizeof(int));
+    memmove(&running_ends[low], &running_ends[low + 1], (num_running_tasks - low - 1) * sizeof(double));
+    num_running_tasks--;
+}
+
+/* The shadow time and extra nodes of scanShadowTime, from the running tasks profile: the scan releases the
+   tasks by increasing truncated remaining time. Among the tasks with the same truncated remaining time, those
+   past their expected end by a fraction of a second (a negative remaining time truncated towards zero) come
+   first, in reverse dispatch order, then the others in dispatch order. A task whose remaining time is exactly
+   -1 is taken for a finished one by the scan, so it is never released. Returns 0 when the profile cannot give
+   the same result (a dispatched task has not started yet, the running tasks release too few nodes, or the
+   float elapsed times put the remaining times out of the profile order).
+   The profile is walked from the earliest completion until enough nodes are released, and the tasks
+   with the same remaining time are insertion-sorted: O(r + b^2) for r running tasks and b of them
+   sharing a remaining time, instead of the O(n^2) of scanShadowTime for n dispatched tasks. */
+int profileShadowTime(int curr_time, int available_nodes, int needed, int num_tasks_disp, int *shadow_time, int *extra_nodes)
+{
+    int i, j;
+    int available_nodes_future = 0;
+    int bucket_size = 0;
+    int bucket_remaining = 0;
+    stats_shadow_lookups++;
+    if (num_started_tasks != num_tasks_disp)
+        return 0;
+    for (i = 0; i <= num_running_tasks; i++)
+    {
+        int remaining = 0;
+        int release_key = 0;
+        if (i < num_running_tasks)
         {
-            break;
+            float task_elapsed_time = curr_time - task_queue[running_tasks[i]].startTime;
+            double remaining_time = all_runtimes[running_tasks[i]] - task_elapsed_time;
+            if (remaining_time == -1.0)
+                continue;
+            if (!(remaining_time > INT_MIN && remaining_time < INT_MAX))
+                return 0;
+            remaining = remaining_time;
+            if (bucket_size > 0 && remaining < bucket_remaining)
+                return 0;
+            // Ascending keys give the release order of the scan within the same truncated remaining time
+            release_key = remaining_time < remaining ? -1 - running_tasks[i] : running_tasks[i];
+        }
+        if (bucket_size > 0 && (i == num_running_tasks || remaining != bucket_remaining))
+        {
+            for (j = 1; j < bucket_size; j++)
+            {
+                int key = shadow_bucket[j];
+                int k = j - 1;
+                for (; k >= 0 && shadow_bucket[k] > key; k--)
+                    shadow_bucket[k + 1] = shadow_bucket[k];
+                shadow_bucket[k + 1] = key;
+            }
+            for (j = 0; j < bucket_size; j++)
+            {
+                int task = shadow_bucket[j] < 0 ? -1 - shadow_bucket[j] : shadow_bucket[j];
+                available_nodes_future += all_cores[task];
+                if (available_nodes + available_nodes_future >= needed)
+                {
+                    *shadow_time = curr_time + bucket_remaining;
+                    *extra_nodes = (available_nodes + available_nodes_future) - needed;
+                    return 1;
+                }
+            }
+            bucket_size = 0;
+        }
+        if (i < num_running_tasks)
+        {
+            shadow_bucket[bucket_size++] = release_key;
+            bucket_remaining = remaining;
         }
     }
-    // printf("%d ", num_arrived_tasks);
-    if (num_arrived_tasks == 1)
-        return;
+    return 0;
+}
 
+void scanShadowTime(int curr_time, int available_nodes, int needed, int num_tasks_disp, int *shadow_time, int *extra_nodes)
+{
+    int i, j;
+    stats_shadow_scans++;
     // double remaining_time[num_tasks_disp];
     double *remaining_time = (double *)calloc(num_tasks_disp, sizeof(double));
     for (i = 0; i < num_tasks_disp; i++)
@@ -139,46 +350,65 @@ void backFill(double *runtimes, int *cores, int *submit, int *orig_pos, int poli
             remaining_time[i] = -1.0;
         }
     }
-    int available_nodes = 0;
-    for (j = 0; j < number_of_nodes; j++)
-    {
-        if (busy_workers[j] == 0)
-        {
-            available_nodes++;
-        }
-    }
-    int shadow_time = 0;
     int available_nodes_future = 0;
-    int extra_nodes = 0;
     int min_remaining = INT_MAX;
     int min_remaining_task = 0;
-    if (available_nodes < cores[0])
+    for (i = 0; i < num_tasks_disp; i++)
     {
-        for (i = 0; i < num_tasks_disp; i++)
+        min_remaining = INT_MAX;
+        for (j = 0; j < num_tasks_disp; j++)
         {
-            min_remaining = INT_MAX;
-            for (j = 0; j < num_tasks_disp; j++)
+            if (remaining_time[j] != -1.0 && remaining_time[j] < min_remaining)
             {
-                if (remaining_time[j] != -1.0 && remaining_time[j] < min_remaining)
-                {
-                    min_remaining = remaining_time[j];
-                    min_remaining_task = j;
-                }
-            }
-            remaining_time[min_remaining_task] = INT_MAX;
-            available_nodes_future += all_cores[min_remaining_task];
-            if (available_nodes + available_nodes_future >= cores[0])
-            {
-                shadow_time = curr_time + min_remaining;
-                extra_nodes = (available_nodes + available_nodes_future) - cores[0];
-                break;
+                min_remaining = remaining_time[j];
+                min_remaining_task = j;
             }
         }
+        remaining_time[min_remaining_task] = INT_MAX;
+        available_nodes_future += all_cores[min_remaining_task];
+        if (available_nodes + available_nodes_future >= needed)
+        {
+            *shadow_time = curr_time + min_remaining;
+            *extra_nodes = (available_nodes + available_nodes_future) - needed;
+            break;
+        }
+    }
+    free(remaining_time);
+}
+
+void backFill(double *runtimes, int *cores, int *submit, int *orig_pos, int policy, int queue_num_tasks, int num_tasks_disp)
+{
+    int i, j;
+    int curr_time = MSG_get_clock();
+    int num_arrived_tasks = 0;
+    for (i = 0; i < queue_num_tasks; i++)
+    {
+        if (submit[i] <= curr_time)
+        {
+            num_arrived_tasks++;
+        }
+        else
+        {
+            break;
+        }
+    }
+    // printf("%d ", num_arrived_tasks);
+    if (num_arrived_tasks == 1)
+        return;
+    stats_backfill_attempts++;
+
+    int available_nodes = num_free_nodes;
+    int shadow_time = 0;
+    int extra_nodes = 0;
+    if (available_nodes < cores[0] && !profileShadowTime(curr_time, available_nodes, cores[0], num_tasks_disp, &shadow_time, &extra_nodes))
+    {
+        scanShadowTime(curr_time, available_nodes, cores[0], num_tasks_disp, &shadow_time, &extra_nodes);
     }
     for (i = 1; i < num_arrived_tasks; i++)
     {
         if ((cores[i] <= available_nodes && (curr_time + runtimes[i]) <= shadow_time) || (cores[i] <= (available_nodes < extra_nodes ? available_nodes : extra_nodes)))
         {
+            stats_backfilled_tasks++;
             if (VERBOSE)
                 XBT_INFO("\"Task_%d\" [r=%.1f,c=%d, s=%d] Backfilled. Shadow Time=%d, Extra Nodes=%d.", orig_pos[i], runtimes[i], cores[i], submit[i], shadow_time, extra_nodes);
             double r_buffer = runtimes[i];
@@ -201,9 +431,109 @@ void backFill(double *runtimes, int *cores, int *submit, int *orig_pos, int poli
     }
 }
 
+double taskScore(int policy, double runtime, int cores, int submit, int task_age)
+{
+    switch (policy)
+    {
+    case 30:
+        return ((float)task_age / (float)runtime) * cores;
+    case WFP3:
+        return pow((float)task_age / (float)runtime, 3) * cores;
+    case UNICEF:
+        return (task_age + EPSILON) / (log2((double)cores + EPSILON) * runtime);
+    case F4:
+        return (0.0056500287 * runtime) * (0.0000024814 * sqrt(cores)) + (0.0074444355 * log10(submit)); // 256nodes
+    case F3:
+        return (-0.2188093701 * runtime) * (-0.0000000049 * cores) + (0.0073580361 * log10(submit)); // 256nodes
+    case F2:
+        return (0.0000342717 * sqrt(runtime)) * (0.0076562110 * cores) + (0.0067364626 * log10(submit)); // 256nodes
+    case F1:
+        return (-0.0155183403 * log10(runtime)) * (-0.0005149209 * cores) + (0.0069596182 * log10(submit)); // 256nodes
+    case SAF:
+        return runtime * cores;
+    case LIN:
+        return linear(runtime, cores, submit);
+    case QDR:
+        return quadratic(runtime, cores, submit);
+    case CUB:
+        return cubic(runtime, cores, submit);
+    case QUA:
+        return quartic(runtime, cores, submit);
+    case QUI:
+        return quintic(runtime, cores, submit);
+    case SEX:
+        return sextic(runtime, cores, submit);
+    }
+    return 0.0;
+}
+
+int compareQueueIndexes(const void *a, const void *b)
+{
+    int index_a = *(const int *)a;
+    int index_b = *(const int *)b;
+    if (queue_scores[index_a] < queue_scores[index_b])
+        return queue_sort_descending ? 1 : -1;
+    if (queue_scores[index_a] > queue_scores[index_b])
+        return queue_sort_descending ? -1 : 1;
+    // Equal scores keep their queue order
+    return index_a - index_b;
+}
+
+/* Sorts the indexes of the first num_arrived_tasks scores into queue_order. Returns 1 if the
+   sorted scores are strictly monotonic (no ties), 0 otherwise. */
+int sortQueueIndexes(int num_arrived_tasks, int descending)
+{
+    int i;
+    for (i = 0; i < num_arrived_tasks; i++)
+    {
+        queue_order[i] = i;
+    }
+    queue_sort_descending = descending;
+    qsort(queue_order, num_arrived_tasks, sizeof(int), compareQueueIndexes);
+    for (i = 1; i < num_arrived_tasks; i++)
+    {
+        if (descending ? !(queue_scores[queue_order[i - 1]] > queue_scores[queue_order[i]]) : !(queue_scores[queue_order[i - 1]] < queue_scores[queue_order[i]]))
+            return 0;
+    }
+    return 1;
+}
+
+/* The selection scans below mark the chosen tasks with -1e20 (highest score first) or 1e20 (lowest
+   score first), so they only match a sort when every score lies strictly inside that mark */
+int queueScoresInRange(int num_arrived_tasks, int descending)
+{
+    int i;
+    for (i = 0; i < num_arrived_tasks; i++)
+    {
+        if (descending ? !(queue_scores[i] > -1e20) : !(queue_scores[i] < 1e20))
+            return 0;
+    }
+    return 1;
+}
+
+void reorderQueue(double *runtimes, int *cores, int *submit, int *orig_pos, int num_arrived_tasks)
+{
+    int i;
+    for (i = 0; i < num_arrived_tasks; i++)
+    {
+        queue_r_temp[i] = runtimes[queue_order[i]];
+        queue_c_temp[i] = cores[queue_order[i]];
+        queue_s_temp[i] = submit[queue_order[i]];
+        queue_p_temp[i] = orig_pos[queue_order[i]];
+    }
+    for (i = 0; i < num_arrived_tasks; i++)
+    {
+        runtimes[i] = queue_r_temp[i];
+        cores[i] = queue_c_temp[i];
+        submit[i] = queue_s_temp[i];
+        orig_pos[i] = queue_p_temp[i];
+    }
+}
+
 void sortTasksQueue(double *runtimes, int *cores, int *submit, int *orig_pos, int policy, int queue_num_tasks, int num_tasks_disp)
 {
     int i, j;
+    stats_sort_calls++;
     int curr_time = MSG_get_clock();
     int num_arrived_tasks = 0;
     for (i = 0; i < queue_num_tasks; i++)
@@ -222,60 +552,19 @@ void sortTasksQueue(double *runtimes, int *cores, int *submit, int *orig_pos, in
         return;
     if (policy == EASY)
     {
-        // double remaining_time[num_tasks_disp];
-        double *remaining_time = (double *)calloc(num_tasks_disp, sizeof(double));
-        for (i = 0; i < num_tasks_disp; i++)
-        {
-            if (task_queue[i].endTime == 0.0f)
-            {
-                float task_elapsed_time = curr_time - task_queue[i].startTime;
-                remaining_time[i] = all_runtimes[i] - task_elapsed_time;
-            }
-            else
-            {
-                remaining_time[i] = -1.0;
-            }
-        }
-        int available_nodes = 0;
-        for (j = 0; j < number_of_nodes; j++)
-        {
-            if (busy_workers[j] == 0)
-            {
-                available_nodes++;
-            }
-        }
+        stats_backfill_attempts++;
+        int available_nodes = num_free_nodes;
         int shadow_time = 0;
-        int available_nodes_future = 0;
         int extra_nodes = 0;
-        int min_remaining = INT_MAX;
-        int min_remaining_task = 0;
-        if (available_nodes < cores[0])
+        if (available_nodes < cores[0] && !profileShadowTime(curr_time, available_nodes, cores[0], num_tasks_disp, &shadow_time, &extra_nodes))
         {
-            for (i = 0; i < num_tasks_disp; i++)
-            {
-                min_remaining = INT_MAX;
-                for (j = 0; j < num_tasks_disp; j++)
-                {
-                    if (remaining_time[j] != -1.0 && remaining_time[j] < min_remaining)
-                    {
-                        min_remaining = remaining_time[j];
-                        min_remaining_task = j;
-                    }
-                }
-                remaining_time[min_remaining_task] = INT_MAX;
-                available_nodes_future += all_cores[min_remaining_task];
-                if (available_nodes + available_nodes_future >= cores[0])
-                {
-                    shadow_time = curr_time + min_remaining;
-                    extra_nodes = (available_nodes + available_nodes_future) - cores[0];
-                    break;
-                }
-            }
+            scanShadowTime(curr_time, available_nodes, cores[0], num_tasks_disp, &shadow_time, &extra_nodes);
         }
         for (i = 1; i < num_arrived_tasks; i++)
         {
             if ((cores[i] <= available_nodes && (curr_time + runtimes[i]) <= shadow_time) || (cores[i] <= (available_nodes < extra_nodes ? available_nodes : extra_nodes)))
             {
+                stats_backfilled_tasks++;
                 if (VERBOSE)
                     XBT_INFO("\"Task_%d\" [r=%.1f,c=%d, s=%d] Backfilled. Shadow Time=%d, Extra Nodes=%d.", orig_pos[i], runtimes[i], cores[i], submit[i], shadow_time, extra_nodes);
                 double r_buffer = runtimes[i];
@@ -296,7 +585,6 @@ void sortTasksQueue(double *runtimes, int *cores, int *submit, int *orig_pos, in
                 break;
             }
         }
-        free(remaining_time);
         return;
     }
     if (policy == FCFS)
@@ -306,6 +594,17 @@ void sortTasksQueue(double *runtimes, int *cores, int *submit, int *orig_pos, in
     }
     if (policy == SJF)
     {
+        for (i = 0; i < num_arrived_tasks; i++)
+        {
+            queue_scores[i] = runtimes[i];
+        }
+        /* The exchange sort below does not keep the order of equal runtimes, so the index sort
+           replaces it only when all the runtimes differ (both give the same order then) */
+        if (sortQueueIndexes(num_arrived_tasks, 0))
+        {
+            reorderQueue(runtimes, cores, submit, orig_pos, num_arrived_tasks);
+            return;
+        }
         double r_buffer;
         int c_buffer;
         int s_buffer;
@@ -334,131 +633,89 @@ void sortTasksQueue(double *runtimes, int *cores, int *submit, int *orig_pos, in
         // backFill(runtimes, cores, submit, orig_pos, policy, queue_num_tasks,  num_tasks_disp);
         return;
     }
-    double *h_values = (double *)calloc(num_arrived_tasks, sizeof(double));
-    double *r_temp = (double *)calloc(num_arrived_tasks, sizeof(double));
-    int *c_temp = (int *)calloc(num_arrived_tasks, sizeof(int));
-    int *s_temp = (int *)calloc(num_arrived_tasks, sizeof(int));
-    int *p_temp = (int *)calloc(num_arrived_tasks, sizeof(int));
-    int max_arrive = 0;
-    for (i = 0; i < num_arrived_tasks; i++)
+    if (task_scores == NULL)
     {
-        if (submit[i] > max_arrive)
-        {
-            max_arrive = submit[i];
-        }
+        task_scores = (double *)malloc(number_of_tasks * sizeof(double));
+        task_score_known = (char *)calloc(number_of_tasks, sizeof(char));
     }
-
-    // printf("%d\n", max_arrive);
     int task_age = 0;
     for (i = 0; i < num_arrived_tasks; i++)
     {
         task_age = curr_time - submit[i];
-        switch (policy)
+        if (policy == WFP3 || policy == UNICEF || policy == 30)
         {
-        case 30:
-            h_values[i] = ((float)task_age / (float)runtimes[i]) * cores[i];
-            break;
-        case WFP3:
-            h_values[i] = pow((float)task_age / (float)runtimes[i], 3) * cores[i];
-            break;
-        case UNICEF:
-            h_values[i] = (task_age + EPSILON) / (log2((double)cores[i] + EPSILON) * runtimes[i]);
-            break;
-        case F4:
-            h_values[i] = (0.0056500287 * runtimes[i]) * (0.0000024814 * sqrt(cores[i])) + (0.0074444355 * log10(submit[i])); // 256nodes
-            break;
-        case F3:
-            h_values[i] = (-0.2188093701 * runtimes[i]) * (-0.0000000049 * cores[i]) + (0.0073580361 * log10(submit[i])); // 256nodes
-            break;
-        case F2:
-            h_values[i] = (0.0000342717 * sqrt(runtimes[i])) * (0.0076562110 * cores[i]) + (0.0067364626 * log10(submit[i])); // 256nodes
-            break;
-        case F1:
-            h_values[i] = (-0.0155183403 * log10(runtimes[i])) * (-0.0005149209 * cores[i]) + (0.0069596182 * log10(submit[i])); // 256nodes
-            break;
-        case SAF:
-            h_values[i] = runtimes[i] * cores[i];
-            break;
-        case LIN:
-            h_values[i] = linear(runtimes[i], cores[i], submit[i]);
-            break;
-        case QDR:
-            h_values[i] = quadratic(runtimes[i], cores[i], submit[i]);
-            break;
-        case CUB:
-            h_values[i] = cubic(runtimes[i], cores[i], submit[i]);
-            break;
-        case QUA:
-            h_values[i] = quartic(runtimes[i], cores[i], submit[i]);
-            break;
-        case QUI:
-            h_values[i] = quintic(runtimes[i], cores[i], submit[i]);
-            break;
-        case SEX:
-            h_values[i] = sextic(runtimes[i], cores[i], submit[i]);
-            break;
+            queue_scores[i] = taskScore(policy, runtimes[i], cores[i], submit[i], task_age);
+        }
+        else
+        {
+            if (!task_score_known[orig_pos[i]])
+            {
+                task_scores[orig_pos[i]] = taskScore(policy, runtimes[i], cores[i], submit[i], task_age);
+                task_score_known[orig_pos[i]] = 1;
+            }
+            queue_scores[i] = task_scores[orig_pos[i]];
         }
         if (VERBOSE)
-            XBT_INFO("Score for \"Task_%d\" [r=%.1f,c=%d,s=%d]=%.7f", orig_pos[i], runtimes[i], cores[i], submit[i], h_values[i]);
+            XBT_INFO("Score for \"Task_%d\" [r=%.1f,c=%d,s=%d]=%.7f", orig_pos[i], runtimes[i], cores[i], submit[i], queue_scores[i]);
     }
     if (policy == WFP3 || policy == UNICEF)
     {
-        double max_val = 0.0;
-        int max_index;
-        for (i = 0; i < num_arrived_tasks; i++)
+        /* Picking the first highest score again and again is a stable sort by decreasing score */
+        if (queueScoresInRange(num_arrived_tasks, 1))
         {
-            max_val = -1e20;
-            for (j = 0; j < num_arrived_tasks; j++)
+            sortQueueIndexes(num_arrived_tasks, 1);
+        }
+        else
+        {
+            double max_val = 0.0;
+            int max_index = 0;
+            for (i = 0; i < num_arrived_tasks; i++)
             {
-                if (h_values[j] > max_val)
+                max_val = -1e20;
+                for (j = 0; j < num_arrived_tasks; j++)
                 {
-                    max_val = h_values[j];
-                    max_index = j;
+                    if (queue_scores[j] > max_val)
+                    {
+                        max_val = queue_scores[j];
+                        max_index = j;
+                    }
                 }
+                queue_order[i] = max_index;
+                queue_scores[max_index] = -1e20;
             }
-            r_temp[i] = runtimes[max_index];
-            c_temp[i] = cores[max_index];
-            s_temp[i] = submit[max_index];
-            p_temp[i] = orig_pos[max_index];
-            h_values[max_index] = -1e20;
         }
+        reorderQueue(runtimes, cores, submit, orig_pos, num_arrived_tasks);
     }
     else if (policy >= F4)
     {
-        double min_val = 1e20;
-        int min_index;
-        for (i = 0; i < num_arrived_tasks; i++)
+        /* Picking the first lowest score again and again is a stable sort by increasing score */
+        if (queueScoresInRange(num_arrived_tasks, 0))
         {
-            min_val = 1e20;
-            min_index = 0;
-            for (j = 0; j < num_arrived_tasks; j++)
+            sortQueueIndexes(num_arrived_tasks, 0);
+        }
+        else
+        {
+            double min_val = 1e20;
+            int min_index;
+            for (i = 0; i < num_arrived_tasks; i++)
             {
-                if (h_values[j] < min_val)
+                min_val = 1e20;
+                min_index = 0;
+                for (j = 0; j < num_arrived_tasks; j++)
                 {
-                    min_val = h_values[j];
-                    min_index = j;
+                    if (queue_scores[j] < min_val)
+                    {
+                        min_val = queue_scores[j];
+                        min_index = j;
+                    }
                 }
+                queue_order[i] = min_index;
+                queue_scores[min_index] = 1e20;
             }
-            r_temp[i] = runtimes[min_index];
-            c_temp[i] = cores[min_index];
-            s_temp[i] = submit[min_index];
-            p_temp[i] = orig_pos[min_index];
-            h_values[min_index] = 1e20;
         }
-    }
-    for (i = 0; i < num_arrived_tasks; i++)
-    {
-        runtimes[i] = r_temp[i];
-        cores[i] = c_temp[i];
-        submit[i] = s_temp[i];
-        orig_pos[i] = p_temp[i];
+        reorderQueue(runtimes, cores, submit, orig_pos, num_arrived_tasks);
     }
     // backFill(runtimes, cores, submit, orig_pos, policy, queue_num_tasks,  num_tasks_disp);
-    free(r_temp);
-    free(c_temp);
-    free(s_temp);
-    free(p_temp);
-    free(h_values);
 }
 
 const char *getfield(char *line, int num)
@@ -570,8 +827,11 @@ int master(int argc, char *argv[])
 
         todo = xbt_new0(msg_task_t, number_of_tasks);
 
-        busy_workers = (int *)calloc(number_of_nodes, sizeof(int));
+        initFreeNodes(number_of_nodes);
         task_queue = (struct task_t *)malloc(number_of_tasks * sizeof(struct task_t));
+        running_tasks = (int *)malloc(number_of_tasks * sizeof(int));
+        running_ends = (double *)malloc(number_of_tasks * sizeof(double));
+        shadow_bucket = (int *)malloc(number_of_tasks * sizeof(int));
         // tasks_comp_sizes = (double**) malloc(number_of_tasks * sizeof(double*));
         // tasks_comm_sizes = (double**) malloc(number_of_tasks * sizeof(double*));
         // tasks_allocation = (int**) malloc(number_of_tasks * sizeof(int*));
@@ -592,18 +852,7 @@ int master(int argc, char *argv[])
                 { // task has not arrived yet
                     MSG_process_sleep(all_submit[i] - MSG_get_clock());
                 }
-                available_nodes = 0;
-                for (j = 0; j < number_of_nodes; j++)
-                {
-                    if (busy_workers[j] == 0)
-                    {
-                        available_nodes++;
-                        if (available_nodes == all_cores[i])
-                        {
-                            break;
-                        }
-                    }
-                }
+                available_nodes = num_free_nodes;
                 // if(VERBOSE)
                 //   XBT_INFO("Available nodes=%d. Nodes needed=%d", available_nodes, all_cores[i]);
                 if (available_nodes < all_cores[i])
@@ -611,6 +860,7 @@ int master(int argc, char *argv[])
                     if (VERBOSE)
                         XBT_INFO("Insuficient workers for \"Task_%d\" [r=%.1f,c=%d,s=%d] (%d available workers. need %d). Waiting.", orig_task_positions[i], all_runtimes[i], all_cores[i], all_submit[i], available_nodes, all_cores[i]);
                     // MSG_process_sleep(1.0f);
+                    stats_dispatch_retries++;
                     MSG_process_suspend(p_master);
                 }
             } while (available_nodes < all_cores[i]);
@@ -630,21 +880,7 @@ int master(int argc, char *argv[])
             // tasks_allocation[i][0] = all_cores[i];
             // tasks_workers[i] = xbt_new0(msg_host_t*, all_cores[i]);
 
-            int count = 0;
-            for (j = 0; j < number_of_nodes; j++)
-            {
-                if (busy_workers[j] == 0)
-                {
-                    // task_queue[i].task_workers[count] = workers[j];
-                    task_queue[i].task_allocation[count] = j;
-                    busy_workers[j] = 1;
-                    count++;
-                }
-                if (count >= all_cores[i])
-                {
-                    break;
-                }
-            }
+            allocateNodes(task_queue[i].task_allocation, all_cores[i]);
 
             msg_host_t self = MSG_host_self();
             double speed = MSG_host_get_speed(self);
@@ -742,7 +978,6 @@ int taskManager(int argc, char *argv[])
 {
     msg_task_t task = NULL;
     struct task_t *_task = NULL;
-    int i;
     int res;
     // while (1) {
     res = MSG_task_receive(&(task), MSG_host_get_name(MSG_host_self()));
@@ -767,17 +1002,15 @@ int taskManager(int argc, char *argv[])
     }
     */
     _task->startTime = MSG_get_clock();
+    addRunningTask(_task - task_queue);
+    stats_simulated_events++;
     MSG_task_execute(task);
     _task->endTime = MSG_get_clock();
+    removeRunningTask(_task - task_queue);
+    stats_simulated_events++;
     if (VERBOSE)
         XBT_INFO("\"%s\" done", MSG_task_get_name(task));
-    int *allocation = _task->task_allocation;
-    int n = _task->numNodes;
-    // int i;
-    for (i = 0; i < n; i++)
-    {
-        busy_workers[allocation[i]] = 0;
-    }
+    releaseNodes(_task->task_allocation, _task->numNodes);
     MSG_task_destroy(task);
     task = NULL;
     MSG_process_resume(p_master);
@@ -798,6 +1031,7 @@ int taskMonitor(int argc, char *argv[])
         }
         if (VERBOSE)
             XBT_INFO("\"Task_%d\" [r=%.1f,c=%d,s=%d] arrived. Waking up master.", i, all_runtimes[i], all_cores[i], all_submit[i]);
+        stats_simulated_events++;
         MSG_process_resume(p_master);
     }
     return 0;
@@ -875,6 +1109,9 @@ msg_error_t test_all(const char *platform_file,
     printf("%g\n", MSG_get_clock());
     */
 
+    if (STATS)
+        printStats();
+
     return res;
 } /* end_of_test_all */
 
@@ -905,6 +1142,10 @@ int main(int argc, char *argv[])
             {
                 STATE = 1;
             }
+            if (strcmp(argv[i], "-stats") == 0)
+            {
+                STATS = 1;
+            }
             if (strcmp(argv[i], "-spt") == 0)
             {
                 chosen_policy = SJF;
@@ -965,6 +1206,14 @@ int main(int argc, char *argv[])
             {
                 chosen_policy = SEX;
             }
+            if (strcmp(argv[i], "-coefficients") == 0 && i + 1 < argc)
+            {
+                if (set_coefficients(argv[i + 1]) != 0)
+                {
+                    printf("Invalid -coefficients parameter %s. Please give a coefficient set or a regression report.\n", argv[i + 1]);
+                    exit(1);
+                }
+            }
             if (strcmp(argv[i], "-nt") == 0)
             {
                 number_of_tasks = atoi(argv[i + 1]);
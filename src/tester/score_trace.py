@@ -0,0 +1,83 @@
+import os
+import sys
+import numpy as np
+
+# Add the src directory to the path so we can import the tools
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "src")))
+from tools.swf_reader import iter_swf_chunks, CHUNK_SIZE
+from policy_engine import load_coefficients, DEFAULT_COEFFICIENTS, POLYNOMIALS, SECONDS_IN_ONE_HOUR
+from regressor.polynomials import evaluate_polynomials
+
+
+def score_trace(workload, output_file, policies=None, coefficient_set=DEFAULT_COEFFICIENTS, estimates=False):
+    """
+    Score every job of a SWF trace with the polynomial policies and write the scores to a CSV file,
+    reading the trace one chunk at a time.
+
+    The scores are the ones the binaries compute for a job, with its submit time taken from the
+    first job of the trace instead of the first job of a tester window.
+
+    Parameters
+    ----------
+    workload : str
+        The path to the SWF trace.
+    output_file : str
+        The path to the CSV file, with a job, p, q and r column and a column for each policy.
+    policies : list, optional
+        The polynomial policies, all of them (LIN to SEX) by default.
+    coefficient_set : str, optional
+        The name of a set compiled in parameters.c or the path to a regression report.
+    estimates : bool, optional
+        Whether p is the requested time of the jobs, as in sched-simulator-estimate-backfilling,
+        or their run time.
+
+    Returns
+    -------
+    int
+        The number of scored jobs.
+    """
+    if policies is None:
+        policies = list(POLYNOMIALS)
+    coefficients, temporal_normalized = load_coefficients(coefficient_set)
+    thetas = [coefficients[POLYNOMIALS[policy][0]] for policy in policies]
+    time_scale = SECONDS_IN_ONE_HOUR if temporal_normalized else 1
+    row_format = ["%d"] * 4 + ["%.17g"] * len(policies)
+    number_of_jobs = 0
+    first_submit = None
+
+    with open(output_file, "w+") as output:
+        output.write(",".join(["job", "p", "q", "r", *policies]) + "\n")
+        for jobs in iter_swf_chunks(workload, CHUNK_SIZE):
+            if len(jobs) == 0:
+                continue
+            if first_submit is None:
+                first_submit = jobs["r"][0]
+
+            p = jobs["~p" if estimates else "p"]
+            r = jobs["r"] - first_submit
+            scores = evaluate_polynomials(thetas, p / time_scale, jobs["q"], r / time_scale)
+
+            # A whole chunk is written at once, with enough digits to read the scores back exactly
+            job = np.arange(number_of_jobs, number_of_jobs + len(jobs))
+            columns = np.column_stack([job, p, jobs["q"], r]).astype(np.int64)
+            np.savetxt(output, np.column_stack([columns, scores]), fmt=row_format, delimiter=",")
+            number_of_jobs += len(jobs)
+    return number_of_jobs
+
+
+if __name__ == "__main__":
+    # Score a trace with every polynomial policy: python score_trace.py workload output [-estimate] [-coefficients set]
+    if len(sys.argv) < 3:
+        print(f"usage: python {sys.argv[0]} workload_file output_file [-estimate] [-coefficients set]")
+        sys.exit(1)
+
+    arguments = sys.argv[3:]
+    coefficient_set = DEFAULT_COEFFICIENTS
+    for i, argument in enumerate(arguments):
+        if argument == "-coefficients":
+            coefficient_set = arguments[i + 1]
+
+    number_of_jobs = score_trace(
+        sys.argv[1], sys.argv[2], coefficient_set=coefficient_set, estimates="-estimate" in arguments
+    )
+    print(f"{number_of_jobs} jobs scored in '{sys.argv[2]}'")
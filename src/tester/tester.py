@@ -1,17 +1,27 @@
 import os
 import sys
+import shutil
 import pathlib
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 
 # Add the src directory to the path so we can import the tools
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "src")))
 from tools.swf_reader import *
+from policy_engine import read_coefficient_sets, read_number_of_nodes, simulate_policy, DEFAULT_COEFFICIENTS
+from result_cache import ResultCache
 
 # Predefined paths (enable the script to be run from anywhere in the project)
 EXPERIMENTS_DIR = pathlib.Path(__file__).parent
 DATA_DIR = pathlib.Path(__file__).parent.parent.parent / "data"
 
+SCRATCH_DIR = EXPERIMENTS_DIR / "scratch"
+RESULT_CACHE_FILE = EXPERIMENTS_DIR / "results-cache.sqlite"
+# The sources of the python backend, whose content versions its cached results
+PYTHON_BACKEND_FILES = [EXPERIMENTS_DIR / "policy_engine.py", EXPERIMENTS_DIR.parent / "regressor" / "polynomials.py"]
+
 SECONDS_IN_A_DAY = 86400
 SIM_NUM_DAYS = 15
 STATE_SIZE = 16
@@ -71,6 +81,7 @@ simulators = {
     "ACTUAL": "sched-simulator-runtime",
     "ESTIMATED": "sched-simulator-estimate-backfilling",
     "BACKFILLING": "sched-simulator-estimate-backfilling",
+    "CONSERVATIVE": "sched-simulator-estimate-backfilling",
 }
 
 policies_flags = {
@@ -88,8 +99,88 @@ policies_flags = {
     "SEX": "-sex",
 }
 
+# Policies whose coefficients can be chosen at runtime (-coefficients)
+POLYNOMIAL_POLICIES = ["LIN", "QDR", "CUB", "QUA", "QUI", "SEX"]
+
 
-def workload_experiments(workloads, policies, sim_types):
+def write_experiment_input(experiment_dir, state_jobs, queue_jobs, sim_type):
+    experiment_dir.mkdir(parents=True, exist_ok=True)
+    earliest_submit = state_jobs["r"][0]
+
+    with open(experiment_dir / "initial-simulation-submit.csv", "w+") as task_file:
+        for job in np.concatenate((state_jobs, queue_jobs)):
+            if sim_type != "ACTUAL":
+                task_file.write(f"{job['p']},{job['q']},{job['r'] - earliest_submit},{job['~p']}\n")
+            else:
+                task_file.write(f"{job['p']},{job['q']},{job['r'] - earliest_submit}\n")
+
+
+def run_policy(command, experiment_dir):
+    # Every experiment has its own directory, as the simulators read their tasks from the working directory
+    output = subprocess.run(command, stdout=subprocess.PIPE, text=True, cwd=experiment_dir).stdout
+    try:
+        return float(output)
+    except ValueError:
+        raise RuntimeError(f"Unexpected output of '{' '.join(map(str, command))}' in {experiment_dir}: {output!r}")
+
+
+def run_python_policy(jobs, number_of_nodes, policy, sim_type, coefficient_set, dispatch_delay):
+    slowdown = simulate_policy(
+        jobs,
+        number_of_nodes,
+        policy,
+        estimates=sim_type != "ACTUAL",
+        backfilling=sim_type == "BACKFILLING",
+        coefficient_set=coefficient_set or DEFAULT_COEFFICIENTS,
+        dispatch_delay=dispatch_delay,
+        conservative=sim_type == "CONSERVATIVE",
+    )
+    # Same precision as the output of the simulators
+    return float(f"{slowdown:f}")
+
+
+def run(run_function_and_args):
+    run_function, args = run_function_and_args
+    return run_function(*args)
+
+
+def get_policy_columns(policies, coefficients):
+    # Every polynomial policy is evaluated with each coefficient set, the other policies once
+    columns = []
+    for policy in policies:
+        if coefficients and policy in POLYNOMIAL_POLICIES:
+            for label, coefficient_set in coefficients.items():
+                columns.append((f"{policy} ({label})", policy, str(coefficient_set)))
+        else:
+            columns.append((policy, policy, None))
+    return columns
+
+
+def coefficient_set_key(cache, coefficient_set):
+    # A regression report is identified by its content, so regenerating it at the same path is noticed
+    if coefficient_set is None or coefficient_set in read_coefficient_sets():
+        return coefficient_set or ""
+    return f"{coefficient_set} ({cache.file_hash(coefficient_set)})"
+
+
+def workload_experiments(
+    workloads,
+    policies,
+    sim_types,
+    workers=1,
+    coefficients=None,
+    backend="simgrid",
+    cache_file=RESULT_CACHE_FILE,
+    dispatch_delay=0.0,
+):
+    if backend not in ["simgrid", "python"]:
+        raise ValueError(f"Unknown backend '{backend}'")
+    # The python backend does not model the network: its results depend on the time it charges
+    # for sending a job to its worker (dispatch_delay), which SimGrid derives from the platform
+    backend_key = backend if backend == "simgrid" else f"python (dispatch delay {dispatch_delay!r})"
+
+    # Only the runs missing from the cache are simulated (cache_file=None keeps the results in memory)
+    cache = ResultCache(cache_file)
     for workload_trace in workloads:
         for sim_type in sim_types:
             if workload_trace in ["LUBLIN 256", "LUBLIN 1024"]:
@@ -106,101 +197,125 @@ def workload_experiments(workloads, policies, sim_types):
 
             if sim_type == "BACKFILLING":
                 backfilling_flag = "-bf"
+            elif sim_type == "CONSERVATIVE":
+                backfilling_flag = "-cbf"
             else:
                 backfilling_flag = ""
 
-            number_of_policies = len(policies)
+            if backend == "python":
+                number_of_nodes = read_number_of_nodes(DATA_DIR / "applications" / deploy_file)
 
-            workload_jobs = ReaderSWF(workload_file)
+            number_of_policies = len(policies)
+            columns = get_policy_columns(policies, coefficients)
+            trace_hash = cache.file_hash(workload_file)
+            deployment_hash = cache.file_hash(DATA_DIR / "applications" / deploy_file)
+            coefficient_keys = {
+                coefficient_set: coefficient_set_key(cache, coefficient_set) for _, _, coefficient_set in columns
+            }
+            # A rebuilt binary or an edited engine does not reuse the slowdowns of the previous one
+            if backend == "simgrid":
+                simulator_hash = cache.file_hash(EXPERIMENTS_DIR / simulators[sim_type])
+            else:
+                simulator_hash = ",".join(cache.file_hash(file) for file in PYTHON_BACKEND_FILES)
 
             print(
                 f"Performing scheduling performance test for the workload trace {workload_trace}.\nConfiguration: {sim_type}"
             )
 
-            # DataFrame to store all slowdowns from all experiments
-            slowdowns = pd.DataFrame(columns=policies)
-
-            choose = 0
-            for exp in range(number_of_experiments):
-                task_file = open(EXPERIMENTS_DIR / "initial-simulation-submit.csv", "w+")
-                earliest_submit = workload_jobs.jobs_info["r"][choose]
-
-                number_of_jobs = 0
+            # Consecutive windows of STATE_SIZE jobs plus the jobs submitted in the next
+            # SIM_NUM_DAYS, read lazily so the trace never has to fit in memory
+            windows = iter_swf_windows(workload_file, STATE_SIZE, SECONDS_IN_A_DAY * SIM_NUM_DAYS)
+            keys = {}
+            runs = {}
+            first_job = 0
+            for exp, (state_jobs, queue_jobs) in zip(range(number_of_experiments), windows):
+                number_of_jobs = len(state_jobs) + len(queue_jobs)
+                for column, policy, coefficient_set in columns:
+                    keys[(exp, column)] = (
+                        trace_hash,
+                        deployment_hash,
+                        first_job,
+                        number_of_jobs,
+                        sim_type,
+                        backfilling_flag,
+                        policy,
+                        coefficient_keys[coefficient_set],
+                        backend_key,
+                        simulator_hash,
+                    )
+                first_job += number_of_jobs
+                missing_columns = [
+                    (column, policy, coefficient_set)
+                    for column, policy, coefficient_set in columns
+                    if cache.get(keys[(exp, column)]) is None
+                ]
+                if not missing_columns:
+                    print(f"Scheduling experiment {exp + 1} is cached. Number of tasks={number_of_jobs}")
+                    continue
+
+                if backend == "python":
+                    window = np.concatenate((state_jobs, queue_jobs))
+                    jobs = {key: window[key] for key in ["p", "q", "~p"]}
+                    jobs["r"] = window["r"] - state_jobs["r"][0]
+                else:
+                    experiment_dir = SCRATCH_DIR / f"experiment-{exp}"
+                    write_experiment_input(experiment_dir, state_jobs, queue_jobs, sim_type)
 
-                state_jobs = {"p": [], "~p": [], "q": [], "r": []}
-                for idx in range(STATE_SIZE):
-                    state_jobs["p"].append(workload_jobs.jobs_info["p"][choose + idx])
-                    state_jobs["q"].append(workload_jobs.jobs_info["q"][choose + idx])
-                    state_jobs["r"].append(workload_jobs.jobs_info["r"][choose + idx] - earliest_submit)
+                print(f"Performing scheduling experiment {exp + 1}. Number of tasks={number_of_jobs}")
 
-                    if sim_type != "ACTUAL":
-                        state_jobs["~p"].append(workload_jobs.jobs_info["~p"][choose + idx])
-                        task_file.write(
-                            f"{state_jobs['p'][idx]},{state_jobs['q'][idx]},{state_jobs['r'][idx]},{state_jobs['~p'][idx]}\n"
-                        )
-                    else:
-                        task_file.write(f"{state_jobs['p'][idx]},{state_jobs['q'][idx]},{state_jobs['r'][idx]}\n")
-
-                    number_of_jobs += 1
-
-                queue_jobs = {"p": [], "~p": [], "q": [], "r": []}
-                idx = 0
-                while (
-                    workload_jobs.jobs_info["r"][choose + STATE_SIZE + idx] - earliest_submit
-                ) <= SECONDS_IN_A_DAY * SIM_NUM_DAYS:
-                    queue_jobs["p"].append(workload_jobs.jobs_info["p"][STATE_SIZE + choose + idx])
-                    queue_jobs["q"].append(workload_jobs.jobs_info["q"][STATE_SIZE + choose + idx])
-                    queue_jobs["r"].append(workload_jobs.jobs_info["r"][STATE_SIZE + choose + idx] - earliest_submit)
-
-                    if sim_type != "ACTUAL":
-                        queue_jobs["~p"].append(workload_jobs.jobs_info["~p"][STATE_SIZE + choose + idx])
-                        task_file.write(
-                            f"{queue_jobs['p'][idx]},{queue_jobs['q'][idx]},{queue_jobs['r'][idx]},{queue_jobs['~p'][idx]}\n"
+                for column, policy, coefficient_set in missing_columns:
+                    if backend == "python":
+                        runs[(exp, column)] = (
+                            run_python_policy,
+                            (jobs, number_of_nodes, policy, sim_type, coefficient_set, dispatch_delay),
                         )
-                    else:
-                        task_file.write(f"{queue_jobs['p'][idx]},{queue_jobs['q'][idx]},{queue_jobs['r'][idx]}\n")
+                        continue
 
-                    idx += 1
-                    number_of_jobs += 1
-
-                task_file.close()
-                choose += STATE_SIZE + idx
-
-                print(f"Performing scheduling experiment {exp + 1}. Number of tasks={number_of_jobs}")
-
-                _buffer = open(EXPERIMENTS_DIR / "plot-temp.dat", "w+")
-                for policy in policies:
                     policy_flag = policies_flags[policy]
-                    subprocess.run(
-                        [
-                            f"./{simulators[sim_type]}",
-                            DATA_DIR / "platforms" / "plat_day.xml",
-                            DATA_DIR / "applications" / deploy_file,
-                            backfilling_flag,
-                            policy_flag,
-                            "-nt",
-                            str(number_of_jobs),
-                        ],
-                        stdout=_buffer,
-                        cwd=EXPERIMENTS_DIR,
-                    )
-
-                _buffer.close()
-
-                temp_data = pd.DataFrame(columns=policies)
-
-                _buffer = open(EXPERIMENTS_DIR / "plot-temp.dat", "r")
-                lines = list(_buffer)
-                for i, policy in enumerate(policies):
-                    temp_data[policy] = [float(lines[i])]
-                _buffer.close()
-
-                slowdowns = pd.concat([slowdowns, temp_data], ignore_index=True)
-
-            slowdowns.to_csv(
-                EXPERIMENTS_DIR / f"{workload_trace}_{sim_type}_{number_of_experiments}_{number_of_policies}.csv",
-                index=False,
+                    command = [
+                        EXPERIMENTS_DIR / simulators[sim_type],
+                        DATA_DIR / "platforms" / "plat_day.xml",
+                        DATA_DIR / "applications" / deploy_file,
+                        backfilling_flag,
+                        policy_flag,
+                        "-nt",
+                        str(number_of_jobs),
+                    ]
+                    if coefficient_set is not None:
+                        command += ["-coefficients", coefficient_set]
+                    runs[(exp, column)] = (run_policy, (command, experiment_dir))
+
+            # The (experiment, policy) runs are independent: simulator processes driven by threads,
+            # or in-process simulations run by worker processes. Every slowdown is cached as soon
+            # as it is known, so an interrupted test resumes where it stopped
+            if workers == 1:
+                for run_key, run_function_and_args in runs.items():
+                    cache.put(keys[run_key], run(run_function_and_args))
+            else:
+                pool = ThreadPoolExecutor if backend == "simgrid" else ProcessPoolExecutor
+                with pool(max_workers=workers) as executor:
+                    futures = {executor.submit(run, runs[run_key]): run_key for run_key in runs}
+                    for future in as_completed(futures):
+                        cache.put(keys[futures[future]], future.result())
+            shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+            # DataFrame with the slowdowns of all experiments, one row per experiment
+            experiments = sorted({exp for exp, _ in keys})
+            if len(experiments) < number_of_experiments:
+                print(
+                    f"Warning: only {len(experiments)} of the {number_of_experiments} experiments fit in "
+                    f"{workload_file}",
+                    file=sys.stderr,
+                )
+            slowdowns = pd.DataFrame(
+                [[cache.get(keys[(exp, column)]) for column, _, _ in columns] for exp in experiments],
+                columns=[column for column, _, _ in columns],
             )
+            # The backends do not give the same slowdowns, so the python ones do not overwrite the SimGrid ones
+            suffix = "" if backend == "simgrid" else f"_{backend}"
+            slowdowns_file = f"{workload_trace}_{sim_type}_{number_of_experiments}_{number_of_policies}{suffix}.csv"
+            slowdowns.to_csv(EXPERIMENTS_DIR / slowdowns_file, index=False)
+    cache.close()
 
 
 if __name__ == "__main__":
@@ -208,4 +323,5 @@ if __name__ == "__main__":
         ["CTC-SP2", "SDSC-BLUE", "LUBLIN 256"],
         ["FCFS", "WFP3", "UNICEF", "SPT", "SAF", "F2", "LIN", "QDR", "CUB", "QUA", "QUI", "SEX"],
         ["ACTUAL", "ESTIMATED"],
+        workers=os.cpu_count(),
     )
@@ -0,0 +1,71 @@
+import numpy as np
+
+# Upper bound of the run and requested times of the synthetic jobs (two days, as in the Lublin model)
+MAX_RUNTIME = 172800
+DEPLOYMENT_TEMPLATE = '''<?xml version='1.0'?>
+<!DOCTYPE platform SYSTEM "https://simgrid.org/simgrid.dtd">
+<platform version="4.1">
+  <process host="master" function="master">
+    <argument value="{nodes}"/>
+    <argument value="{nodes}"/>
+  </process>
+</platform>
+'''
+
+
+def generate_jobs(number_of_jobs, number_of_processors, mean_interarrival=900, seed=0):
+    """
+    Draw the submit time (r), run time (p), number of processors (q) and requested time (~p)
+    of synthetic jobs: exponential interarrival times, log-uniform job widths (mostly powers of
+    two, a quarter of them serial), log-normal run times and requested times overestimating the
+    run times by up to five times.
+    """
+    rng = np.random.default_rng(seed)
+    jobs = {}
+    jobs['r'] = np.cumsum(rng.exponential(mean_interarrival, number_of_jobs)).astype(np.int64)
+
+    widths = 2 ** rng.uniform(0, np.log2(number_of_processors), number_of_jobs)
+    powers = rng.random(number_of_jobs) < 0.75
+    widths[powers] = 2 ** np.round(np.log2(widths[powers]))
+    widths[rng.random(number_of_jobs) < 0.25] = 1
+    jobs['q'] = np.clip(np.round(widths), 1, number_of_processors).astype(np.int64)
+
+    jobs['p'] = np.clip(rng.lognormal(7, 1.5, number_of_jobs), 1, MAX_RUNTIME).astype(np.int64)
+    requested = np.ceil(jobs['p'] * rng.uniform(1, 5, number_of_jobs))
+    jobs['~p'] = np.clip(requested, jobs['p'], MAX_RUNTIME).astype(np.int64)
+    return jobs
+
+
+def write_swf(filename, jobs, number_of_processors):
+    """Write jobs (as returned by generate_jobs) to a SWF trace with the 18 fields of the format."""
+    number_of_jobs = len(jobs['r'])
+    fields = np.full((number_of_jobs, 18), -1, dtype=np.int64)
+    fields[:, 0] = np.arange(1, number_of_jobs + 1)
+    fields[:, 1] = jobs['r']
+    fields[:, 2] = 0
+    fields[:, 3] = jobs['p']
+    fields[:, 4] = jobs['q']
+    fields[:, 7] = jobs['q']
+    fields[:, 8] = jobs['~p']
+    fields[:, 10] = 1
+
+    header = '\n'.join([
+        'Version: 2.2',
+        'Computer: synthetic',
+        f'MaxJobs: {number_of_jobs}',
+        f'MaxRecords: {number_of_jobs}',
+        f'MaxProcs: {number_of_processors}',
+    ])
+    np.savetxt(filename, fields, fmt='%d', header=header, comments='; ')
+
+
+def write_deployment(filename, number_of_nodes):
+    """Write a deployment file whose master runs on number_of_nodes nodes, readable by the simulator and the tester."""
+    with open(filename, 'w') as deployment:
+        deployment.write(DEPLOYMENT_TEMPLATE.format(nodes=number_of_nodes))
+
+
+def generate_swf(filename, number_of_jobs, number_of_processors, mean_interarrival=900, seed=0):
+    """Write a synthetic SWF trace of number_of_jobs jobs for a machine of number_of_processors processors."""
+    jobs = generate_jobs(number_of_jobs, number_of_processors, mean_interarrival, seed)
+    write_swf(filename, jobs, number_of_processors)
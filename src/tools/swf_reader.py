@@ -1,35 +1,160 @@
-import re
+import os
+import json
+import hashlib
+import pathlib
+import numpy as np
+import pandas as pd
+
+# Columns of the Standard Workload Format used by the modules (0-based):
+# submit time (r), run time (p), number of allocated processors (q) and requested time (~p)
+SWF_COLUMNS = {'r': 1, 'p': 3, 'q': 4, '~p': 8}
+JOB_DTYPE = np.dtype([('p', np.int64), ('~p', np.int64), ('q', np.int64), ('r', np.int64)])
+CACHE_DIR_NAME = '.swf-cache'
+CHUNK_SIZE = 65536
+
+
+def read_swf_header(filename):
+    number_of_processors = None
+    with open(filename, 'r') as reader:
+        for line in reader:
+            row = line.split()
+            if not row:
+                continue
+            if not row[0].startswith(';'):
+                break
+            # The last MaxProcs/MaxNodes entry of the header wins
+            if 'MaxProcs:' in row:
+                number_of_processors = int(row[row.index('MaxProcs:') + 1])
+            elif 'MaxNodes:' in row:
+                number_of_processors = int(row[row.index('MaxNodes:') + 1])
+    return number_of_processors
+
+
+def filter_jobs(jobs, number_of_processors):
+    keep = (jobs['q'] > 0) & (jobs['q'] <= number_of_processors) & (jobs['p'] > 0) & (jobs['~p'] > 0)
+    return jobs[keep]
+
+
+def read_swf_columns(filename, **kwargs):
+    return pd.read_csv(filename, sep=r'\s+', comment=';', header=None, usecols=list(SWF_COLUMNS.values()), **kwargs)
+
+
+def to_jobs(columns):
+    jobs = np.empty(len(columns), dtype=JOB_DTYPE)
+    for key, column in SWF_COLUMNS.items():
+        jobs[key] = columns[column].to_numpy(dtype=np.int64)
+    return jobs
+
+
+def iter_swf_chunks(filename, chunk_size=CHUNK_SIZE):
+    """Yield the filtered jobs of a SWF trace in arrays of at most chunk_size lines, without loading the whole trace."""
+    number_of_processors = read_swf_header(filename)
+    with read_swf_columns(filename, chunksize=chunk_size) as reader:
+        for columns in reader:
+            yield filter_jobs(to_jobs(columns), number_of_processors)
+
+
+def iter_swf_jobs(filename, chunk_size=CHUNK_SIZE):
+    """Yield the filtered jobs of a SWF trace one at a time, as records with the fields p, ~p, q and r."""
+    for jobs in iter_swf_chunks(filename, chunk_size):
+        yield from jobs
+
+
+def iter_swf_windows(filename, state_size, window_length, chunk_size=CHUNK_SIZE):
+    """
+    Yield consecutive (state, queue) windows of a SWF trace: the state holds the next
+    state_size jobs and the queue the following jobs submitted at most window_length
+    seconds after the first state job. The next window starts with the first job left
+    out of the queue. Only the current window and one chunk are kept in memory.
+    """
+    chunks = iter_swf_chunks(filename, chunk_size)
+    buffer = np.empty(0, dtype=JOB_DTYPE)
+    exhausted = False
+
+    def read_chunk():
+        nonlocal buffer, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+        else:
+            buffer = np.concatenate((buffer, chunk))
+
+    while True:
+        while len(buffer) <= state_size and not exhausted:
+            read_chunk()
+        if len(buffer) < state_size:
+            return
+
+        earliest_submit = buffer['r'][0]
+        searched = state_size
+        while True:
+            late = np.flatnonzero(buffer['r'][searched:] - earliest_submit > window_length)
+            if late.size > 0:
+                end = searched + late[0]
+                break
+            searched = len(buffer)
+            if exhausted:
+                # The last window ends with the trace
+                end = len(buffer)
+                break
+            read_chunk()
+
+        yield buffer[:state_size], buffer[state_size:end]
+        buffer = buffer[end:]
+        if exhausted and len(buffer) == 0:
+            return
+
 
 class ReaderSWF:
-    def __init__(self, filename):
+    def __init__(self, filename, cache=True):
         self.filename = filename
+        self.cache = cache
         self.number_of_jobs = None
         self.number_of_processors = None
+        self.jobs = None
         self.jobs_info = {'p': [], '~p': [], 'q': [], 'r': []}
         self.read_and_extract_data()
 
+    def get_cache_files(self):
+        path = pathlib.Path(self.filename).resolve()
+        stat = path.stat()
+        key = hashlib.sha1(f'{path}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()
+        cache_dir = path.parent / CACHE_DIR_NAME
+        return cache_dir / f'{key}.npy', cache_dir / f'{key}.json'
+
+    def load_cache(self):
+        jobs_file, info_file = self.get_cache_files()
+        # The info file is written last, so its presence means the jobs file is complete
+        if not info_file.exists():
+            return False
+        with open(info_file, 'r') as info:
+            self.number_of_processors = json.load(info)['number_of_processors']
+        self.jobs = np.load(jobs_file, mmap_mode='r')
+        return True
+
+    def save_cache(self):
+        jobs_file, info_file = self.get_cache_files()
+        try:
+            jobs_file.parent.mkdir(exist_ok=True)
+            with open(jobs_file.with_suffix('.tmp'), 'wb') as jobs_cache:
+                np.save(jobs_cache, self.jobs)
+            os.replace(jobs_file.with_suffix('.tmp'), jobs_file)
+            with open(info_file.with_suffix('.tmp'), 'w') as info:
+                json.dump({'filename': str(self.filename), 'number_of_processors': self.number_of_processors}, info)
+            os.replace(info_file.with_suffix('.tmp'), info_file)
+        except OSError:
+            # A read-only workload directory only costs the parsing time
+            pass
+
+    def parse(self):
+        self.number_of_processors = read_swf_header(self.filename)
+        self.jobs = filter_jobs(to_jobs(read_swf_columns(self.filename)), self.number_of_processors)
+
     def read_and_extract_data(self):
-        with open(self.filename, 'r') as reader:
-            jobs_counter = 0
-            for line in reader.readlines():
-                
-                row = re.split(" +", line.lstrip(" "))
-                row[-1] = row[-1].rstrip()
-
-
-                if row[0].startswith(";"):
-                    if "MaxProcs:" in row:
-                        self.number_of_processors = int(row[row.index("MaxProcs:") + 1])
-                    elif "MaxNodes:" in row:
-                        self.number_of_processors = int(row[row.index("MaxNodes:") + 1])
-                    continue
-
-                # row[4] is q, row[3] is p, row[8] is ~p, and row[1] is r
-                if int(row[4]) > 0 and int(row[4]) <= self.number_of_processors and int(row[3]) > 0 and int(row[8]) > 0:
-                    jobs_counter += 1
-                    self.jobs_info['p'].append(int(row[3]))
-                    self.jobs_info['~p'].append(int(row[8]))
-                    self.jobs_info['q'].append(int(row[4]))
-                    self.jobs_info['r'].append(int(row[1]))
-            
-            self.number_of_jobs = jobs_counter
\ No newline at end of file
+        if not (self.cache and self.load_cache()):
+            self.parse()
+            if self.cache:
+                self.save_cache()
+
+        self.number_of_jobs = len(self.jobs)
+        self.jobs_info = {key: self.jobs[key] for key in JOB_DTYPE.names}
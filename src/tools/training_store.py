@@ -0,0 +1,102 @@
+import os
+import sys
+import fcntl
+import pathlib
+import numpy as np
+
+# One record per job of Q: the tuple it belongs to, its characteristics and its score
+RECORD_DTYPE = np.dtype([('tuple', np.uint32), ('p', np.uintc), ('q', np.uintc), ('r', np.uintc), ('score', np.double)])
+# One entry per tuple: where its records start in the records file and how many there are
+INDEX_DTYPE = np.dtype([('tuple', np.int64), ('offset', np.int64), ('count', np.int64)])
+
+
+class TrainingStore:
+    """
+    An append-only store of training data: fixed-size records in a binary file
+    (`<name>.dat`) and an index of the records of each tuple (`<name>.idx`).
+
+    The records of a tuple are written first and only become part of the store
+    when its index entry is appended, so a crash never leaves a partial tuple:
+    whatever follows the last indexed record is overwritten by the next append.
+    Appends take an exclusive lock on the index, so several processes can write
+    to the same store.
+    """
+
+    def __init__(self, filename):
+        self.records_file = pathlib.Path(filename)
+        self.index_file = self.records_file.with_suffix('.idx')
+
+    def read_index(self):
+        if not self.index_file.exists():
+            return np.empty(0, dtype=INDEX_DTYPE)
+        index = np.fromfile(self.index_file, dtype=np.uint8)
+        # Ignore an entry being written
+        complete = len(index) - len(index) % INDEX_DTYPE.itemsize
+        return index[:complete].view(INDEX_DTYPE)
+
+    def get_tuple_indexes(self):
+        return set(self.read_index()['tuple'].tolist())
+
+    def get_number_of_records(self, index=None):
+        index = self.read_index() if index is None else index
+        return int(index['offset'][-1] + index['count'][-1]) if len(index) else 0
+
+    def append(self, tuple_index, p, q, r, score):
+        records = np.empty(len(score), dtype=RECORD_DTYPE)
+        records['tuple'] = tuple_index
+        records['p'] = p
+        records['q'] = q
+        records['r'] = r
+        records['score'] = score
+
+        self.records_file.parent.mkdir(parents=True, exist_ok=True)
+        index_fd = os.open(self.index_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(index_fd, fcntl.LOCK_EX)
+            # Drop an entry left incomplete by a crashed writer
+            index_size = os.fstat(index_fd).st_size
+            index_size -= index_size % INDEX_DTYPE.itemsize
+            os.ftruncate(index_fd, index_size)
+
+            offset = self.get_number_of_records()
+            records_fd = os.open(self.records_file, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                os.pwrite(records_fd, records.tobytes(), offset * RECORD_DTYPE.itemsize)
+                os.fsync(records_fd)
+            finally:
+                os.close(records_fd)
+
+            entry = np.array([(tuple_index, offset, len(records))], dtype=INDEX_DTYPE)
+            os.pwrite(index_fd, entry.tobytes(), index_size)
+            os.fsync(index_fd)
+        finally:
+            # Closing the index releases the lock
+            os.close(index_fd)
+
+    def read(self):
+        """Map the records of all the indexed tuples (in the order they were appended)."""
+        number_of_records = self.get_number_of_records()
+        if number_of_records == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.memmap(self.records_file, dtype=RECORD_DTYPE, mode='r', shape=(number_of_records,))
+
+    def export_csv(self, filename):
+        """Write the records as `p,q,r,score` lines, tuple after tuple in index order (the per-tuple CSV format)."""
+        index = np.sort(self.read_index(), order='tuple')
+        records = self.read()
+        with open(filename, 'w+') as out_file:
+            for _, offset, count in index:
+                for record in records[offset : offset + count].tolist():
+                    out_file.write(f'{record[1]},{record[2]},{record[3]},{record[4]}\n')
+
+    def clear(self):
+        for file in (self.records_file, self.index_file):
+            if file.exists():
+                file.unlink()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(f'usage: python {sys.argv[0]} <training store (.dat)> <output CSV>')
+        sys.exit(1)
+    TrainingStore(sys.argv[1]).export_csv(sys.argv[2])
@@ -0,0 +1,215 @@
+import sys
+import pathlib
+import numpy as np
+import pytest
+
+SRC_DIR = pathlib.Path(__file__).parent.parent / "src"
+sys.path.append(str(SRC_DIR))
+sys.path.append(str(SRC_DIR / "tester"))
+from tools.swf_generator import generate_jobs
+from policy_engine import (
+    INT_MAX,
+    TASK_FILE,
+    _Cluster,
+    _exchange_sort_order,
+    _selection_order,
+    read_task_file,
+    simulate_policy,
+)
+from tester import run_policy
+
+TESTER_DIR = SRC_DIR / "tester"
+NUMBER_OF_NODES = 32
+NUMBER_OF_TASKS = 80
+SEEDS = [0, 1, 2]
+
+# A cluster whose network is fast enough for the 1000-byte transfer of a job to take a negligible
+# time, so the engine runs without dispatch delay. The master runs on node-0, and the binaries
+# send task i to the worker on node-(i + 1), so the master gets a worker per task (its first
+# argument) besides the number of nodes of the cluster. The task monitor runs on the next node.
+PLATFORM_TEMPLATE = """<?xml version='1.0'?>
+<!DOCTYPE platform SYSTEM "https://simgrid.org/simgrid.dtd">
+<platform version="4.1">
+  <cluster id="cluster" prefix="node-" suffix="" radical="0-{last_node}" speed="1Gf" bw="125GBps" lat="0us"/>
+</platform>
+"""
+DEPLOYMENT_TEMPLATE = """<?xml version='1.0'?>
+<!DOCTYPE platform SYSTEM "https://simgrid.org/simgrid.dtd">
+<platform version="4.1">
+  <process host="node-0" function="master">
+    <argument value="{workers}"/>
+    <argument value="{nodes}"/>
+  </process>
+</platform>
+"""
+
+# (binary, flags, arguments of simulate_policy)
+CONFIGURATIONS = [
+    ("sched-simulator-runtime", [], {}),
+    ("sched-simulator-estimate-backfilling", [], {"estimates": True}),
+    ("sched-simulator-estimate-backfilling", ["-bf"], {"estimates": True, "backfilling": True}),
+    ("sched-simulator-estimate-backfilling", ["-cbf"], {"estimates": True, "conservative": True}),
+]
+POLICIES = ["FCFS", "SPT", "WFP3", "UNICEF", "F2", "LIN", "SEX"]
+
+
+def write_task_file(directory, seed, estimates, coarse):
+    jobs = generate_jobs(NUMBER_OF_TASKS, NUMBER_OF_NODES, mean_interarrival=300, seed=seed)
+    if coarse:
+        # Whole hours, so many jobs of the queue get the same score and the ties are broken as in the binaries
+        for key in ("p", "~p"):
+            jobs[key] = np.maximum(np.round(jobs[key] / 3600), 1).astype(np.int64) * 3600
+        jobs["~p"] = np.maximum(jobs["~p"], jobs["p"])
+    with open(directory / TASK_FILE, "w+") as task_file:
+        for p, q, r, requested in zip(jobs["p"], jobs["q"], jobs["r"] - jobs["r"][0], jobs["~p"]):
+            task_file.write(f"{p},{q},{r},{requested}\n" if estimates else f"{p},{q},{r}\n")
+
+
+@pytest.mark.skipif(
+    not all((TESTER_DIR / binary).exists() for binary, _, _ in CONFIGURATIONS),
+    reason="the tester binaries are not built (make -C src/tester)",
+)
+@pytest.mark.parametrize("coarse", [False, True])
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("policy", POLICIES)
+@pytest.mark.parametrize("binary, flags, arguments", CONFIGURATIONS)
+def test_simulate_policy_matches_binaries(tmp_path, seed, policy, binary, flags, arguments, coarse):
+    platform = tmp_path / "platform.xml"
+    platform.write_text(PLATFORM_TEMPLATE.format(last_node=NUMBER_OF_TASKS + 1))
+    deployment = tmp_path / "deployment.xml"
+    deployment.write_text(DEPLOYMENT_TEMPLATE.format(workers=NUMBER_OF_TASKS, nodes=NUMBER_OF_NODES))
+    write_task_file(tmp_path, seed, arguments.get("estimates", False), coarse)
+
+    policy_flags = [] if policy == "FCFS" else [f"-{policy.lower()}"]
+    command = [TESTER_DIR / binary, platform, deployment, *flags, *policy_flags, "-nt", str(NUMBER_OF_TASKS)]
+    expected = run_policy(command, tmp_path)
+
+    jobs = read_task_file(tmp_path / TASK_FILE, NUMBER_OF_TASKS)
+    slowdown = simulate_policy(jobs, NUMBER_OF_NODES, policy, **arguments)
+    assert float(f"{slowdown:f}") == pytest.approx(expected, rel=1e-4)
+
+
+def selection_loops(scores, highest):
+    # The selection loops of sortTasksQueue, as written in the binaries
+    scores = list(scores)
+    order = []
+    best_index = 0
+    for _ in range(len(scores)):
+        if highest:
+            best = -1e20
+            for j in range(len(scores)):
+                if scores[j] > best:
+                    best = scores[j]
+                    best_index = j
+            scores[best_index] = -1e20
+        else:
+            best = 1e20
+            best_index = 0
+            for j in range(len(scores)):
+                if scores[j] < best:
+                    best = scores[j]
+                    best_index = j
+            scores[best_index] = 1e20
+        order.append(best_index)
+    return order
+
+
+def exchange_sort(keys):
+    # The SJF exchange sort of sortTasksQueue, as written in the binaries
+    keys = list(keys)
+    order = list(range(len(keys)))
+    for i in range(len(keys)):
+        for j in range(len(keys)):
+            if keys[i] < keys[j]:
+                keys[i], keys[j] = keys[j], keys[i]
+                order[i], order[j] = order[j], order[i]
+    return order
+
+
+def scan_shadow_time(curr_time, available_nodes, needed, remaining_time, cores):
+    # scanShadowTime, as written in the binaries: the remaining times are -1 for the finished tasks
+    remaining_time = list(remaining_time)
+    shadow_time, extra_nodes = 0, 0
+    available_nodes_future = 0
+    min_remaining_task = 0
+    for _ in range(len(remaining_time)):
+        min_remaining = INT_MAX
+        for j in range(len(remaining_time)):
+            if remaining_time[j] != -1.0 and remaining_time[j] < min_remaining:
+                min_remaining = int(remaining_time[j])
+                min_remaining_task = j
+        remaining_time[min_remaining_task] = INT_MAX
+        available_nodes_future += cores[min_remaining_task]
+        if available_nodes + available_nodes_future >= needed:
+            shadow_time = (curr_time + min_remaining + 2**31) % 2**32 - 2**31
+            extra_nodes = available_nodes + available_nodes_future - needed
+            break
+    return shadow_time, extra_nodes
+
+
+@pytest.mark.parametrize("highest", [True, False])
+def test_selection_order_matches_selection_loops(highest):
+    rng = np.random.default_rng(0)
+    for case in range(500):
+        size = rng.integers(2, 33)
+        # Few distinct scores, so most queues hold ties
+        scores = rng.integers(0, 5, size).astype(float) * rng.choice([1.0, -1.0])
+        if case % 5 == 0:
+            # Scores beyond the sentinels of the loops
+            scores[rng.integers(0, size)] = rng.choice([1e21, -1e21, np.inf, -np.inf, np.nan])
+        assert _selection_order(scores, highest).tolist() == selection_loops(scores.tolist(), highest)
+
+
+def test_exchange_sort_order_matches_exchange_sort():
+    rng = np.random.default_rng(1)
+    for case in range(500):
+        size = rng.integers(2, 33)
+        high = 1000 if case % 2 else 5
+        keys = rng.integers(1, high, size).astype(float)
+        assert _exchange_sort_order(keys).tolist() == exchange_sort(keys.tolist())
+
+
+def test_shadow_matches_scan_shadow_time():
+    rng = np.random.default_rng(2)
+    for case in range(500):
+        number_dispatched = int(rng.integers(1, 40))
+        number_of_jobs = number_dispatched + 1
+        jobs = {
+            "p": rng.integers(1, 5000, number_of_jobs).astype(float),
+            "~p": rng.integers(1, 5000, number_of_jobs).astype(float),
+            "q": rng.integers(1, 9, number_of_jobs),
+            "r": np.zeros(number_of_jobs, dtype=np.int64),
+        }
+        cluster = _Cluster(jobs, 64, "FCFS", True, True, False, None, 0.0)
+        cluster.order = rng.permutation(number_of_jobs)
+        curr_time = int(rng.integers(5000, 10000))
+        # Running jobs, some of them past their requested time, and finished ones
+        cluster.running = sorted(rng.choice(number_dispatched, int(rng.integers(0, number_dispatched + 1)), False))
+        if case % 2:
+            cluster.start[cluster.order[:number_dispatched]] = rng.uniform(0, curr_time, number_dispatched)
+        elif case % 4 == 2:
+            # Remaining times within a few seconds of zero, some past the requested time by a fraction of a
+            # second and some of exactly -1
+            dispatched = cluster.order[:number_dispatched]
+            cluster.start[dispatched] = curr_time - rng.integers(0, 100, number_dispatched)
+            offsets = rng.choice([-1.0, -0.75, -0.5, -0.25, 0.0, 0.25, 0.5, 1.0, 1.5], number_dispatched)
+            cluster.requested[dispatched] = curr_time - cluster.start[dispatched] + offsets
+        else:
+            # Times on a coarse grid, so many jobs have the same remaining time
+            dispatched = cluster.order[:number_dispatched]
+            elapsed_steps = rng.integers(0, 50, number_dispatched)
+            cluster.start[dispatched] = curr_time - 100 * elapsed_steps
+            cluster.requested[dispatched] = 100 * (elapsed_steps + rng.integers(0, 10, number_dispatched))
+            if case % 8 == 0:
+                cluster.requested[dispatched[0]] = 1.0
+        cluster.free_nodes = int(rng.integers(0, 8))
+        needed = int(rng.integers(1, 40))
+
+        remaining = np.full(number_dispatched, -1.0)
+        for position in cluster.running:
+            job = cluster.order[position]
+            elapsed = float(np.float32(curr_time - cluster.start[job]))
+            remaining[position] = cluster.requested[job] - elapsed
+        cores = cluster.cores[cluster.order[:number_dispatched]]
+        expected = scan_shadow_time(curr_time, cluster.free_nodes, needed, remaining.tolist(), cores.tolist())
+        assert cluster.shadow(curr_time, number_dispatched, needed) == expected
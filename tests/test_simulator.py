@@ -0,0 +1,121 @@
+import sys
+import pathlib
+import numpy as np
+import pytest
+
+SRC_DIR = pathlib.Path(__file__).parent.parent / "src"
+sys.path.append(str(SRC_DIR))
+sys.path.append(str(SRC_DIR / "simulator"))
+from tools.swf_generator import generate_swf, write_deployment
+from tools.training_store import TrainingStore
+from simulator import Simulator
+from score_accumulator import ScoreAccumulator
+
+NUMBER_OF_NODES = 64
+SIZE_OF_S = 16
+SIZE_OF_Q = 32
+NUMBER_OF_TRIALS = 256
+BATCH_SIZE = 64
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    workload = tmp_path / "workload.swf"
+    generate_swf(workload, 500, NUMBER_OF_NODES, seed=0)
+    deployment = tmp_path / "deployment.xml"
+    write_deployment(deployment, NUMBER_OF_NODES)
+    return workload, deployment
+
+
+def make_simulator(inputs, directory, **arguments):
+    workload, deployment = inputs
+    simulator = Simulator(
+        workload,
+        deployment,
+        None,
+        1,
+        arguments.pop("number_of_trials", NUMBER_OF_TRIALS),
+        SIZE_OF_S,
+        SIZE_OF_Q,
+        True,
+        engine="python",
+        batch_size=BATCH_SIZE,
+        **arguments,
+    )
+    simulator.use_output_dir(directory)
+    simulator.use_scratch_dir(directory)
+    return simulator
+
+
+def read_scores(simulator):
+    return np.array(TrainingStore(simulator._training_store_file).read()["score"])
+
+
+@pytest.mark.parametrize("sampling", ["uniform", "stratified"])
+def test_resumed_tuple_matches_uninterrupted_tuple(inputs, tmp_path, sampling):
+    uninterrupted = make_simulator(inputs, tmp_path / "uninterrupted", sampling=sampling)
+    uninterrupted.simulate_tuple(0)
+
+    # Interrupted once every block is checkpointed, before the scores are stored
+    interrupted = make_simulator(inputs, tmp_path / "interrupted", sampling=sampling)
+
+    def interrupt(index, score_dist):
+        raise Interrupted
+
+    interrupted.save_score_distribution = interrupt
+    with pytest.raises(Interrupted):
+        interrupted.simulate_tuple(0)
+    assert interrupted.get_checkpoint_file(0).exists()
+
+    # The resumed tuple has no block left to schedule
+    resumed = make_simulator(inputs, tmp_path / "interrupted", sampling=sampling)
+    assert resumed.simulate_tuple(0)["trials"] == 0
+    assert not resumed.get_checkpoint_file(0).exists()
+    np.testing.assert_array_equal(read_scores(resumed), read_scores(uninterrupted))
+
+
+def test_tuple_without_checkpoint_is_stored(inputs, tmp_path):
+    simulator = make_simulator(inputs, tmp_path)
+    simulator.save_checkpoint = lambda index, next_block: None
+    simulator.simulate_tuple(0)
+
+    assert TrainingStore(simulator._training_store_file).get_tuple_indexes() == {0}
+    assert not simulator.get_checkpoint_file(0).exists()
+
+
+@pytest.mark.parametrize("number_of_trials", [SIZE_OF_Q // 2, SIZE_OF_Q + 1])
+def test_stratified_sampling_needs_trials_for_every_first_choice(inputs, tmp_path, number_of_trials):
+    with pytest.raises(ValueError):
+        make_simulator(inputs, tmp_path, number_of_trials=number_of_trials, sampling="stratified")
+
+
+def test_stratified_accumulator_waits_for_every_stratum():
+    accumulator = ScoreAccumulator(4, stratified=True)
+    # Identical slowdowns give zero-width intervals, but the last stratum has no trials
+    accumulator.add([0, 0, 1, 1, 2, 2], [2.0] * 6)
+    assert not accumulator.has_converged(tolerance=1.0)
+    with pytest.raises(ValueError):
+        accumulator.score_distribution(6)
+
+    accumulator.add([3, 3], [2.0, 2.0])
+    assert accumulator.has_converged(tolerance=1.0)
+    np.testing.assert_allclose(accumulator.score_distribution(8), [0.25] * 4)
+
+
+def interrupt(self, index, score_dist):
+    raise Interrupted
+
+
+def test_failed_parallel_run_removes_the_scratch_directories(inputs, tmp_path, monkeypatch):
+    simulator = make_simulator(inputs, tmp_path)
+    monkeypatch.setattr(Simulator, "_scratch_path", tmp_path / "scratch")
+    monkeypatch.setattr(Simulator, "_metrics_file", tmp_path / "simulation-metrics.jsonl")
+    # The workers fail once the tuple is simulated
+    monkeypatch.setattr(Simulator, "save_score_distribution", interrupt)
+    with pytest.raises(Interrupted):
+        simulator.simulate(workers=2)
+    assert not (tmp_path / "scratch").exists()
@@ -0,0 +1,127 @@
+import io
+import sys
+import pathlib
+import subprocess
+import numpy as np
+import pytest
+
+SRC_DIR = pathlib.Path(__file__).parent.parent / "src"
+sys.path.append(str(SRC_DIR))
+sys.path.append(str(SRC_DIR / "simulator"))
+from tools.swf_generator import generate_jobs
+from trials_engine import _dispatch, initial_state, post_S_state, simulate_trials
+
+TRIALS_SIMULATOR = SRC_DIR / "simulator" / "trials_simulator"
+# The sizes of S and Q compiled in trials_simulator.c
+SIZE_OF_S = 16
+SIZE_OF_Q = 32
+# trials_simulator sends job i to the worker on node-(i + 1), so the master needs at least S + Q workers
+NUMBER_OF_NODES = 64
+NUMBER_OF_TRIALS = 64
+SEEDS = [0, 1, 2]
+
+# A cluster whose network is fast enough for the 1000-byte transfer of a job to take a negligible
+# time, so the engine runs without dispatch delay. The master runs on node-0 and the task
+# managers on the next nodes.
+PLATFORM_TEMPLATE = """<?xml version='1.0'?>
+<!DOCTYPE platform SYSTEM "https://simgrid.org/simgrid.dtd">
+<platform version="4.1">
+  <cluster id="cluster" prefix="node-" suffix="" radical="0-{last_node}" speed="1Gf" bw="125GBps" lat="0us"/>
+</platform>
+"""
+DEPLOYMENT_TEMPLATE = """<?xml version='1.0'?>
+<!DOCTYPE platform SYSTEM "https://simgrid.org/simgrid.dtd">
+<platform version="4.1">
+  <process host="node-0" function="master">
+    <argument value="{nodes}"/>
+  </process>
+</platform>
+"""
+
+# A hand-worked schedule on 4 nodes: S0 takes nodes 0-1 from 0 to 10, S1 node 2 from 2 to 7,
+# S2 waits for S0 and takes nodes 0-2 from 10 to 14, S3 takes node 3 from 12 to 18
+JOBS_S = {"p": [10, 5, 4, 6], "q": [2, 1, 3, 1], "r": [0, 2, 3, 12]}
+JOBS_Q = {"p": [20, 1], "q": [4, 1], "r": [13, 13]}
+# Q0 then Q1: Q0 waits for S3 and runs from 18 to 38 (slowdown 1.25), Q1 waits for Q0 (2.6).
+# Q1 then Q0: Q1 runs on node 0 from 14 (bounded to 1), Q0 still waits for S3 (1.25).
+PERMUTATIONS = [[0, 1], [1, 0]]
+SLOWDOWNS = [(1.25 + 2.6) / 2, (1.0 + 1.25) / 2]
+
+
+def write_inputs(directory, seed):
+    jobs = generate_jobs(SIZE_OF_S + SIZE_OF_Q, NUMBER_OF_NODES, mean_interarrival=300, seed=seed)
+    jobs["r"] -= jobs["r"][0]
+    with open(directory / "current-simulation.csv", "w+") as tuple_file:
+        for p, q, r in zip(jobs["p"], jobs["q"], jobs["r"]):
+            tuple_file.write(f"{p},{q},{r}\n")
+    (directory / "platform.xml").write_text(PLATFORM_TEMPLATE.format(last_node=SIZE_OF_S + SIZE_OF_Q + NUMBER_OF_NODES))
+    (directory / "deployment.xml").write_text(DEPLOYMENT_TEMPLATE.format(nodes=NUMBER_OF_NODES))
+    jobs_S = {key: jobs[key][:SIZE_OF_S] for key in ("p", "q", "r")}
+    jobs_Q = {key: jobs[key][SIZE_OF_S:] for key in ("p", "q", "r")}
+    return jobs_S, jobs_Q
+
+
+def run_trials_simulator(directory, *arguments, stdin=None):
+    command = [TRIALS_SIMULATOR, directory / "platform.xml", directory / "deployment.xml", *arguments]
+    return subprocess.run(command, input=stdin, stdout=subprocess.PIPE, text=True, cwd=directory, check=True).stdout
+
+
+binary_required = pytest.mark.skipif(
+    not TRIALS_SIMULATOR.exists(), reason="trials_simulator is not built (make -C src/simulator)"
+)
+
+
+@binary_required
+@pytest.mark.parametrize("seed", SEEDS)
+def test_simulate_trials_matches_batch_mode(tmp_path, seed):
+    jobs_S, jobs_Q = write_inputs(tmp_path, seed)
+    identity = np.broadcast_to(np.arange(SIZE_OF_Q), (NUMBER_OF_TRIALS, SIZE_OF_Q))
+    permutations = np.random.default_rng(seed).permuted(identity, axis=1)
+
+    batch = io.StringIO()
+    np.savetxt(batch, permutations, fmt="%d", delimiter=",")
+    output = run_trials_simulator(tmp_path, "-batch", "-", stdin=batch.getvalue())
+    expected = np.loadtxt(io.StringIO(output), ndmin=1)
+
+    slowdowns = simulate_trials(jobs_S, jobs_Q, permutations, NUMBER_OF_NODES)
+    np.testing.assert_allclose(np.round(slowdowns, 6), expected, rtol=1e-4)
+
+
+@binary_required
+@pytest.mark.parametrize("seed", SEEDS)
+def test_initial_state_matches_state_mode(tmp_path, seed):
+    jobs_S, _ = write_inputs(tmp_path, seed)
+    expected = np.loadtxt(io.StringIO(run_trials_simulator(tmp_path, "-state")), delimiter=",")
+    np.testing.assert_allclose(initial_state(jobs_S, NUMBER_OF_NODES), expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("dispatch_delay", [0.0, 0.5])
+def test_dispatch_waits_for_submit_and_nodes(dispatch_delay):
+    # Trial 0 waits for its submit time, then for the completion at 3 to get two nodes;
+    # trial 1 starts at its clock on all the nodes
+    clock = np.array([0.0, 5.0])
+    busy_until = np.array([[3.0, 0.0, 8.0], [0.0, 0.0, 0.0]])
+    start, allocation = _dispatch(
+        clock, busy_until, np.array([2.0, 2.0]), np.array([2, 3]), np.array([1.0, 1.0]), dispatch_delay
+    )
+
+    np.testing.assert_array_equal(start, [3.0 + dispatch_delay, 5.0 + dispatch_delay])
+    np.testing.assert_array_equal(allocation, [[True, True, False], [True, True, True]])
+    np.testing.assert_array_equal(clock, start)
+    end = start + 2.0
+    np.testing.assert_array_equal(busy_until, [[end[0], end[0], 8.0], [end[1], end[1], end[1]]])
+
+
+def test_initial_state_of_hand_worked_schedule():
+    # S3 is the last S job (0.01), S2 has run for 2 seconds on nodes 0-2
+    np.testing.assert_array_equal(initial_state(JOBS_S, 4), [2.0, 2.0, 2.0, 0.01])
+
+    busy_until, clock = post_S_state(JOBS_S, 4)
+    np.testing.assert_array_equal(busy_until, [14.0, 14.0, 14.0, 18.0])
+    assert clock == 12.0
+
+
+@pytest.mark.parametrize("block_size", [1, 2])
+def test_simulate_trials_of_hand_worked_schedule(block_size):
+    slowdowns = simulate_trials(JOBS_S, JOBS_Q, PERMUTATIONS, 4, block_size=block_size)
+    np.testing.assert_allclose(slowdowns, SLOWDOWNS)